@@ -0,0 +1,109 @@
+"""
+Decoding speed of the attention beam search, as real time factor (decoding time
+over audio duration, 10ms frames) per beam width, with and without the incremental
+decoder cache.
+
+Example:
+    python3 benchmark_decode.py -m egs/aishell/exp/transformer_baseline/model.average.from70to79.pt \\
+        -bws 1 2 5 10 -nu 200
+"""
+import os
+import time
+import yaml
+import logging
+import argparse
+import oneflow as flow
+from otrans.model import End2EndModel
+from otrans.recognize import SpeechToTextRecognizer
+from otrans.data.loader import FeatureLoader
+from otrans.train.utils import map_to_cuda
+
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+
+def load_model(args, params):
+    model = End2EndModel[params["model"]["type"]](params["model"])
+    for name in ["frontend", "encoder", "decoder"]:
+        getattr(model, name).load_state_dict(
+            flow.load(os.path.join(args.load_model, "%s.pt" % name))
+        )
+    model.eval()
+    if args.ngpu > 0:
+        model.cuda()
+    return model
+
+
+def decode_time(recognizer, utterances):
+    total_time = 0
+    for enc_inputs, enc_mask in utterances:
+        st = time.time()
+        recognizer.recognize(enc_inputs, enc_mask)
+        total_time += time.time() - st
+    return total_time
+
+
+def main(args):
+    if args.config is not None:
+        path = args.config
+    else:
+        path = os.path.join(args.load_model, "../" "config.yaml")
+    with open(path, "r") as f:
+        params = yaml.load(f, Loader=yaml.FullLoader)
+    assert params["model"]["type"] == "speech2text"
+    params["data"]["batch_size"] = 1
+
+    model = load_model(args, params)
+    data_loader = FeatureLoader(params, args.decode_set, is_eval=True)
+
+    utterances = []
+    total_frames = 0
+    for _, inputs, _ in data_loader.loader:
+        if args.ngpu > 0:
+            inputs = map_to_cuda(inputs)
+        utterances.append((inputs["inputs"], inputs["mask"]))
+        total_frames += inputs["inputs"].size(1)
+        if len(utterances) == args.num_utts:
+            break
+    logger.info(
+        "Decode %d utterances (%.1f seconds)" % (len(utterances), total_frames / 100)
+    )
+
+    print("%10s %12s %12s %8s" % ("beam_width", "rtf_no_cache", "rtf_cache", "speedup"))
+    for beam_width in args.beam_widths:
+        rtfs = []
+        for apply_cache in [False, True]:
+            recognizer = SpeechToTextRecognizer(
+                model,
+                beam_width=beam_width,
+                max_len=args.max_len,
+                idx2unit=data_loader.dataset.idx2unit,
+                penalty=args.penalty,
+                lamda=args.lamda,
+                ngpu=args.ngpu,
+                apply_cache=apply_cache,
+            )
+            # warm up
+            decode_time(recognizer, utterances[:1])
+            rtfs.append(decode_time(recognizer, utterances) / total_frames * 100)
+        print(
+            "%10d %12.6f %12.6f %7.2fx"
+            % (beam_width, rtfs[0], rtfs[1], rtfs[0] / rtfs[1])
+        )
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-c", "--config", type=str, default=None)
+parser.add_argument("-n", "--ngpu", type=int, default=1)
+parser.add_argument("-m", "--load_model", type=str, default=None)
+parser.add_argument("-d", "--decode_set", type=str, default="test")
+parser.add_argument("-bws", "--beam_widths", type=int, nargs="+", default=[1, 5, 10])
+parser.add_argument("-nu", "--num_utts", type=int, default=100)
+parser.add_argument("-ml", "--max_len", type=int, default=60)
+parser.add_argument("-pn", "--penalty", type=float, default=0.6)
+parser.add_argument("-ld", "--lamda", type=float, default=5)
+cmd_args = parser.parse_args()
+
+main(cmd_args)
@@ -109,6 +109,10 @@ def main(args):
         decoder_folder_name.append("%s_%.2f" % (lm_type, args.lm_weight))
     if args.ctc_weight > 0.0:
         decoder_folder_name.append("ctc_weight_%.3f" % args.ctc_weight)
+    if args.streaming:
+        decoder_folder_name.append(
+            "streaming_%d_%d_%d" % (args.chunk_size, args.lookahead, args.left_context)
+        )
     if args.ngram_lm is not None:
         decoder_folder_name.append("ngram_alpha%.2f_beta%.2f" % (args.alpha, args.beta))
     if args.apply_rescoring:
@@ -255,6 +259,11 @@ parser.add_argument("-md", "--mode", type=str, default="beam")
 # transducer related
 parser.add_argument("-mt", "--max_tokens_per_chunk", type=int, default=5)
 parser.add_argument("-pf", "--path_fusion", action="store_true", default=False)
+# streaming ctc related, in encoder steps
+parser.add_argument("-st", "--streaming", action="store_true", default=False)
+parser.add_argument("-cs", "--chunk_size", type=int, default=16)
+parser.add_argument("-la", "--lookahead", type=int, default=4)
+parser.add_argument("-lc", "--left_context", type=int, default=64)
 parser.add_argument("-s", "--suffix", type=str, default=None)
 parser.add_argument("-p2w", "--piece2word", action="store_true", default=False)
 parser.add_argument("-resc", "--apply_rescoring", action="store_true", default=False)
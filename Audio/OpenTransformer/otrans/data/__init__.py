@@ -0,0 +1,10 @@
+PAD = 0
+BOS = 1
+EOS = 1
+UNK = 2
+BLK = 0
+
+PAD_TOKEN = "<PAD>"
+BOS_TOKEN = "<S/E>"
+EOS_TOKEN = "<S/E>"
+UNK_TOKEN = "<UNK>"
@@ -0,0 +1,193 @@
+import os
+import wave
+import logging
+import numpy as np
+from otrans.data import UNK
+from otrans.data.kaldi import ArkReader, read_scp
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_vocab(path):
+    unit2idx = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) == 2:
+                unit2idx[parts[0]] = int(parts[1])
+    idx2unit = {i: u for u, i in unit2idx.items()}
+    return unit2idx, idx2unit
+
+
+def read_text(files):
+    texts = {}
+    for path in files:
+        for utt_id, text in read_scp(path):
+            texts[utt_id] = text
+    return texts
+
+
+def spec_augment(
+    features,
+    rng,
+    freq_mask_num=2,
+    time_mask_num=2,
+    freq_mask_rate=0.3,
+    time_mask_rate=0.05,
+):
+    """Masks random bands of channels and steps with zeros, on a copy."""
+    features = np.array(features, dtype=np.float32)
+    time_step, num_bins = features.shape
+    for _ in range(freq_mask_num):
+        width = rng.randint(0, int(num_bins * freq_mask_rate) + 1)
+        start = rng.randint(0, num_bins - width + 1)
+        features[:, start : start + width] = 0.0
+    for _ in range(time_mask_num):
+        width = rng.randint(0, int(time_step * time_mask_rate) + 1)
+        start = rng.randint(0, time_step - width + 1)
+        features[start : start + width, :] = 0.0
+    return features
+
+
+class AudioDataset(object):
+    """Utterances of a split, their features and transcripts.
+
+    ``dataset_type`` is where the features come from:
+        kaldi: ``feat`` are kaldi ``feats.scp`` files, read from the ark files through
+            memory maps
+        npy: ``feat`` are scp files mapping every utterance to a (time, dim) ``.npy``
+            file, opened memory-mapped
+        online: ``feat`` are ``wav.scp`` files of 16 bit PCM wavs, log mel filter banks
+            are computed on the fly with python_speech_features
+    The number of frames of every utterance is read once from the headers (or from an
+    ``utt2num_frames`` file next to the scp) to bucket them by length.
+    """
+
+    def __init__(self, params, name, is_eval=False):
+        self.params = params
+        self.name = name
+        self.is_eval = is_eval
+        self.dataset_type = params["dataset_type"]
+        if self.dataset_type not in ("kaldi", "npy", "online"):
+            raise ValueError(
+                "dataset_type must be one of kaldi, npy, online or text, got %s"
+                % self.dataset_type
+            )
+
+        self.unit2idx, self.idx2unit = load_vocab(params["vocab"])
+        self.normalization = params.get("normalization", False)
+        self.apply_spec_augment = params.get("spec_augment", False) and not is_eval
+        self.spec_augment_config = params.get("spec_augment_config", {})
+        self.num_mel_bins = params.get("num_mel_bins", 40)
+        for option in ("speed_perturb", "volume_perturb"):
+            if params.get(option, False):
+                logger.warning("%s is not supported and ignored." % option)
+
+        texts = read_text(params[name]["text"])
+        self.ark_reader = ArkReader()
+        self.utt_ids, self.locations, num_frames = [], [], []
+        for scp in params[name]["feat"]:
+            utt2num_frames = self._read_utt2num_frames(scp)
+            for utt_id, location in read_scp(scp):
+                if utt_id not in texts:
+                    continue
+                self.utt_ids.append(utt_id)
+                self.locations.append(location)
+                if utt_id in utt2num_frames:
+                    num_frames.append(utt2num_frames[utt_id])
+                else:
+                    num_frames.append(self._num_frames(location))
+        self.lengths = np.array(num_frames, dtype=np.int64)
+        self.targets = [self.encode(texts[utt_id]) for utt_id in self.utt_ids]
+        logger.info(
+            "Load %d utterances (%.1f hours) of %s"
+            % (len(self.utt_ids), self.lengths.sum() / 360000.0, name)
+        )
+
+    def _read_utt2num_frames(self, scp):
+        path = os.path.join(os.path.dirname(scp), "utt2num_frames")
+        if not os.path.exists(path):
+            return {}
+        return {utt_id: int(n) for utt_id, n in read_scp(path)}
+
+    def _num_frames(self, location):
+        if self.dataset_type == "kaldi":
+            return self.ark_reader.num_frames(location)
+        elif self.dataset_type == "npy":
+            return np.load(location, mmap_mode="r").shape[0]
+        else:
+            # 25ms windows every 10ms
+            with wave.open(location, "rb") as w:
+                rate = w.getframerate()
+                return max(1 + (w.getnframes() - rate // 40) // (rate // 100), 0)
+
+    def encode(self, text):
+        return [self.unit2idx.get(unit, UNK) for unit in text.split()]
+
+    def __len__(self):
+        return len(self.utt_ids)
+
+    def read_features(self, index):
+        location = self.locations[index]
+        if self.dataset_type == "kaldi":
+            return self.ark_reader.read(location)
+        elif self.dataset_type == "npy":
+            return np.load(location, mmap_mode="r")
+        else:
+            from python_speech_features import logfbank
+
+            with wave.open(location, "rb") as w:
+                rate = w.getframerate()
+                signal = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+            return logfbank(signal, samplerate=rate, nfilt=self.num_mel_bins)
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def get(self, index, rng=None):
+        """Returns the utterance id, the (time, dim) float32 features and the target
+        token ids. ``rng`` draws the SpecAugment masks when training."""
+        features = self.read_features(index)
+        if self.normalization:
+            features = (features - features.mean(axis=0)) / (
+                features.std(axis=0) + 1e-5
+            )
+        if self.apply_spec_augment:
+            rng = np.random if rng is None else rng
+            features = spec_augment(features, rng, **self.spec_augment_config)
+        return (
+            self.utt_ids[index],
+            np.asarray(features, dtype=np.float32),
+            self.targets[index],
+        )
+
+
+class TextDataset(object):
+    """Transcripts of a split to train language models, lengths are in tokens."""
+
+    def __init__(self, params, name, is_eval=False):
+        self.params = params
+        self.name = name
+        self.is_eval = is_eval
+        self.unit2idx, self.idx2unit = load_vocab(params["vocab"])
+
+        files = params[name]["text"] if "text" in params[name] else params[name]["tgt"]
+        texts = []
+        for path in files:
+            texts.extend(read_scp(path))
+        self.utt_ids = [utt_id for utt_id, _ in texts]
+        self.targets = [
+            [self.unit2idx.get(unit, UNK) for unit in text.split()] for _, text in texts
+        ]
+        self.lengths = np.array([len(t) + 1 for t in self.targets], dtype=np.int64)
+        logger.info("Load %d sentences of %s" % (len(self.utt_ids), name))
+
+    def __len__(self):
+        return len(self.utt_ids)
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def get(self, index, rng=None):
+        return self.utt_ids[index], None, self.targets[index]
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def read_scp(path):
+    """Returns the (key, value) pairs of a kaldi scp (or text) file, in order."""
+    pairs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2:
+                pairs.append((parts[0], parts[1]))
+    return pairs
+
+
+def _char_to_float(headers, data):
+    """Decompresses the columns of a kaldi "CM" matrix, see CompressedMatrix::CharToFloat."""
+    p0, p25, p75, p100 = [headers[:, i : i + 1] for i in range(4)]
+    data = data.astype(np.float32)
+    return np.where(
+        data <= 64,
+        p0 + (p25 - p0) * data / 64.0,
+        np.where(
+            data <= 192,
+            p25 + (p75 - p25) * (data - 64.0) / 128.0,
+            p75 + (p100 - p75) * (data - 192.0) / 63.0,
+        ),
+    )
+
+
+class ArkReader(object):
+    """Reads matrices from kaldi binary ark files through memory maps.
+
+    Locations are ``path:offset`` as found in ``feats.scp``. Float and double matrices
+    are returned without copying the data, compressed ones ("CM", "CM2", "CM3") are
+    decompressed. Every ark file is mapped once and shared by all threads.
+    """
+
+    def __init__(self):
+        self._maps = {}
+
+    def _map(self, path):
+        if path not in self._maps:
+            self._maps[path] = np.memmap(path, dtype=np.uint8, mode="r")
+        return self._maps[path]
+
+    def _header(self, location):
+        path, offset = location.rsplit(":", 1)
+        buf = self._map(path)
+        offset = int(offset)
+        if bytes(buf[offset : offset + 2]) != b"\0B":
+            raise ValueError("%s is not a binary kaldi matrix" % location)
+        kind = bytes(buf[offset + 2 : offset + 5]).decode()
+        pos = offset + 5
+        if kind in ("FM ", "DM "):
+            # each int32 is preceded by its size
+            rows = int(np.frombuffer(buf, np.int32, 1, pos + 1)[0])
+            cols = int(np.frombuffer(buf, np.int32, 1, pos + 6)[0])
+            return buf, kind, rows, cols, pos + 10
+        elif kind in ("CM ", "CM2", "CM3"):
+            rows = int(np.frombuffer(buf, np.int32, 1, pos + 8)[0])
+            cols = int(np.frombuffer(buf, np.int32, 1, pos + 12)[0])
+            return buf, kind, rows, cols, pos
+        else:
+            raise ValueError(
+                "unsupported kaldi matrix type %s at %s" % (kind, location)
+            )
+
+    def num_frames(self, location):
+        return self._header(location)[2]
+
+    def read(self, location):
+        buf, kind, rows, cols, pos = self._header(location)
+        if kind == "FM ":
+            return np.frombuffer(buf, np.float32, rows * cols, pos).reshape(rows, cols)
+        if kind == "DM ":
+            data = np.frombuffer(buf, np.float64, rows * cols, pos)
+            return data.reshape(rows, cols).astype(np.float32)
+
+        min_value, value_range = np.frombuffer(buf, np.float32, 2, pos)
+        pos += 16
+        if kind == "CM2":
+            data = np.frombuffer(buf, np.uint16, rows * cols, pos).reshape(rows, cols)
+            return min_value + value_range / 65535.0 * data.astype(np.float32)
+        if kind == "CM3":
+            data = np.frombuffer(buf, np.uint8, rows * cols, pos).reshape(rows, cols)
+            return min_value + value_range / 255.0 * data.astype(np.float32)
+
+        # one header of 4 uint16 percentiles per column, then the columns
+        headers = np.frombuffer(buf, np.uint16, 4 * cols, pos).reshape(cols, 4)
+        headers = min_value + value_range / 65535.0 * headers.astype(np.float32)
+        data = np.frombuffer(buf, np.uint8, rows * cols, pos + 8 * cols)
+        columns = _char_to_float(headers, data.reshape(cols, rows))
+        return np.ascontiguousarray(columns.T, dtype=np.float32)
@@ -0,0 +1,205 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import oneflow as flow
+from otrans.data import PAD, BOS, EOS
+from otrans.data.dataset import AudioDataset, TextDataset
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_batches(lengths, batch_size, max_frames=0, rng=None, pool_size=0):
+    """Groups the indices of ``lengths`` into batches of similar lengths.
+
+    Without ``rng`` the order is kept and batches hold ``batch_size`` samples. With it,
+    the samples are shuffled, sorted by length within pools of ``pool_size`` (the
+    whole set by default) and the batches are shuffled. A batch holds ``batch_size``
+    samples, or with ``max_frames`` as many as fit in ``max_frames`` padded frames.
+    """
+    if rng is None:
+        order = np.arange(len(lengths))
+    else:
+        order = rng.permutation(len(lengths))
+        pool_size = pool_size if pool_size > 0 else len(lengths)
+        order = np.concatenate(
+            [
+                pool[np.argsort(lengths[pool], kind="stable")]
+                for pool in np.split(order, range(pool_size, len(order), pool_size))
+            ]
+        )
+
+    batches = []
+    if max_frames > 0:
+        batch, longest = [], 0
+        for index in order.tolist():
+            longest_with = max(longest, int(lengths[index]))
+            if len(batch) > 0 and longest_with * (len(batch) + 1) > max_frames:
+                batches.append(batch)
+                batch, longest_with = [], int(lengths[index])
+            batch.append(index)
+            longest = longest_with
+        if len(batch) > 0:
+            batches.append(batch)
+    else:
+        batches = [
+            order[i : i + batch_size].tolist() for i in range(0, len(order), batch_size)
+        ]
+
+    if rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+
+def collate_audio(samples):
+    utt_ids = [utt_id for utt_id, _, _ in samples]
+    max_frames = max(feats.shape[0] for _, feats, _ in samples)
+    feat_dim = samples[0][1].shape[1]
+    inputs = np.zeros((len(samples), max_frames, feat_dim), dtype=np.float32)
+    mask = np.zeros((len(samples), max_frames), dtype=np.int32)
+    for b, (_, feats, _) in enumerate(samples):
+        inputs[b, : feats.shape[0]] = feats
+        mask[b, : feats.shape[0]] = 1
+
+    targets, targets_length = pad_targets([t for _, _, t in samples])
+    return (
+        utt_ids,
+        {"inputs": inputs, "mask": mask},
+        {"targets": targets, "targets_length": targets_length},
+    )
+
+
+def collate_text(samples):
+    utt_ids = [utt_id for utt_id, _, _ in samples]
+    targets, targets_length = pad_targets([t for _, _, t in samples])
+    inputs = targets[:, :-1].copy()
+    mask = (np.arange(inputs.shape[1])[None] < targets_length[:, None]).astype(np.int32)
+    return (
+        utt_ids,
+        {"inputs": inputs, "mask": mask},
+        {"targets": targets[:, 1:].copy(), "targets_length": targets_length},
+    )
+
+
+def pad_targets(targets):
+    """[BOS] + tokens + [EOS] padded with PAD, the length counts the tokens and EOS."""
+    max_length = max(len(t) for t in targets) + 2
+    padded = np.full((len(targets), max_length), PAD, dtype=np.int64)
+    for b, t in enumerate(targets):
+        padded[b, : len(t) + 2] = [BOS] + t + [EOS]
+    lengths = np.array([len(t) + 1 for t in targets], dtype=np.int64)
+    return padded, lengths
+
+
+def to_tensors(batch):
+    utt_ids, inputs, targets = batch
+    return (
+        utt_ids,
+        {key: flow.tensor(value) for key, value in inputs.items()},
+        {key: flow.tensor(value) for key, value in targets.items()},
+    )
+
+
+class BatchIterator(object):
+    """The batches of an epoch, read and collated by a pool of threads ahead of use."""
+
+    def __init__(self, dataset, batches, collate, num_workers=0, seed=0):
+        self.dataset = dataset
+        self.batches = batches
+        self.collate = collate
+        self.num_workers = num_workers
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.batches)
+
+    def read(self, i):
+        rng = np.random.RandomState([self.seed, i])
+        return self.collate([self.dataset.get(index, rng) for index in self.batches[i]])
+
+    def __iter__(self):
+        if self.num_workers <= 0:
+            for i in range(len(self.batches)):
+                yield to_tensors(self.read(i))
+            return
+
+        prefetch = 2 * self.num_workers
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            pending = deque(
+                executor.submit(self.read, i)
+                for i in range(min(prefetch, len(self.batches)))
+            )
+            for i in range(len(self.batches)):
+                batch = pending.popleft().result()
+                if i + prefetch < len(self.batches):
+                    pending.append(executor.submit(self.read, i + prefetch))
+                yield to_tensors(batch)
+
+
+class FeatureLoader(object):
+    """Batches of a split of ``params["data"]``.
+
+    Training batches are bucketed by length: with ``max_frames_per_batch`` in the data
+    params every batch holds about that many padded frames (tokens for text),
+    otherwise ``batch_size`` utterances of similar lengths. They are reshuffled every
+    epoch (``set_epoch``) and, when training on several devices, dealt out to the
+    ranks, every rank getting the same number of batches. Evaluation batches keep the
+    order of the split.
+
+    ``loader`` iterates over ``(utt_ids, inputs, targets)`` where inputs holds
+    "inputs" and "mask" and targets holds "targets" and "targets_length".
+    """
+
+    def __init__(self, params, name, ngpu=1, is_eval=False):
+        self.params = params["data"]
+        self.name = name
+        self.is_eval = is_eval
+
+        if self.params["dataset_type"] == "text":
+            self.dataset = TextDataset(self.params, name, is_eval)
+            self.collate = collate_text
+        else:
+            self.dataset = AudioDataset(self.params, name, is_eval)
+            self.collate = collate_audio
+
+        self.batch_size = self.params["batch_size"]
+        self.max_frames = 0 if is_eval else self.params.get("max_frames_per_batch", 0)
+        self.pool_size = self.params.get("bucket_pool_size", 0)
+        self.num_workers = self.params.get("num_workers", 0)
+        self.seed = self.params.get("seed", 1234)
+        self.epoch = 0
+
+        if ngpu > 1 and not is_eval:
+            self.rank = flow.env.get_rank()
+            self.world_size = flow.env.get_world_size()
+        else:
+            self.rank, self.world_size = 0, 1
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    @property
+    def loader(self):
+        if self.is_eval:
+            batches = make_batches(self.dataset.lengths, self.batch_size)
+        else:
+            # every rank draws the same batches and keeps its share of them
+            rng = np.random.RandomState([self.seed, self.epoch])
+            batches = make_batches(
+                self.dataset.lengths,
+                self.batch_size,
+                self.max_frames,
+                rng,
+                self.pool_size,
+            )
+            num_batches = len(batches) // self.world_size * self.world_size
+            batches = batches[self.rank : num_batches : self.world_size]
+
+        return BatchIterator(
+            self.dataset,
+            batches,
+            self.collate,
+            self.num_workers,
+            seed=self.seed + self.epoch * self.world_size + self.rank,
+        )
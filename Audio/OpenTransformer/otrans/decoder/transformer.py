@@ -115,25 +115,30 @@ class TransformerDecoderLayer(nn.Module):
         )
 
     def inference(
-        self,
-        x,
-        xmask,
-        memory,
-        memory_mask=None,
-        pos=None,
-        cache={"slf": None, "src": None},
+        self, x, xmask, memory, memory_mask=None, pos=None, cache=None,
     ):
+        """Decode the new steps ``x`` given the cache of the previous ones.
+
+        :param torch.Tensor x: new steps of every hypothesis (batch * beam, time1, size)
+        :param torch.Tensor xmask: (batch * beam, time1, time2), None for a single step
+        :param torch.Tensor memory: encoded source features (batch, max_time_in, size)
+        :param torch.Tensor memory_mask: mask for memory (batch, 1, max_time_in)
+        :param dict cache: {"slf": self attention key and value, "src": projected memory}
+        """
+
+        if cache is None:
+            cache = {"slf": None, "src": None}
 
         if self.normalize_before:
             x = self.norm1(x)
         residual = x
         if self.relative_positional:
             slf_attn_out, slf_attn_weight, slf_cache = self.slf_attn.inference(
-                x, xmask, pos, cache=["slf"]
+                x, xmask, pos, cache=cache["slf"]
             )
         else:
             slf_attn_out, slf_attn_weight, slf_cache = self.slf_attn.inference(
-                x, xmask, cache=["slf"]
+                x, xmask, cache=cache["slf"]
             )
         if self.concat_after:
             x = residual + self.concat_linear1(flow.cat([x, slf_attn_out], dim=-1))
@@ -259,10 +264,44 @@ class TransformerDecoder(nn.Module):
         return logits, attn_weights
 
     def inference(self, preds, memory, memory_mask=None, cache=None):
+        """Log probabilities of the tokens following ``preds``.
+
+        ``preds`` (batch * beam, steps) holds the hypotheses of every sample of
+        ``memory`` (batch, time, size), stacked sample by sample. Without ``cache``
+        all steps are decoded, with the cache returned by the previous call only the
+        last one is: it holds the self attention key and value of every block and the
+        memory projected once for all hypotheses.
+        """
 
         assert preds.dim() == 2
-        logits, attn_weights = self.forward(preds, memory, memory_mask)
+        if cache is None:
+            cache = [None] * len(self.blocks)
+            dec_output, _ = self.pos_emb(self.embedding(preds))
+            dec_mask = get_transformer_decoder_mask(preds)
+        else:
+            # the new step attends to all cached ones, no mask is needed
+            position = flow.tensor(
+                [[preds.size(1) - 1]], dtype=flow.int64, device=preds.device
+            )
+            dec_output, _ = self.pos_emb.forward_from_pos(
+                self.embedding(preds[:, -1:]), position
+            )
+            dec_mask = None
+
+        attn_weights = {}
+        new_cache = []
+        for i, block in enumerate(self.blocks):
+            dec_output, attn_weight, block_cache = block.inference(
+                dec_output, dec_mask, memory, memory_mask.unsqueeze(1), cache=cache[i],
+            )
+            attn_weights["dec_block_%d" % i] = attn_weight
+            new_cache.append(block_cache)
+
+        if self.normalize_before:
+            dec_output = self.after_norm(dec_output)
+
+        logits = self.output_layer(dec_output[:, -1, :])
         logsoftmax = nn.LogSoftmax(dim=-1)
-        log_probs = logsoftmax(logits[:, -1, :])
+        log_probs = logsoftmax(logits)
 
-        return log_probs, cache, attn_weights
+        return log_probs, new_cache, attn_weights
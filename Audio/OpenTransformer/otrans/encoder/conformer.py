@@ -115,6 +115,20 @@ class ConformerEncoderBlock(nn.Module):
     def attn_infer(self, x, mask, pos, cache):
         residual = x
         x = self.mha_norm(x)
+        if cache is not None:
+            # the cached steps are all valid
+            mask = flow.cat(
+                [
+                    flow.ones(
+                        mask.size(0),
+                        cache[0].size(2),
+                        dtype=mask.dtype,
+                        device=mask.device,
+                    ),
+                    mask,
+                ],
+                dim=1,
+            )
         if self.relative_positional:
             slf_attn_out, slf_attn_weights, new_cache = self.mha.inference(
                 x, mask.unsqueeze(1), pos, cache
@@ -125,21 +139,56 @@ class ConformerEncoderBlock(nn.Module):
             )
         return residual + slf_attn_out, slf_attn_weights, new_cache
 
-    def inference(self, x, mask, pos=None, cache=None):
+    def conv_augment_infer(self, x, mask, cache, num_commit):
+        residual = x
+        x = self.conv_norm(x)
+        x, new_cache = self.conv.inference(x, mask, cache, num_commit)
+        return residual + x, new_cache
+
+    def inference(
+        self, x, mask, pos=None, cache=None, num_commit=None, left_context=None
+    ):
+        """Forward the new steps ``x`` of a stream given the states of its previous steps.
+
+        ``cache`` holds the attention key and value ("attn") and the convolution inputs
+        ("conv") of the previous steps. Only the first ``num_commit`` steps of ``x`` (all
+        by default) are added to the returned cache, the others are lookahead steps
+        which are forwarded again with the next chunk. At most ``left_context`` steps
+        are kept for attention.
+        """
+
+        if cache is None:
+            cache = {"attn": None, "conv": None}
+        num_commit = x.size(1) if num_commit is None else num_commit
 
         if self.macaron_style:
             x = self.pre_ffn_forward(x)
 
         if self.conv_first:
-            x = self.conv_augment_forward(x, mask)
-            x, slf_attn_weights, new_cache = self.attn_infer(x, mask, pos, cache)
+            x, conv_cache = self.conv_augment_infer(x, mask, cache["conv"], num_commit)
+            x, slf_attn_weights, attn_cache = self.attn_infer(
+                x, mask, pos, cache["attn"]
+            )
         else:
-            x, slf_attn_weights, new_cache = self.attn_infer(x, mask, pos, cache)
-            x = self.conv_augment_forward(x, mask)
+            x, slf_attn_weights, attn_cache = self.attn_infer(
+                x, mask, pos, cache["attn"]
+            )
+            x, conv_cache = self.conv_augment_infer(x, mask, cache["conv"], num_commit)
 
-        x = self.post_ffn_forward(x)
+        # drop the lookahead steps
+        key, value = attn_cache
+        stop = key.size(2) - x.size(1) + num_commit
+        start = 0 if left_context is None else max(stop - left_context, 0)
+        attn_cache = (key[:, :, start:stop], value[:, :, start:stop])
 
-        return self.final_norm(x), new_cache, {"slf_attn_weights": slf_attn_weights}
+        # as in forward
+        x = self.post_ffn_norm(x)
+
+        return (
+            self.final_norm(x),
+            {"attn": attn_cache, "conv": conv_cache},
+            {"slf_attn_weights": slf_attn_weights},
+        )
 
 
 class ConformerEncoder(BaseEncoder):
@@ -221,3 +270,62 @@ class ConformerEncoder(BaseEncoder):
             attn_weights["enc_block_%d" % i] = attn_weight
 
         return enc_output, mask, attn_weights
+
+    def inference(self, inputs, mask, cache=None, lookahead=0, left_context=None):
+        """Encode a chunk of a stream.
+
+        Args:
+            inputs: the next steps of the streams [B, T, V]
+            mask: [B, T]
+            cache: returned by the inference of the previous chunk, None for the first
+            lookahead: the last ``lookahead`` steps are only used as right context of
+                the others, they have to be fed again at the start of the next chunk
+            left_context: attention steps kept in the cache, unlimited by default
+        Returns:
+            the encoded T - lookahead steps, their mask, the new cache and the
+            attention weights
+        """
+        if cache is None:
+            cache = {"offset": 0, "blocks": [None] * len(self.blocks)}
+        num_commit = inputs.size(1) - lookahead
+        block_cache = cache["blocks"][0]
+        num_cached = 0 if block_cache is None else block_cache["attn"][0].size(2)
+
+        enc_output = inputs
+        pos = None
+        if self.positional_encoding:
+            if self.relative_positional:
+                position = flow.arange(
+                    -(num_cached + inputs.size(1) - 1),
+                    inputs.size(1),
+                    device=inputs.device,
+                ).reshape(1, -1)
+                pos = self.pos_emb._embedding_from_positions(position)
+            else:
+                position = flow.arange(
+                    cache["offset"],
+                    cache["offset"] + inputs.size(1),
+                    device=inputs.device,
+                ).reshape(1, -1)
+                enc_output, pos = self.pos_emb.forward_from_pos(inputs, position)
+
+        attn_weights = {}
+        new_cache = {"offset": cache["offset"] + num_commit, "blocks": []}
+        for i, block in enumerate(self.blocks):
+            enc_output, block_cache, attn_weight = block.inference(
+                enc_output,
+                mask,
+                pos,
+                cache["blocks"][i],
+                num_commit=num_commit,
+                left_context=left_context,
+            )
+            new_cache["blocks"].append(block_cache)
+            attn_weights["enc_block_%d" % i] = attn_weight
+
+        return (
+            enc_output[:, :num_commit],
+            mask[:, :num_commit],
+            new_cache,
+            attn_weights,
+        )
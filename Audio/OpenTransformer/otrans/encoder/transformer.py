@@ -84,7 +84,7 @@ class TransformerEncoderLayer(nn.Module):
         residual = x
         if self.relative_positional:
             slf_attn_out, slf_attn_weights, new_cache = self.slf_attn.inference(
-                x, mask, cache, pos
+                x, mask, pos, cache
             )
         else:
             slf_attn_out, slf_attn_weights, new_cache = self.slf_attn.inference(
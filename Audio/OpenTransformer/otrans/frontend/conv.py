@@ -160,6 +160,13 @@ class ConvFrontEnd(BaseFrontEnd):
         if self.front_end_layer_norm:
             self.layer_norm = nn.LayerNorm(self.output_size)
 
+        # an output step covers receptive_field input steps, subsampling after the
+        # previous one
+        time_kernels = [k if isinstance(k, int) else k[0] for k in self.kernel_size]
+        time_strides = [s if isinstance(s, int) else s[0] for s in self.stride]
+        self.subsampling = time_strides[0] * time_strides[1]
+        self.receptive_field = time_kernels[0] + (time_kernels[1] - 1) * time_strides[0]
+
     def forward(self, x, mask):
         """Subsample inputs
 
@@ -183,7 +190,25 @@ class ConvFrontEnd(BaseFrontEnd):
         return x, mask
 
     def inference(self, x, mask, cache):
+        """Subsample the next steps of a stream
+
+        The input steps not covered yet by a whole output step are returned as cache
+        and prepended to the next inputs, so chunks are subsampled exactly like the
+        whole stream. Returns None outputs until enough steps are available.
+
+        :param torch.Tensor inputs: x tensor [batch, time, size]
+        :param torch.Tensor inputs_mask: mask [batch, time]
+        :param tuple cache: the inputs and mask left by the previous call or None
+        """
+
+        if cache is not None:
+            x = flow.cat([cache[0], x], dim=1)
+            mask = flow.cat([cache[1], mask], dim=1)
+
+        if x.size(1) < self.receptive_field:
+            return None, None, (x, mask)
 
-        x, mask = self.forward(x, mask)
+        out, out_mask = self.forward(x, mask)
 
-        return x, mask, cache
+        consumed = out.size(1) * self.subsampling
+        return out, out_mask, (x[:, consumed:], mask[:, consumed:])
@@ -85,6 +85,13 @@ class MultiHeadedSelfAttention(BasedAttention):
         return context, attn_weights
 
     def inference(self, x, mask, cache=None):
+        """Incremental self attention.
+
+        :param torch.Tensor x: the new steps (batch, time1, size)
+        :param torch.Tensor mask: (batch, time1 or 1, time2) or None
+        :param tuple cache: key and value of the previous steps (batch, nheads, time, d_k)
+        :return: context, attention weights and the key and value of all steps (time2)
+        """
 
         x = self.qvk_proj(x)
 
@@ -98,13 +105,17 @@ class MultiHeadedSelfAttention(BasedAttention):
         key = key.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
         value = value.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
 
+        if cache is not None:
+            key = flow.cat([cache[0], key], dim=2)
+            value = flow.cat([cache[1], value], dim=2)
+
         scores = flow.matmul(query, key.transpose(2, 3)) / math.sqrt(self.d_k)
 
         context, attn_weights = self.compute_context(
             value, scores, mask.unsqueeze(1) if mask is not None else None
         )
 
-        return context, attn_weights, cache
+        return context, attn_weights, (key, value)
 
 
 class MultiHeadedCrossAttention(BasedAttention):
@@ -156,32 +167,54 @@ class MultiHeadedCrossAttention(BasedAttention):
         return context, attn_weights
 
     def inference(self, query, memory, memory_mask, cache=None):
-        """Compute 'Scaled Dot Product Attention'
+        """Compute 'Scaled Dot Product Attention' for decoding
 
-        :param torch.Tensor query: (batch, time1, size)
+        The key and value of ``memory`` are projected once and returned as cache.
+        ``query`` may hold several hypotheses of every sample of ``memory`` (e.g. the
+        beams), stacked sample by sample; they attend to the memory of their sample
+        without it being repeated.
+
+        :param torch.Tensor query: (batch * beam, time1, size)
         :param torch.Tensor memory: (batch, time2, size)
-        :param torch.Tensor mask: (batch, time1 or 1, time2)
-        :return torch.Tensor: attentined and transformed `value` (batch, time1, d_model)
+        :param torch.Tensor mask: (batch, 1, time2)
+        :param tuple cache: projected key and value (batch, nheads, time2, d_k)
+        :return torch.Tensor: attentined and transformed `value` (batch * beam, time1, d_model)
         """
 
-        query = self.q_proj(query)
-        memory = self.vk_proj(memory)
+        if cache is None:
+            memory = self.vk_proj(memory)
 
-        if self.share_vk_proj:
-            key = value = memory
+            if self.share_vk_proj:
+                key = value = memory
+            else:
+                key, value = flow.split(memory, self.d_model, dim=-1)
+
+            batch_size = memory.size(0)
+            key = key.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
+            value = value.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
+            cache = (key, value)
         else:
-            key, value = flow.split(memory, self.d_model, dim=-1)
+            key, value = cache
 
-        batch_size = query.size(0)
+        batch_size = key.size(0)
+        beam_width = query.size(0) // batch_size
+        time1 = query.size(1)
+
+        # fold the hypotheses of a sample into its query steps
+        query = self.q_proj(query)
         query = query.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
-        key = key.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
-        value = value.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
 
         scores = flow.matmul(query, key.transpose(2, 3)) / math.sqrt(self.d_k)
 
         context, attn_weights = self.compute_context(
             value, scores, memory_mask.unsqueeze(1)
         )
+        context = context.reshape(batch_size * beam_width, time1, self.d_model)
+        attn_weights = (
+            attn_weights.reshape(batch_size, self.nheads, beam_width, time1, -1)
+            .transpose(1, 2)
+            .reshape(batch_size * beam_width, self.nheads, time1, -1)
+        )
         return context, attn_weights, cache
 
 
@@ -213,17 +246,20 @@ class MultiHeadedSelfAttentionWithRelPos(BasedAttention):
         self.posu = nn.Parameter(flow.Tensor(1, 1, n_heads, self.d_k))
         self.posv = nn.Parameter(flow.Tensor(1, 1, n_heads, self.d_k))
 
-    def _RelPosBias(self, content, abs_pos):
+    def _RelPosBias(self, content, abs_pos, query_len=None):
         """Compute relative positinal encoding.
         Args:
             content: [B, T, N, H] if not self.skip_term_b else [1, 1, N, H] oneflow.Size([16, 169, 4, 96])
             abs_pos: [B, N, S=2T-1, H] oneflow.Size([1, 4, 337, 96])
+            query_len: T1 if the queries are only the last T1 of the T2 = S - T1 + 1
+                keys (S = T1 + T2 - 1), by default T1 = T2 = T
         Returns:
             torch.Tensor: Output tensor.
         """
         B, _, N, _ = content.size()
         S = abs_pos.size(2)
-        T = (S + 1) // 2
+        T1 = (S + 1) // 2 if query_len is None else query_len
+        T2 = S - T1 + 1
 
         if not self.skip_term_b:
             matrix_bd = flow.matmul(
@@ -234,8 +270,9 @@ class MultiHeadedSelfAttentionWithRelPos(BasedAttention):
                 content.transpose(1, 2), abs_pos.transpose(-2, -1).repeat(B, 1, 1, 1)
             )
 
-        rel_pos = flow.arange(0, T, dtype=flow.long, device=matrix_bd.device)
-        rel_pos = (rel_pos[None] - rel_pos[:, None]).reshape(1, 1, T, T) + (T - 1)
+        key_pos = flow.arange(0, T2, dtype=flow.long, device=matrix_bd.device)
+        query_pos = flow.arange(0, T1, dtype=flow.long, device=matrix_bd.device)
+        rel_pos = (key_pos[None] - query_pos[:, None]).reshape(1, 1, T1, T2) + (T1 - 1)
         return flow.gather(matrix_bd, dim=3, index=rel_pos.repeat(B, N, 1, 1))
 
     def forward(self, x, mask, pos):
@@ -278,6 +315,52 @@ class MultiHeadedSelfAttentionWithRelPos(BasedAttention):
 
         return context, attn_weights
 
-    def inference(self, inputs, mask, pos, cache=None):
-        context, attn_weights = self.forward(inputs, mask, pos)
-        return context, attn_weights, cache
+    def inference(self, x, mask, pos, cache=None):
+        """
+        Args:
+            x: the new steps [B, T1, V]
+            mask: [B, 1, T2] or None
+            pos: positional embedding of the relative positions -(T2-1) ... T1-1
+                [1, S=T1+T2-1, V]
+            cache: key and value of the previous T2 - T1 steps [B, N, T2-T1, H]
+        Returns:
+            context, attention weights and the key and value of all T2 steps
+        """
+
+        x = self.qvk_proj(x)
+
+        if self.share_qvk_proj:
+            query = key = value = x
+        else:
+            query, key, value = flow.split(x, self.d_model, dim=-1)
+
+        batch_size = x.size(0)
+        query = query.reshape(batch_size, -1, self.nheads, self.d_k)
+        key = key.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
+        value = value.reshape(batch_size, -1, self.nheads, self.d_k).transpose(1, 2)
+
+        if cache is not None:
+            key = flow.cat([cache[0], key], dim=2)
+            value = flow.cat([cache[1], value], dim=2)
+
+        bpos = pos.size(0)
+        pos = (
+            self.pos_proj(pos).reshape(bpos, -1, self.nheads, self.d_k).transpose(1, 2)
+        )
+
+        query_with_bias_u = query + self.posu
+        query_with_bias_u = query_with_bias_u.transpose(1, 2)
+        matrix_ac = flow.matmul(query_with_bias_u, key.transpose(-2, -1))
+
+        matrix_bd = self._RelPosBias(
+            query + self.posv if not self.skip_term_b else self.posv,
+            pos,
+            query_len=query.size(1),
+        )
+
+        scores = (matrix_ac + matrix_bd) / math.sqrt(self.d_k)
+        context, attn_weights = self.compute_context(
+            value, scores, mask.unsqueeze(1) if mask is not None else None
+        )
+
+        return context, attn_weights, (key, value)
@@ -49,3 +49,39 @@ class ConformerConvolutionModule(nn.Module):
         x = flow.masked_fill(x, mask == 0, 0.0)
 
         return x
+
+    def inference(self, x, mask, cache=None, num_commit=None):
+        """
+        Args:
+            x: the new steps [batch_size, time, channels]
+            mask: [batch_size, time]
+            cache: inputs of the depthwise conv of the previous steps, its left context
+                [batch_size, (kernel_size - 1) // 2, channels]
+            num_commit: leading steps of x whose inputs go to the cache, all by default
+        Returns:
+            the output and the new cache
+        """
+        left = (self.depthwise_conv.kernel_size[0] - 1) // 2
+        mask = mask.unsqueeze(2).repeat([1, 1, x.size(-1)])
+
+        x = self.pointwise_conv1(x)
+        x = F.glu(x)
+        x = flow.masked_fill(x, mask == 0, 0.0)
+
+        if cache is None:
+            cache = flow.zeros(x.size(0), left, x.size(2), device=x.device)
+        num_commit = x.size(1) if num_commit is None else num_commit
+        conv_inputs = flow.cat([cache, x], dim=1)
+        new_cache = conv_inputs[:, num_commit : num_commit + left]
+
+        # the zero padding on the left only touches the steps of the cache
+        x = conv_inputs.transpose(1, 2)
+        x = self.depthwise_conv(x)[:, :, left:]
+        x = self.batch_norm(x)
+        x = x * flow.sigmoid(x)
+        x = x.transpose(1, 2)
+
+        x = self.pointwise_conv2(x)
+        x = flow.masked_fill(x, mask == 0, 0.0)
+
+        return x, new_cache
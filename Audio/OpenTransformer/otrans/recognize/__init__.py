@@ -3,7 +3,26 @@ from otrans.recognize.speech2text import SpeechToTextRecognizer
 
 
 def build_recognizer(model_type, model, lm, args, idx2unit):
-    if model_type == "speech2text":
+    if model_type == "speech2text" and args.streaming:
+        # stream the CTC assistor, the attention decoder needs the whole utterance
+        if getattr(model, "assistor", None) is None:
+            raise ValueError(
+                "Streaming a speech2text model decodes its CTC assistor, "
+                "which needs ctc_weight > 0"
+            )
+        return CTCRecognizer(
+            model=model,
+            lm=lm,
+            lm_weight=args.lm_weight,
+            idx2unit=idx2unit,
+            ngpu=args.ngpu,
+            mode=args.mode,
+            streaming=True,
+            chunk_size=args.chunk_size,
+            lookahead=args.lookahead,
+            left_context=args.left_context,
+        )
+    elif model_type == "speech2text":
         return SpeechToTextRecognizer(
             model=model,
             lm=lm,
@@ -29,6 +48,10 @@ def build_recognizer(model_type, model, lm, args, idx2unit):
             mode=args.mode,
             alpha=args.alpha,
             beta=args.beta,
+            streaming=args.streaming,
+            chunk_size=args.chunk_size,
+            lookahead=args.lookahead,
+            left_context=args.left_context,
         )
     else:
         raise NotImplementedError
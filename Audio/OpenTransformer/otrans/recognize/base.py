@@ -59,34 +59,22 @@ class Recognizer:
         if self.lm.model_type == "transformer_lm":
             log_probs = self.lm.predict(preds, last_frame=False)
         else:
-            log_probs = []
-            hidden = None
-            for t in range(preds.size(1)):
-                log_prob, hidden = self.lm.predict(preds[:, t].unsqueeze(-1), hidden)
-                log_probs.append(log_prob)
+            log_probs, _ = self.lm.predict(preds)
 
-            log_probs = flow.cat(log_probs, dim=1)
-
-        rescores = []
+        # log probability of every token of every beam, at once
         max_length = log_probs.size(1)
-        vocab_size = log_probs.size(-1)
-
-        for b in range(preds.size(0)):
-            base_index = flow.arange(max_length, device=preds.device)
-            bias_index = preds[b].reshape(-1)
-
-            index = base_index * vocab_size + bias_index
-            score = flow.index_select(log_probs[b].reshape(-1), dim=-1, index=index)
-
-            label_len = min(int(pred_lens[b]), score.size(0))
-            score[label_len - 1 :] = 0
-            rescores.append(flow.sum(score) / label_len)
-
-        rescores = flow.tensor(rescores, dtype=flow.float32)
+        scores = flow.gather(
+            log_probs, dim=-1, index=preds[:, :max_length].unsqueeze(-1).long()
+        ).squeeze(-1)
+
+        label_len = flow.clamp(pred_lens.to(log_probs.device).float(), max=max_length)
+        steps = flow.arange(max_length, device=log_probs.device).unsqueeze(0)
+        mask = (steps < (label_len - 1).unsqueeze(1)).to(scores.dtype)
+        rescores = flow.sum(scores * mask, dim=-1) / label_len
         _, indices = flow.sort(rescores, dim=-1, descending=True)
 
         sorted_preds = preds[indices]
-        sorted_length = pred_lens[indices]
+        sorted_length = pred_lens[indices.to(pred_lens.device)]
 
         return sorted_preds, sorted_length
 
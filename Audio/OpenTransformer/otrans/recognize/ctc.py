@@ -1,6 +1,7 @@
 import oneflow as flow
+import oneflow.nn.functional as F
 import logging
-from otrans.data import PAD, BLK, EOS
+from otrans.data import BLK
 from otrans.recognize.base import Recognizer
 
 
@@ -17,12 +18,22 @@ class CTCRecognizer(Recognizer):
         mode="greedy",
         alpha=0.1,
         beta=0.0,
+        streaming=False,
+        chunk_size=16,
+        lookahead=4,
+        left_context=64,
     ):
         super().__init__(model, idx2unit, lm, lm_weight, ngpu)
 
         self.beam_width = beam_width
         self.mode = mode
 
+        # in encoder steps, i.e. after the subsampling of the frontend
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.lookahead = lookahead
+        self.left_context = left_context if left_context > 0 else None
+
         if self.mode == "beam":
             import ctcdecode_edited as ctcdecode
 
@@ -40,37 +51,27 @@ class CTCRecognizer(Recognizer):
             )
 
     def recognize(self, inputs, inputs_length):
+        """Returns the 1-best prediction of every utterance as a list, and the scores
+        [batch_size, 1], like the nbest of the attention recognizer."""
 
-        if self.mode == "greedy":
-            results = self.recognize_greedy(inputs, inputs_length)
+        if self.streaming:
+            results, scores = self.recognize_streaming(inputs, inputs_length)
+        elif self.mode == "greedy":
+            results, scores = self.recognize_greedy(inputs, inputs_length)
         elif self.mode == "beam":
-            results = self.recognize_beam(inputs, inputs_length)
+            results, scores = self.recognize_beam(inputs, inputs_length)
         else:
             raise ValueError
 
-        return self.translate(results)
+        return [[pred] for pred in self.translate(results)], scores
 
     def recognize_greedy(self, inputs, inputs_length):
 
         log_probs, length = self.model.inference(inputs, inputs_length)
+        preds = log_probs.argmax(dim=-1)
+        scores = best_path_scores(log_probs, preds, length)
 
-        _, preds = log_probs.topk(self.beam_width, dim=-1)
-
-        results = []
-        for b in range(log_probs.size(0)):
-            pred = []
-            last_k = PAD
-            for i in range(int(length[b])):
-                k = int(preds[b][i][0])
-                if k == last_k or k == PAD:
-                    last_k = k
-                    continue
-                else:
-                    last_k = k
-                    pred.append(k)
-
-            results.append(pred)
-        return results
+        return collapse_best_paths(preds, length), scores.unsqueeze(1)
 
     def recognize_beam(self, inputs, inputs_length):
 
@@ -89,4 +90,161 @@ class CTCRecognizer(Recognizer):
             tokens = [int(i) for i in best_results[b, :length]]
             results.append(tokens)
 
-        return results
+        return results, beam_scores[:, :1]
+
+    def recognize_streaming(self, inputs, inputs_mask):
+        """Decode every utterance as a stream, fed chunk by chunk."""
+        frames_per_chunk = self.chunk_size * self.model.frontend.subsampling
+        results, scores = [], []
+        for b in range(inputs.size(0)):
+            length = int(inputs_mask[b].sum())
+            cache = None
+            for start in range(0, length, frames_per_chunk):
+                end = min(start + frames_per_chunk, length)
+                partial, cache = self.recognize_chunk(
+                    inputs[b : b + 1, start:end], cache, final=end == length
+                )
+                logging.debug("[%d / %d frames] %s" % (end, length, partial[0]))
+            results.append(cache["preds"][0])
+            scores.append(cache["score"])
+        return results, flow.cat(scores).unsqueeze(1)
+
+    def recognize_chunk(self, inputs, cache=None, final=False):
+        """Streaming greedy decoding.
+
+        Args:
+            inputs: the next features of a batch of streams, all of the same length
+                [batch_size, time, size]
+            cache: returned by the previous chunk, None for the first one
+            final: the streams end with this chunk
+        Returns:
+            the partial hypotheses and the cache
+
+        The encoder forwards chunk_size steps at a time, plus lookahead steps of right
+        context, and keeps left_context steps of history, so the latency and memory of
+        a stream do not grow with its length.
+        """
+        assert self.mode == "greedy"
+
+        batch_size = inputs.size(0)
+        if cache is None:
+            cache = {
+                "frontend": None,
+                "encoder": None,
+                "ctc": None,
+                "frames": None,
+                "preds": [[] for _ in range(batch_size)],
+                "last": None,
+                "score": flow.zeros(batch_size, device=inputs.device),
+            }
+
+        mask = flow.ones(
+            batch_size, inputs.size(1), dtype=flow.uint8, device=inputs.device
+        )
+        x, _, cache["frontend"] = self.model.frontend.inference(
+            inputs, mask, cache["frontend"]
+        )
+        frames = cache["frames"]
+        if x is not None:
+            frames = x if frames is None else flow.cat([frames, x], dim=1)
+
+        memory = []
+        window = self.chunk_size + self.lookahead
+        while frames is not None and frames.size(1) > 0:
+            if frames.size(1) >= window:
+                num_steps, lookahead = window, self.lookahead
+            elif final:
+                num_steps = frames.size(1)
+                lookahead = max(num_steps - self.chunk_size, 0)
+            else:
+                break
+            chunk_mask = flow.ones(
+                batch_size, num_steps, dtype=flow.uint8, device=frames.device
+            )
+            chunk_memory, _, cache["encoder"], _ = self.model.encoder.inference(
+                frames[:, :num_steps],
+                chunk_mask,
+                cache["encoder"],
+                lookahead=lookahead,
+                left_context=self.left_context,
+            )
+            memory.append(chunk_memory)
+            frames = frames[:, num_steps - lookahead :]
+        cache["frames"] = frames
+
+        log_probs = self.stream_ctc_log_probs(
+            flow.cat(memory, dim=1) if len(memory) > 0 else None, cache, final
+        )
+        if log_probs is not None:
+            preds = log_probs.argmax(dim=-1)
+            tokens = collapse_best_paths(preds, last=cache["last"])
+            for b in range(batch_size):
+                cache["preds"][b].extend(tokens[b])
+            cache["last"] = preds[:, -1]
+            cache["score"] = cache["score"] + best_path_scores(log_probs, preds)
+
+        return self.translate(cache["preds"]), cache
+
+    def stream_ctc_log_probs(self, memory, cache, final):
+        """CTC log probabilities of the encoded steps, the lookahead conv of the CTC
+        assistor waits for its right context in the cache."""
+        assistor = self.model.assistor
+        if not assistor.apply_look_ahead:
+            if memory is None:
+                return None
+            return flow.log_softmax(assistor.output_layer(memory), dim=-1)
+
+        steps = assistor.lookahead_steps
+        if cache["ctc"] is not None:
+            memory = (
+                cache["ctc"]
+                if memory is None
+                else flow.cat([cache["ctc"], memory], dim=1)
+            )
+        if memory is None:
+            return None
+        if final:
+            memory = F.pad(memory, pad=(0, 0, 0, steps), value=0.0)
+            cache["ctc"] = None
+        elif memory.size(1) <= steps:
+            cache["ctc"] = memory
+            return None
+        else:
+            cache["ctc"] = memory[:, -steps:]
+
+        memory = assistor.lookahead_conv(memory.transpose(1, 2)).transpose(1, 2)
+        return flow.log_softmax(assistor.output_layer(memory), dim=-1)
+
+
+def best_path_scores(log_probs, preds, lengths=None):
+    """Log probabilities of the best paths [batch_size], over their valid steps."""
+    scores = flow.gather(log_probs, dim=-1, index=preds.unsqueeze(-1)).squeeze(-1)
+    if lengths is not None:
+        steps = flow.arange(preds.size(1), device=preds.device).unsqueeze(0)
+        valid = steps < lengths.to(preds.device).unsqueeze(1)
+        scores = scores * valid.to(scores.dtype)
+    return flow.sum(scores, dim=-1)
+
+
+def collapse_best_paths(preds, lengths=None, last=None):
+    """Merges the repeats and removes the blanks of CTC best paths.
+
+    Args:
+        preds: [batch_size, time]
+        lengths: valid steps of every path [batch_size], all by default
+        last: the step preceding every path [batch_size], e.g. the end of the previous
+            chunk of a stream, blank by default
+    Returns:
+        the tokens of every path, read back to host at once
+    """
+    batch_size, time_step = preds.size()
+    if last is None:
+        last = flow.full([batch_size], BLK, dtype=preds.dtype, device=preds.device)
+    prev = flow.cat([last.reshape(batch_size, 1), preds[:, :-1]], dim=1)
+    keep = flow.logical_and(preds != prev, preds != BLK)
+    if lengths is not None:
+        steps = flow.arange(time_step, device=preds.device).unsqueeze(0)
+        keep = flow.logical_and(keep, steps < lengths.to(preds.device).unsqueeze(1))
+
+    tokens = flow.masked_fill(preds, flow.logical_not(keep), -1).cpu().numpy()
+    return [row[row >= 0].tolist() for row in tokens]
@@ -17,7 +17,7 @@ class SpeechToTextRecognizer(Recognizer):
         penalty=0,
         lamda=5,
         ngpu=1,
-        apply_cache=False,
+        apply_cache=True,
     ):
         super(SpeechToTextRecognizer, self).__init__(
             model, idx2unit, lm, lm_weight, ngpu
@@ -34,7 +34,7 @@ class SpeechToTextRecognizer(Recognizer):
         self.lm_weight = lm_weight
 
         self.attn_weights = {}
-        self.apply_cache = False
+        self.apply_cache = apply_cache
 
     def encode(self, inputs, inputs_mask, cache=None):
         new_cache = {}
@@ -63,18 +63,8 @@ class SpeechToTextRecognizer(Recognizer):
         self.attn_weights["encoder"] = enc_attn_weights
         self.attn_weights["decoder"] = []
 
-        b, t, v = memory.size()
-
-        beam_memory = (
-            memory.unsqueeze(1)
-            .repeat([1, self.beam_width, 1, 1])
-            .view(b * self.beam_width, t, v)
-        )
-        beam_memory_mask = (
-            memory_mask.unsqueeze(1)
-            .repeat([1, self.beam_width, 1])
-            .view(b * self.beam_width, t)
-        )
+        # the beams of an utterance share its memory, the decoder projects it once
+        b = memory.size(0)
 
         preds = (
             flow.ones([b * self.beam_width, 1], dtype=flow.int64, device=memory.device)
@@ -90,7 +80,7 @@ class SpeechToTextRecognizer(Recognizer):
         with flow.no_grad():
             for _ in range(1, self.max_len + 1):
                 preds, cache, scores, ending_flag = self.decode_step(
-                    preds, beam_memory, beam_memory_mask, cache, scores, ending_flag
+                    preds, memory, memory_mask, cache, scores, ending_flag
                 )
 
                 # whether stop or not
@@ -127,7 +117,12 @@ class SpeechToTextRecognizer(Recognizer):
         return self.nbest_translate(nbest_preds), nbest_scores
 
     def decode_step(self, preds, memory, memory_mask, cache, scores, flag):
-        """ decode an utterance in a stepwise way"""
+        """ decode an utterance in a stepwise way
+
+        ``preds`` and ``scores`` hold ``beam_width`` hypotheses per utterance of
+        ``memory``. The decoder (and recurrent lm) states are carried in ``cache`` and
+        reordered like the hypotheses kept after pruning.
+        """
 
         batch_size = int(scores.size(0) / self.beam_width)
 
@@ -137,7 +132,7 @@ class SpeechToTextRecognizer(Recognizer):
 
         if self.lm is not None:
             batch_lm_log_probs, lm_hidden = self.lm_decode(preds, cache["lm"])
-            batch_lm_log_probs = batch_lm_log_probs.squeeze(1)
+            batch_lm_log_probs = batch_lm_log_probs.reshape(preds.size(0), -1)
             batch_log_probs = batch_log_probs + self.lm_weight * batch_lm_log_probs
         else:
             lm_hidden = None
@@ -176,6 +171,16 @@ class SpeechToTextRecognizer(Recognizer):
         preds_symbol = flow.index_select(preds, dim=0, index=preds_index)
         preds_symbol = flow.cat([preds_symbol, best_k_preds.view(-1, 1)], dim=1)
 
+        # keep the states of the hypotheses the new ones extend
+        if self.apply_cache:
+            cache["decoder"] = reselect_decoder_cache(
+                dec_cache, self.beam_width, best_k_indices
+            )
+        if lm_hidden is not None:
+            cache["lm"] = tuple(
+                reselect_hidden(h, self.beam_width, best_k_indices) for h in lm_hidden
+            )
+
         # finished or not
         end_flag = flow.eq(preds_symbol[:, -1], EOS).view(-1, 1).to(flow.uint8)
 
@@ -221,13 +226,15 @@ def mask_finished_preds(pred, flag):
     return flow.masked_fill(pred, finished.to(dtype=flow.uint8) == 1, EOS)
 
 
-def reselect_hidden(tensor, beam_width, indices):
-    n_layers, batch_size, hidden_size = tensor.size()
-    tensor = tensor.transpose(0, 1).unsqueeze(1).repeat([1, beam_width, 1, 1])
-    tensor = tensor.reshape(batch_size * beam_width, n_layers, hidden_size)
-    new_tensor = flow.index_select(tensor, dim=0, index=indices)
-    new_tensor = new_tensor.transpose(0, 1).contiguous()
-    return new_tensor
+def reselect_hidden(tensor, beam_width, indices, dim=1):
+    """Selects, along ``dim``, the hypotheses the ``indices`` of the pruned
+    beam_width * beam_width candidates extend.
+    Args:
+        tensor: hidden states of batch_size * beam_size hypotheses along ``dim``,
+            e.g. [n_layers, batch_size * beam_size, hidden_size].
+        indices: A int array with shape [batch_size * beam_size].
+    """
+    return flow.index_select(tensor, dim=dim, index=indices.floor_divide(beam_width))
 
 
 def reselect_hidden_list(tensor_list, beam_width, indices):
@@ -245,3 +252,21 @@ def reselect_hidden_list(tensor_list, beam_width, indices):
             new_tensor_list.append(reselect_hidden(tensor, beam_width, indices))
 
     return new_tensor_list
+
+
+def reselect_decoder_cache(cache, beam_width, indices):
+    """Reorders the self attention key and value of every decoder block, the memory
+    projection is shared by the beams of an utterance and kept as is."""
+    new_cache = []
+    for block_cache in cache:
+        key, value = block_cache["slf"]
+        new_cache.append(
+            {
+                "slf": (
+                    reselect_hidden(key, beam_width, indices, dim=0),
+                    reselect_hidden(value, beam_width, indices, dim=0),
+                ),
+                "src": block_cache["src"],
+            }
+        )
+    return new_cache
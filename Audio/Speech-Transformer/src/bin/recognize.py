@@ -5,7 +5,7 @@ import json
 import oneflow as flow
 import kaldi_io
 from transformer import Transformer
-from utils import add_results_to_json, process_dict
+from utils import add_results_to_json, pad_list, process_dict
 from data import build_LFR_features
 from decoder import Decoder
 from encoder import Encoder
@@ -40,6 +40,9 @@ parser.add_argument(
 # decode
 parser.add_argument("--beam-size", default=5, type=int, help="Beam size")
 parser.add_argument("--nbest", default=1, type=int, help="Nbest size")
+parser.add_argument(
+    "--batch-size", default=16, type=int, help="Number of utterances decoded together"
+)
 parser.add_argument(
     "--decode-max-len",
     default=0,
@@ -132,19 +135,31 @@ def recognize(args):
     with open(args.recog_json, "rb") as f:
         js = json.load(f)["utts"]
 
-    # decode each utterance
+    # decode batches of utterances of similar lengths
+    names = sorted(js.keys(), key=lambda name: int(js[name]["input"][0]["shape"][0]))
     new_js = {}
     with flow.no_grad():
-        for idx, name in enumerate(js.keys(), 1):
-            print("(%d/%d) decoding %s" % (idx, len(js.keys()), name), flush=True)
-            input = kaldi_io.read_mat(js[name]["input"][0]["feat"])
-            input = build_LFR_features(input, LFR_m, LFR_n)
-            input = flow.tensor(input).to(dtype=flow.float32)
-            input_length = flow.tensor([input.size(0)], dtype=flow.int64)
-            input = input.to(device)
-            input_length = input_length.to(device)
-            nbest_hyps = model.recognize(input, input_length, char_list, args)
-            new_js[name] = add_results_to_json(js[name], nbest_hyps, char_list)
+        for start in range(0, len(names), args.batch_size):
+            batch = names[start : start + args.batch_size]
+            print(
+                "(%d/%d) decoding %s" % (start + len(batch), len(names), batch[-1]),
+                flush=True,
+            )
+            inputs = [
+                build_LFR_features(
+                    kaldi_io.read_mat(js[name]["input"][0]["feat"]), LFR_m, LFR_n
+                )
+                for name in batch
+            ]
+            input_lengths = flow.tensor([x.shape[0] for x in inputs], dtype=flow.int64)
+            padded_input = pad_list(
+                [flow.tensor(x).to(dtype=flow.float32) for x in inputs], 0
+            )
+            padded_input = padded_input.to(device)
+            input_lengths = input_lengths.to(device)
+            batch_nbest_hyps = model.recognize(padded_input, input_lengths, args)
+            for name, nbest_hyps in zip(batch, batch_nbest_hyps):
+                new_js[name] = add_results_to_json(js[name], nbest_hyps, char_list)
 
     with open(args.result_label, "wb") as f:
         f.write(json.dumps({"utts": new_js}, indent=4, sort_keys=True).encode("utf_8"))
@@ -58,6 +58,47 @@ class MultiHeadAttention(nn.Module):
 
         return output, attn
 
+    def inference(self, q, k=None, v=None, cache=None, mask=None):
+        """
+        Incremental attention for decoding.
+        Args:
+            q: N x Lq x D
+            k, v: N x Lk x D, new keys and values appended to the cache,
+                None to attend to the cache only
+            cache: (key, value), N x n_head x L x d_k projected keys and values
+            mask: N x 1 x L, masked positions are True
+
+        Returns:
+            output: N x Lq x D
+            cache: (key, value) including k and v
+        """
+        d_k, d_v, n_head = self.d_k, self.d_v, self.n_head
+        sz_b, len_q, _ = q.size()
+
+        residual = q
+
+        q = self.w_qs(q).view(sz_b, len_q, n_head, d_k).transpose(1, 2)
+        if k is not None:
+            key = self.w_ks(k).view(sz_b, -1, n_head, d_k).transpose(1, 2)
+            value = self.w_vs(v).view(sz_b, -1, n_head, d_v).transpose(1, 2)
+            if cache is not None:
+                key = flow.cat([cache[0], key], dim=2)
+                value = flow.cat([cache[1], value], dim=2)
+        else:
+            key, value = cache
+
+        attn = flow.matmul(q, key.transpose(2, 3)) / self.attention.temperature
+        if mask is not None:
+            attn = attn.masked_fill(mask.unsqueeze(1), -np.inf)
+        attn = flow.softmax(attn, dim=-1)
+        output = flow.matmul(attn, value)
+
+        output = output.transpose(1, 2).reshape(sz_b, len_q, -1)
+        output = self.dropout(self.fc(output))
+        output = self.layer_norm(output + residual)
+
+        return output, (key, value)
+
 
 class ScaledDotProductAttention(nn.Module):
     """ Scaled Dot-Product Attention """
@@ -1,3 +1,4 @@
+import numpy as np
 import oneflow as flow
 import oneflow.nn as nn
 import oneflow.nn.functional as F
@@ -148,118 +149,98 @@ class Decoder(nn.Module):
             return pred, gold, dec_slf_attn_list, dec_enc_attn_list
         return pred, gold
 
-    def recognize_beam(self, encoder_outputs, char_list, args):
+    def recognize_beam(self, encoder_outputs, encoder_input_lengths, args):
         """
-        Beam search, decode one utterence now.
+        Beam search, decode a batch of utterences at once.
+        The hypotheses of all utterances are stacked into one batch and only their
+        last token is fed to the decoder at each step, every layer caches the keys
+        and values of the previous tokens and of the encoder outputs.
         Args:
-            encoder_outputs: T x H #418 x 512
-            char_list: list of character #4233
-            args: args.beam #5
+            encoder_outputs: N x Ti x H
+            encoder_input_lengths: N
+            args: args.beam_size #5
 
         Returns:
-            nbest_hyps:
+            nbest_hyps: list of the nbest hypotheses of each utterance
         """
         # search params
         beam = args.beam_size
         nbest = args.nbest
+        n_batch = encoder_outputs.size(0)
+        device = encoder_outputs.device
         if args.decode_max_len == 0:
-            maxlen = encoder_outputs.size(0)
+            maxlens = encoder_input_lengths.cpu().numpy()
         else:
-            maxlen = args.decode_max_len
-
-        encoder_outputs = encoder_outputs.unsqueeze(0)
-        # prepare sos
-        ys = flow.ones(1, 1).fill_(self.sos_id).type_as(encoder_outputs).long()
-        hyp = {"score": 0.0, "yseq": ys}
-        hyps = [hyp]
-        ended_hyps = []
-
-        for i in range(maxlen):
-            hyps_best_kept = []
-            for hyp in hyps:
-                ys = hyp["yseq"]
-                ys = ys.to(device=encoder_outputs.device)
-                # -- Prepare masks
-                non_pad_mask = flow.ones_like(ys).to(dtype=flow.float32).unsqueeze(-1)
-                slf_attn_mask = get_subsequent_mask(ys)
-                # -- Forward
-                dec_output = self.dropout(
-                    self.tgt_word_emb(ys) * self.x_logit_scale
-                    + self.positional_encoding(ys)
+            maxlens = np.full(n_batch, args.decode_max_len)
+
+        dec_enc_attn_mask = get_attn_pad_mask(encoder_outputs, encoder_input_lengths, 1)
+        # only the first hypothesis of each utterance is alive at the start
+        init_scores = np.full((n_batch, beam), -np.inf, dtype=np.float32)
+        init_scores[:, 0] = 0.0
+        scores = flow.tensor(init_scores, device=device)
+        ys = flow.ones(n_batch * beam, 1, dtype=flow.int64, device=device).fill_(
+            self.sos_id
+        )
+        yseqs = np.full((n_batch * beam, 1), self.sos_id, dtype=np.int64)
+        beam_offset = flow.arange(n_batch, device=device).unsqueeze(1) * beam
+        ended_hyps = [[] for _ in range(n_batch)]
+        cache = [None] * self.n_layers
+
+        for i in range(int(maxlens.max())):
+            dec_output = self.dropout(
+                self.tgt_word_emb(ys) * self.x_logit_scale
+                + self.positional_encoding.pe[:, i : i + 1]
+            )
+            for l, dec_layer in enumerate(self.layer_stack):
+                dec_output, cache[l] = dec_layer.inference(
+                    dec_output, encoder_outputs, dec_enc_attn_mask, cache[l]
+                )
+
+            seq_logit = self.tgt_word_prj(dec_output[:, -1])
+            local_scores = F.log_softmax(seq_logit, dim=-1).view(n_batch, beam, -1)
+            vocab_size = local_scores.size(2)
+            # topk over beam x vocab of each utterance
+            scores, best_ids = flow.topk(
+                (scores.unsqueeze(2) + local_scores).view(n_batch, -1), beam, dim=1
+            )
+            prev_beam = (best_ids.floor_divide(vocab_size) + beam_offset).view(-1)
+            ys = (best_ids % vocab_size).view(-1, 1)
+            for layer_cache in cache:
+                layer_cache["slf"] = tuple(
+                    flow.index_select(x, dim=0, index=prev_beam)
+                    for x in layer_cache["slf"]
                 )
 
-                for dec_layer in self.layer_stack:
-                    dec_output, _, _ = dec_layer(
-                        dec_output,
-                        encoder_outputs,
-                        non_pad_mask=non_pad_mask,
-                        slf_attn_mask=slf_attn_mask,
-                        dec_enc_attn_mask=None,
-                    )
-
-                seq_logit = self.tgt_word_prj(dec_output[:, -1])
-                local_logit = F.softmax(seq_logit)
-                local_scores = flow.log(local_logit)
-                # topk scores
-                local_best_scores, local_best_ids = flow.topk(local_scores, beam, dim=1)
-
-                for j in range(beam):
-                    new_hyp = {}
-                    new_hyp["score"] = hyp["score"] + local_best_scores[0, j]
-                    new_hyp["yseq"] = (
-                        flow.ones(1, (1 + ys.size(1))).type_as(encoder_outputs).long()
-                    )
-                    new_hyp["yseq"][:, : ys.size(1)] = hyp["yseq"]
-                    new_hyp["yseq"][:, ys.size(1)] = int(
-                        float(local_best_ids[0, j].numpy())
-                    )
-                    hyps_best_kept.append(new_hyp)
-
-                hyps_best_kept = sorted(
-                    hyps_best_kept, key=lambda x: x["score"], reverse=True
-                )[:beam]
-            # end for hyp in hyps
-            hyps = hyps_best_kept
-            # add eos in the final loop to avoid that there are no ended hyps
-            if i == maxlen - 1:
-                for hyp in hyps:
-                    hyp["yseq"] = flow.cat(
-                        [
-                            hyp["yseq"],
-                            flow.ones(1, 1)
-                            .fill_(self.eos_id)
-                            .type_as(encoder_outputs)
-                            .long(),
-                        ],
-                        dim=1,
-                    )
-
-            # add ended hypothes to a final list, and removed them from current hypothes
-            # (this will be a probmlem, number of hyps < beam)
-            remained_hyps = []
-            for hyp in hyps:
-                if hyp["yseq"][0, -1] == self.eos_id:
-                    ended_hyps.append(hyp)
-                else:
-                    remained_hyps.append(hyp)
-
-            hyps = remained_hyps
-            if len(hyps) > 0:
-                print("remeined hypothes: " + str(len(hyps)))
-            else:
-                print("no hypothesis. Finish decoding.")
+            hyp_scores = scores.cpu().numpy().reshape(-1)
+            yseqs = np.concatenate(
+                [yseqs[prev_beam.cpu().numpy()], ys.cpu().numpy()], axis=1
+            )
+            alive = np.isfinite(hyp_scores)
+            # add eos in the last step of an utterance to avoid that there are no ended hyps,
+            # a hypothesis that just emitted eos does not get a second one
+            last_step = np.repeat(maxlens - 1 == i, beam)
+            ended = alive & ((yseqs[:, -1] == self.eos_id) | last_step)
+            for j in np.flatnonzero(ended):
+                yseq = yseqs[j].tolist()
+                if yseq[-1] != self.eos_id:
+                    yseq.append(self.eos_id)
+                ended_hyps[j // beam].append(
+                    {"score": float(hyp_scores[j]), "yseq": yseq}
+                )
+
+            # ended hypotheses are removed from the beam
+            removed = ended | last_step
+            if not (alive & ~removed).any():
                 break
-            for hyp in hyps:
-                print(
-                    "hypo: "
-                    + "".join([char_list[int(x.numpy())] for x in hyp["yseq"][0, 1:]])
+            if removed.any():
+                scores = scores.masked_fill(
+                    flow.tensor(removed.reshape(n_batch, beam), device=device), -np.inf,
                 )
 
-        nbest_hyps = sorted(ended_hyps, key=lambda x: x["score"], reverse=True)[
-            : min(len(ended_hyps), nbest)
+        nbest_hyps = [
+            sorted(hyps, key=lambda x: x["score"], reverse=True)[:nbest]
+            for hyps in ended_hyps
         ]
-        for hyp in nbest_hyps:
-            hyp["yseq"] = hyp["yseq"][0].cpu().numpy().tolist()
         return nbest_hyps
 
 
@@ -296,3 +277,36 @@ class DecoderLayer(nn.Module):
         dec_output *= non_pad_mask
 
         return dec_output, dec_slf_attn, dec_enc_attn
+
+    def inference(self, dec_input, enc_output, dec_enc_attn_mask=None, cache=None):
+        """
+        Decode the last token of N' = N x beam hypotheses.
+        Args:
+            dec_input: N' x 1 x D
+            enc_output: N x Ti x H, only projected at the first step
+            cache: {"slf": self attention cache, "src": encoder outputs cache}
+
+        Returns:
+            dec_output: N' x 1 x D
+            cache
+        """
+        dec_output, slf_cache = self.slf_attn.inference(
+            dec_input, dec_input, dec_input, None if cache is None else cache["slf"]
+        )
+
+        # the hypotheses of an utterance share its encoder outputs as queries
+        n_batch, d_model = enc_output.size(0), dec_output.size(2)
+        dec_output = dec_output.view(n_batch, -1, d_model)
+        if cache is None:
+            dec_output, src_cache = self.enc_attn.inference(
+                dec_output, enc_output, enc_output, mask=dec_enc_attn_mask
+            )
+        else:
+            dec_output, src_cache = self.enc_attn.inference(
+                dec_output, cache=cache["src"], mask=dec_enc_attn_mask
+            )
+        dec_output = dec_output.view(-1, 1, d_model)
+
+        dec_output = self.pos_ffn(dec_output)
+
+        return dec_output, {"slf": slf_cache, "src": src_cache}
@@ -31,16 +31,16 @@ class Transformer(nn.Module):
         )
         return pred, gold
 
-    def recognize(self, input, input_length, char_list, args):
-        """Sequence-to-Sequence beam search, decode one utterence now.
+    def recognize(self, padded_input, input_lengths, args):
+        """Sequence-to-Sequence beam search, decode a batch of utterences.
         Args:
-            input: T x D
-            char_list: list of characters
+            padded_input: N x Ti x D
+            input_lengths: N
             args: args.beam
         Returns:
-            nbest_hyps:
+            nbest_hyps: nbest hypotheses of each utterance
         """
-        encoder_outputs, *_ = self.encoder(input.unsqueeze(0), input_length)
-        nbest_hyps = self.decoder.recognize_beam(encoder_outputs[0], char_list, args)
+        encoder_outputs, *_ = self.encoder(padded_input, input_lengths)
+        nbest_hyps = self.decoder.recognize_beam(encoder_outputs, input_lengths, args)
 
         return nbest_hyps
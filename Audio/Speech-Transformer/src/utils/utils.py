@@ -42,7 +42,7 @@ def parse_hypothesis(hyp, char_list):
     # remove sos and get results
     tokenid_as_list = list(map(int, hyp["yseq"][1:]))
     token_as_list = [char_list[idx] for idx in tokenid_as_list]
-    score = float(hyp["score"].numpy())
+    score = float(hyp["score"])
 
     # convert to string
     tokenid = " ".join([str(idx) for idx in tokenid_as_list])
@@ -0,0 +1,361 @@
+"""
+Sharded checkpoints for consistent (tensor/pipeline/data parallel) models.
+
+Every rank saves only the slices of the parameters it holds, and among data parallel
+replicas only the first one writes. A checkpoint directory looks like::
+
+    manifest.json          global shape/dtype of every tensor, layout, iteration
+    rank_00000/<name>.npy  slices written by rank 0
+    rank_00000.json        slices of rank 0: name, offsets and shape in the global tensor
+    rank_00000/graph/      rank 0's part of the optimizer/lr scheduler state of the graph
+    ...
+
+A rank's json is written after all of its slices, so a checkpoint is complete once the
+json of every rank listed in the manifest exists. Loading reads the slice lists of all
+ranks and assembles the part each rank needs under the *current* layout from memory
+mapped slices, so a checkpoint can be loaded into a different parallel layout.
+
+The optimizer and lr scheduler state (moments, train step) lives inside the nn.Graph
+and is saved as each rank's local part, so it can only be restored under the same
+layout; otherwise loading warns and that state starts from scratch.
+"""
+import os
+import json
+import queue
+import threading
+import warnings
+
+import numpy as np
+import oneflow as flow
+
+from oneflow_gpt import distribute as dist
+from oneflow_gpt.config import get_args
+from oneflow_gpt.logger import print_rank_0
+
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _rank_dir(path, rank):
+    return os.path.join(path, f"rank_{rank:05d}")
+
+
+def _rank_index(path, rank):
+    return os.path.join(path, f"rank_{rank:05d}.json")
+
+
+def _split_axis(sbp, ndim):
+    for axis in range(ndim):
+        if sbp == flow.sbp.split(axis):
+            return axis
+    return None
+
+
+def _chunk(length, parts, index):
+    """Offset and size of chunk ``index`` when ``length`` is split into ``parts``."""
+    size, remainder = divmod(length, parts)
+    start = index * size + min(index, remainder)
+    return start, size + (1 if index < remainder else 0)
+
+
+class _Layout(object):
+    """Maps the placement of a consistent tensor to its ranks and their mesh coordinates."""
+
+    def __init__(self):
+        args = get_args()
+        self.args = args
+        self.dist_util = dist.get_dist_util()
+        self.stage_placements = []
+        self.stage_ranks = []
+        for layer_idx in range(args.num_layers):
+            stage_id = self.dist_util.get_layer_stage_id(layer_idx)
+            if stage_id < len(self.stage_placements):
+                continue
+            self.stage_placements.append(dist.get_layer_placement(layer_idx))
+            devices = self.dist_util.get_layer_devices(layer_idx)
+            self.stage_ranks.append(
+                [
+                    node_id * args.num_gpus_per_node + device_id
+                    for node_id in sorted(devices)
+                    for device_id in devices[node_id]
+                ]
+            )
+
+    def ranks(self, tensor):
+        for placement, ranks in zip(self.stage_placements, self.stage_ranks):
+            if tensor.placement == placement:
+                return ranks
+        raise ValueError(f"unknown placement {tensor.placement}")
+
+    def local_slice(self, tensor, rank):
+        """
+        Returns ``(offsets, shape, is_writer)`` of ``rank``'s part of ``tensor``, or None
+        if ``rank`` doesn't hold it. ``is_writer`` is False for all but the first replica.
+        """
+        ranks = self.ranks(tensor)
+        if rank not in ranks:
+            return None
+        hierarchy = self.dist_util.parallel_hierarchy or (len(ranks),)
+        coords = [int(c) for c in np.unravel_index(ranks.index(rank), hierarchy)]
+
+        shape = list(tensor.shape)
+        offsets = [0] * len(shape)
+        is_writer = True
+        for mesh_dim, sbp in enumerate(tensor.sbp):
+            axis = _split_axis(sbp, len(shape))
+            if axis is None:
+                # broadcast: every coordinate along this mesh dim holds the same data
+                is_writer = is_writer and coords[mesh_dim] == 0
+                continue
+            start, size = _chunk(shape[axis], hierarchy[mesh_dim], coords[mesh_dim])
+            offsets[axis] += start
+            shape[axis] = size
+        return offsets, shape, is_writer
+
+
+def _graph_state(graph):
+    """The optimizer/lr scheduler variables of ``graph``, its module states excluded."""
+    if graph is None:
+        return {}
+    return {
+        name: value
+        for name, value in graph.state_dict().items()
+        if isinstance(value, flow.Tensor)
+    }
+
+
+class CheckpointManager(object):
+    """
+    Saves and loads sharded checkpoints of ``model`` and the optimizer/lr scheduler
+    state of ``graph``, the nn.Graph training it.
+
+    With ``async_save`` the device to host copy happens in :meth:`save`, which keeps the
+    snapshot consistent with the current step, and the files are written by a
+    background thread while training continues. :meth:`wait` blocks until all pending
+    checkpoints are on disk.
+    """
+
+    def __init__(self, model, graph=None, async_save=True):
+        self.model = model
+        self.graph = graph
+        self.rank = flow.env.get_rank()
+        self.world_size = flow.env.get_world_size()
+        self.async_save = async_save
+        self.layout = _Layout()
+        self._queue = queue.Queue(maxsize=1)
+        self._writer = None
+
+    def save(self, path, iteration=0):
+        print_rank_0(f"Saving model to {path}")
+        manifest = {"iteration": iteration, "world_size": self.world_size}
+        manifest["layout"] = self._layout_sizes()
+        manifest["tensors"] = {}
+
+        shards = []
+        for name, tensor in self.model.state_dict().items():
+            manifest["tensors"][name] = {
+                "shape": list(tensor.shape),
+                "dtype": str(tensor.dtype).split(".")[-1],
+            }
+            local_slice = self.layout.local_slice(tensor, self.rank)
+            if local_slice is None:
+                continue
+            offsets, shape, is_writer = local_slice
+            if not is_writer:
+                continue
+            local = tensor.to_local().numpy()
+            assert list(local.shape) == shape, f"{name}: {local.shape} vs {shape}"
+            shards.append((name, offsets, local))
+
+        graph_state = _graph_state(self.graph)
+        manifest["graph_state"] = sorted(graph_state.keys())
+        graph_shards = [
+            (name, value.to_local().numpy() if value.is_consistent else value.numpy())
+            for name, value in graph_state.items()
+        ]
+
+        if self.async_save:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+            # Blocks only while the previous checkpoint is still being written
+            self._queue.put((path, manifest, shards, graph_shards))
+        else:
+            self._write(path, manifest, shards, graph_shards)
+
+    def _layout_sizes(self):
+        dist_util = self.layout.dist_util
+        return {
+            "tensor_model_parallel_size": dist_util.tensor_model_parallel_size,
+            "pipeline_model_parallel_size": dist_util.pipeline_model_parallel_size,
+            "data_parallel_size": dist_util.data_parallel_size,
+        }
+
+    def wait(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._write(*item)
+
+    def _write(self, path, manifest, shards, graph_shards):
+        rank_dir = _rank_dir(path, self.rank)
+        os.makedirs(os.path.join(rank_dir, "graph"), exist_ok=True)
+        if self.rank == 0:
+            with open(os.path.join(path, MANIFEST_NAME), "w") as f:
+                json.dump(manifest, f, indent=2)
+
+        index = []
+        for name, offsets, array in shards:
+            file_name = name + ".npy"
+            np.save(os.path.join(rank_dir, file_name), array)
+            index.append(
+                {
+                    "name": name,
+                    "file": file_name,
+                    "offsets": offsets,
+                    "shape": list(array.shape),
+                }
+            )
+        for i, (name, array) in enumerate(graph_shards):
+            # variable names of the graph are not necessarily valid file names
+            file_name = os.path.join("graph", f"{i:05d}.npy")
+            np.save(os.path.join(rank_dir, file_name), array)
+            index.append({"name": name, "file": file_name, "graph": True})
+        tmp_file = _rank_index(path, self.rank) + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_file, _rank_index(path, self.rank))
+
+    def load(self, path):
+        """
+        Load the checkpoint at ``path`` into the model and the graph and return its
+        iteration. Must be called before the first call of the graph.
+        """
+        print_rank_0(f"Loading model from {path}")
+        with open(os.path.join(path, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+
+        shards = {}
+        graph_shards = {}
+        for rank in range(manifest["world_size"]):
+            index_file = _rank_index(path, rank)
+            if not os.path.exists(index_file):
+                raise RuntimeError(
+                    f"incomplete checkpoint {path}: missing {index_file}"
+                )
+            with open(index_file, "r") as f:
+                for shard in json.load(f):
+                    shard["file"] = os.path.join(_rank_dir(path, rank), shard["file"])
+                    if shard.get("graph", False):
+                        if rank == self.rank:
+                            graph_shards[shard["name"]] = shard["file"]
+                    else:
+                        shards.setdefault(shard["name"], []).append(shard)
+
+        state_dict = {}
+        for name, tensor in self.model.state_dict().items():
+            if name not in manifest["tensors"]:
+                raise KeyError(f"{name} is missing from checkpoint {path}")
+            saved_shape = manifest["tensors"][name]["shape"]
+            if saved_shape != list(tensor.shape):
+                raise ValueError(
+                    f"{name}: checkpoint shape {saved_shape} != model shape {list(tensor.shape)}"
+                )
+            local_slice = self.layout.local_slice(tensor, self.rank)
+            if local_slice is None:
+                local = flow.tensor(
+                    np.zeros([0] * len(tensor.shape), dtype=np.float32),
+                    dtype=tensor.dtype,
+                )
+            else:
+                offsets, shape, _ = local_slice
+                array = _assemble(shards.get(name, []), offsets, shape, name)
+                local = flow.tensor(array, dtype=tensor.dtype, device="cuda")
+            state_dict[name] = local.to_consistent(
+                placement=tensor.placement, sbp=tensor.sbp
+            )
+
+        self.model.load_state_dict(state_dict)
+        if self.graph is not None:
+            self._load_graph_state(path, manifest, graph_shards)
+        return manifest["iteration"]
+
+    def _load_graph_state(self, path, manifest, graph_shards):
+        names = manifest.get("graph_state", [])
+        same_layout = (
+            manifest["world_size"] == self.world_size
+            and manifest.get("layout") == self._layout_sizes()
+        )
+        if len(names) == 0 or not same_layout:
+            reason = (
+                "it holds no optimizer state"
+                if len(names) == 0
+                else "it was saved with a different parallel layout"
+            )
+            message = (
+                f"checkpoint {path}: {reason}, the optimizer moments and the learning "
+                "rate schedule restart from scratch"
+            )
+            warnings.warn(message)
+            print_rank_0(f"WARNING: {message}")
+            return
+
+        missing = [name for name in names if name not in graph_shards]
+        if len(missing) > 0:
+            raise RuntimeError(f"incomplete checkpoint {path}: missing {missing}")
+        self.graph.load_state_dict(
+            {
+                name: flow.tensor(np.load(graph_shards[name]), device="cuda")
+                for name in names
+            }
+        )
+
+
+def _assemble(shards, offsets, shape, name):
+    """Copy the region ``[offsets, offsets + shape)`` out of the saved slices."""
+    array = None
+    covered = 0
+    for shard in shards:
+        src_begin = shard["offsets"]
+        src_end = [o + s for o, s in zip(shard["offsets"], shard["shape"])]
+        begin = [max(a, b) for a, b in zip(offsets, src_begin)]
+        end = [min(a + s, b) for a, s, b in zip(offsets, shape, src_end)]
+        if any(b >= e for b, e in zip(begin, end)):
+            continue
+        src = np.load(shard["file"], mmap_mode="r")
+        if array is None:
+            array = np.empty(shape, dtype=src.dtype)
+        dst_index = tuple(slice(b - o, e - o) for b, e, o in zip(begin, end, offsets))
+        src_index = tuple(slice(b - o, e - o) for b, e, o in zip(begin, end, src_begin))
+        array[dst_index] = src[src_index]
+        covered += int(np.prod([e - b for b, e in zip(begin, end)]))
+
+    if covered != int(np.prod(shape)):
+        raise RuntimeError(f"{name}: checkpoint does not cover the requested slice")
+    return array
+
+
+def latest_checkpoint(root):
+    """Most recent complete ``iter_*`` checkpoint under ``root``, or None."""
+    if root is None or not os.path.isdir(root):
+        return None
+    candidates = sorted(
+        (d for d in os.listdir(root) if d.startswith("iter_")), reverse=True
+    )
+    for d in candidates:
+        path = os.path.join(root, d)
+        manifest_file = os.path.join(path, MANIFEST_NAME)
+        if not os.path.exists(manifest_file):
+            continue
+        with open(manifest_file, "r") as f:
+            world_size = json.load(f)["world_size"]
+        if all(os.path.exists(_rank_index(path, r)) for r in range(world_size)):
+            return path
+    return None
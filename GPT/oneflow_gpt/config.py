@@ -510,6 +510,12 @@ def _add_checkpointing_args(parser):
         default=False,
         help="save model snapshot for inited",
     )
+    group.add_argument(
+        "--no-async-save",
+        action="store_false",
+        dest="async_save",
+        help="Write checkpoints on the training thread instead of in the background.",
+    )
 
     return parser
 
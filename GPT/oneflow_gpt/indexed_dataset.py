@@ -0,0 +1,160 @@
+"""
+Writer for the Megatron-LM mmap indexed dataset read by ``flow.nn.GPTIndexedBinDataReader``.
+
+``<prefix>.bin`` holds the token ids of every sequence back to back. ``<prefix>.idx`` holds:
+
+    magic (9 bytes) | version (<Q) | dtype code (<B)
+    | number of sequences (<Q) | number of document boundaries (<Q)
+    | sizes (int32, tokens per sequence) | pointers (int64, byte offset of each sequence)
+    | doc_idx (int64, index of the first sequence of each document, plus the end)
+"""
+import os
+import shutil
+import struct
+
+import numpy as np
+
+
+_INDEX_MAGIC = b"MMIDIDX\x00\x00"
+_INDEX_VERSION = 1
+
+DTYPES = {
+    1: np.uint8,
+    2: np.int8,
+    3: np.int16,
+    4: np.int32,
+    5: np.int64,
+    6: np.float32,
+    7: np.float64,
+    8: np.uint16,
+}
+
+
+def dtype_code(dtype):
+    for code, d in DTYPES.items():
+        if d == dtype:
+            return code
+    raise ValueError(f"unsupported dtype {dtype}")
+
+
+def best_fitting_dtype(vocab_size):
+    if vocab_size is not None and vocab_size < 65500:
+        return np.uint16
+    return np.int32
+
+
+def data_file_path(prefix):
+    return prefix + ".bin"
+
+
+def index_file_path(prefix):
+    return prefix + ".idx"
+
+
+def write_index(path, dtype, sizes, doc_idx):
+    sizes = np.asarray(sizes, dtype=np.int32)
+    pointers = np.zeros(len(sizes), dtype=np.int64)
+    if len(sizes) > 1:
+        np.cumsum(sizes[:-1], dtype=np.int64, out=pointers[1:])
+    pointers *= np.dtype(dtype).itemsize
+    with open(path, "wb") as f:
+        f.write(_INDEX_MAGIC)
+        f.write(struct.pack("<Q", _INDEX_VERSION))
+        f.write(struct.pack("<B", dtype_code(dtype)))
+        f.write(struct.pack("<Q", len(sizes)))
+        f.write(struct.pack("<Q", len(doc_idx)))
+        f.write(sizes.tobytes(order="C"))
+        f.write(pointers.tobytes(order="C"))
+        f.write(np.asarray(doc_idx, dtype=np.int64).tobytes(order="C"))
+
+
+def read_index(path):
+    """Returns ``(dtype, sizes, doc_idx)`` of an index file, without the pointers."""
+    with open(path, "rb") as f:
+        magic = f.read(len(_INDEX_MAGIC))
+        if magic != _INDEX_MAGIC:
+            raise ValueError(f"{path} is not a mmap indexed dataset index")
+        (version,) = struct.unpack("<Q", f.read(8))
+        if version != _INDEX_VERSION:
+            raise ValueError(f"{path}: unsupported index version {version}")
+        (code,) = struct.unpack("<B", f.read(1))
+        (num_sizes,) = struct.unpack("<Q", f.read(8))
+        (num_docs,) = struct.unpack("<Q", f.read(8))
+        offset = f.tell()
+
+    if num_sizes == 0:
+        # np.memmap can't map zero bytes
+        return DTYPES[code], np.zeros(0, dtype=np.int32), np.zeros(1, dtype=np.int64)
+    sizes = np.memmap(path, dtype=np.int32, mode="r", offset=offset, shape=(num_sizes,))
+    offset += sizes.nbytes + num_sizes * np.dtype(np.int64).itemsize
+    doc_idx = np.memmap(
+        path, dtype=np.int64, mode="r", offset=offset, shape=(num_docs,)
+    )
+    return DTYPES[code], sizes, doc_idx
+
+
+class MMapIndexedDatasetBuilder(object):
+    """
+    Streams sequences into ``<prefix>.bin`` and writes ``<prefix>.idx`` on :meth:`finalize`.
+
+    Both files are written under a ``.tmp`` suffix and renamed on finalize, so a
+    partially written dataset is never mistaken for a complete one.
+    """
+
+    def __init__(self, prefix, dtype=np.int32):
+        self.prefix = prefix
+        self.dtype = dtype
+        self.sizes = []
+        self.doc_idx = [0]
+        self.num_bytes = 0
+        self._data_file = open(data_file_path(prefix) + ".tmp", "wb")
+
+    def add_item(self, token_ids):
+        array = np.asarray(token_ids, dtype=self.dtype)
+        self._data_file.write(array.tobytes(order="C"))
+        self.sizes.append(array.size)
+        self.num_bytes += array.nbytes
+
+    def end_document(self):
+        self.doc_idx.append(len(self.sizes))
+
+    def add_document(self, token_ids):
+        self.add_item(token_ids)
+        self.end_document()
+
+    def finalize(self):
+        self._data_file.close()
+        write_index(
+            index_file_path(self.prefix) + ".tmp", self.dtype, self.sizes, self.doc_idx
+        )
+        os.replace(data_file_path(self.prefix) + ".tmp", data_file_path(self.prefix))
+        os.replace(index_file_path(self.prefix) + ".tmp", index_file_path(self.prefix))
+
+
+def merge_indexed_datasets(prefixes, output_prefix):
+    """Concatenate the datasets at ``prefixes`` into one dataset at ``output_prefix``."""
+    dtype = None
+    sizes = []
+    doc_idx = [0]
+    with open(data_file_path(output_prefix) + ".tmp", "wb") as out:
+        for prefix in prefixes:
+            shard_dtype, shard_sizes, shard_doc_idx = read_index(
+                index_file_path(prefix)
+            )
+            if dtype is None:
+                dtype = shard_dtype
+            elif dtype != shard_dtype:
+                raise ValueError(
+                    f"{prefix} has dtype {shard_dtype.__name__}, expected {dtype.__name__}"
+                )
+            # doc_idx of a shard starts at 0, shift it past the sequences merged so far
+            doc_idx.extend((shard_doc_idx[1:] + len(sizes)).tolist())
+            sizes.extend(shard_sizes.tolist())
+            with open(data_file_path(prefix), "rb") as f:
+                shutil.copyfileobj(f, out, length=16 * 1024 * 1024)
+
+    write_index(
+        index_file_path(output_prefix) + ".tmp", dtype or np.int32, sizes, doc_idx
+    )
+    os.replace(data_file_path(output_prefix) + ".tmp", data_file_path(output_prefix))
+    os.replace(index_file_path(output_prefix) + ".tmp", index_file_path(output_prefix))
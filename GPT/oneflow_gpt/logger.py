@@ -1,13 +1,30 @@
+import os
+import json
 import time
+import queue
+import threading
 import numpy as np
 import oneflow as flow
 
 
 class Logger(object):
-    def __init__(self, rank):
+    """
+    Holds the registered metrics and prints them.
+
+    :meth:`print_metrics` formats the metrics on the calling thread. :meth:`log_metrics`
+    only snapshots them (no device sync) and hands the snapshot to a background thread.
+    That thread copies device values to host, prints the line and appends one
+    ``{"step", "tag", "value", "wall_time"}`` record per metric to ``metrics_file``.
+    Call :meth:`close` to flush pending records.
+    """
+
+    def __init__(self, rank, metrics_file=None, max_pending=16):
         self.rank = rank
         self.step = 0
         self.metrics = dict()
+        self.metrics_file = metrics_file
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = None
 
     def register_metric(
         self, metric_name, metric, print_format=None, reset_after_print=False
@@ -43,6 +60,69 @@ class Logger(object):
 
         print_ranks(ranks, "[rank:{}] {}".format(self.rank, ", ".join(fields)))
 
+    def log_metrics(self, step, ranks=None):
+        if ranks is None:
+            ranks = range(flow.env.get_world_size())
+
+        snapshots = []
+        for name, m in self.metrics.items():
+            metric = m["metric"]
+            # Non-logging ranks still reset, but never touch device values
+            if self.rank in ranks:
+                snapshots.append((name, m["print_format"], metric, metric.snapshot()))
+            if m["reset_after_print"]:
+                metric.reset()
+
+        if self.rank not in ranks:
+            return
+
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        # Blocks only if the writer falls ``max_pending`` intervals behind
+        self._queue.put((step, snapshots))
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _write_loop(self):
+        f = None
+        if self.metrics_file is not None:
+            os.makedirs(os.path.dirname(self.metrics_file) or ".", exist_ok=True)
+            f = open(self.metrics_file, "a")
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            step, snapshots = item
+            # Waiting for the device values of this step is its completion event
+            host_values = [metric.wait(snap) for _, _, metric, snap in snapshots]
+            done_time = time.perf_counter()
+            wall_time = time.time()
+
+            fields = []
+            for (name, fmt, metric, _), host_value in zip(snapshots, host_values):
+                value = metric.value(host_value, done_time)
+                fields.append(fmt.format(value))
+                if f is not None:
+                    record = {
+                        "step": step,
+                        "tag": name,
+                        "value": value,
+                        "wall_time": wall_time,
+                    }
+                    f.write(json.dumps(record) + "\n")
+            if f is not None:
+                f.flush()
+            print("[rank:{}] {}".format(self.rank, ", ".join(fields)), flush=True)
+
+        if f is not None:
+            f.close()
+
 
 class IterationMetric(object):
     def __init__(self):
@@ -54,6 +134,15 @@ class IterationMetric(object):
     def get_format_str(self, pattern):
         return pattern.format(self.val)
 
+    def snapshot(self):
+        return self.val
+
+    def wait(self, snapshot):
+        return snapshot
+
+    def value(self, snapshot, done_time):
+        return snapshot
+
 
 class LossMetric(object):
     def __init__(self):
@@ -107,6 +196,22 @@ class LossMetric(object):
         loss = self.get_avg_loss()
         return pattern.format(loss)
 
+    def snapshot(self):
+        # The sum is handed over as is, reset() starts a new tensor instead of adding to it
+        return (self.loss_sum, self.numel)
+
+    def wait(self, snapshot):
+        loss_sum, numel = snapshot
+        if isinstance(loss_sum, flow.Tensor):
+            loss_sum = loss_sum.numpy().item()
+        elif isinstance(loss_sum, np.ndarray):
+            loss_sum = loss_sum.item()
+        return (loss_sum, numel)
+
+    def value(self, snapshot, done_time):
+        loss_sum, numel = snapshot
+        return 0 if numel == 0 else loss_sum / numel
+
 
 class AccumulationMetric(object):
     def __init__(self):
@@ -118,12 +223,28 @@ class AccumulationMetric(object):
     def get_format_str(self, pattern):
         return pattern.format(self.acc)
 
+    def snapshot(self):
+        return self.acc
+
+    def wait(self, snapshot):
+        return snapshot
+
+    def value(self, snapshot, done_time):
+        return snapshot
+
 
 class ThroughputMetric(object):
+    """
+    ``get_format_str`` measures wall-clock time between prints. With
+    :meth:`Logger.log_metrics` the interval is instead taken between the completion
+    events of the logged steps, i.e. when their device values became available.
+    """
+
     def __init__(self):
         self.n = 0
         self.ets = None
         self.bts = None
+        self.last_done_time = None
         self.reset()
 
     def reset(self):
@@ -143,6 +264,21 @@ class ThroughputMetric(object):
         throughput = self.n / (self.ets - self.bts)
         return pattern.format(throughput)
 
+    def snapshot(self):
+        return (self.n, self.bts)
+
+    def wait(self, snapshot):
+        return snapshot
+
+    def value(self, snapshot, done_time):
+        # Called on the writer thread only
+        n, begin_time = snapshot
+        if self.last_done_time is not None:
+            begin_time = self.last_done_time
+        self.last_done_time = done_time
+        elapsed = done_time - begin_time
+        return n / elapsed if elapsed > 0 else 0.0
+
 
 def print_rank_0(*args, **kwargs):
     if flow.env.get_rank() == 0:
@@ -10,6 +10,7 @@ import oneflow as flow
 import oneflow._oneflow_internal
 
 from oneflow_gpt.config import get_args
+from oneflow_gpt.checkpoint import CheckpointManager, latest_checkpoint, MANIFEST_NAME
 from oneflow_gpt import distribute as dist
 from oneflow_gpt.data import GPTDataLoader
 from oneflow_gpt.model import GPTModel, Embedding, Logits
@@ -36,6 +37,7 @@ class Trainer(object):
         # NOTE(zwx): grad scaler is not available in eager mode
         self.grad_scaler = make_grad_scaler(self.args)
 
+        self.train_graph = None
         if self.args.graph:
             flow.boxing.nccl.enable_use_compute_stream(True)
 
@@ -48,9 +50,22 @@ class Trainer(object):
                 self.grad_scaler,
             )
 
-        # self.save("init")
+        # The optimizer and lr scheduler state is checkpointed from the graph, so the
+        # graph is built first and the checkpoint loaded before its first call
+        self.checkpoint = CheckpointManager(
+            self.model, self.train_graph, async_save=self.args.async_save
+        )
+        self.start_iteration = 0
+        if self.args.checkpoint_load_path is not None:
+            self.start_iteration = self.load(self.args.checkpoint_load_path)
+
+        if self.args.save_init:
+            self.save("init")
 
-        self.logger = Logger(self.rank)
+        self.logger = Logger(
+            self.rank,
+            metrics_file=os.path.join(self.args.log, f"metrics_rank{self.rank}.jsonl"),
+        )
         self.logger.register_metric("iter", IterationMetric())
         self.logger.register_metric("samples", AccumulationMetric())
         self.logger.register_metric("loss", LossMetric(), "loss: {:.5f}", True)
@@ -59,7 +74,7 @@ class Trainer(object):
         )
 
     def __call__(self):
-        iteration = 0
+        iteration = self.start_iteration
         while iteration < self.args.train_iters:
             if self.args.graph:
                 loss = self.train_graph()
@@ -73,15 +88,25 @@ class Trainer(object):
             # snapshot.step()
             # iteration = snapshot.iter
             iteration += 1
-            print(f"[{self.rank}] iteration: {iteration}")
 
+            # loss stays on device, it is copied to host by the logger's writer thread
             self.logger.meter("samples", self.args.global_batch_size)
             self.logger.meter("loss", loss)
             self.logger.meter("throughput", self.args.global_batch_size)
             if iteration % self.args.log_interval == 0:
                 self.logger.meter("iter", iteration)
-                self.logger.print_metrics([self.world_size - 1])
+                self.logger.log_metrics(iteration, [self.world_size - 1])
 
+            if self.args.save_interval and iteration % self.args.save_interval == 0:
+                self.save(f"iter_{iteration:07d}", iteration)
+
+        saved_last = (
+            self.args.save_interval and iteration % self.args.save_interval == 0
+        )
+        if self.args.save_last and not saved_last:
+            self.save(f"iter_{iteration:07d}", iteration)
+        self.checkpoint.wait()
+        self.logger.close()
         print(f"[{self.rank}] training finished")
 
     def train_eager(self):
@@ -94,15 +119,22 @@ class Trainer(object):
         self.lr_scheduler.step()
         return loss
 
-    def save(self, subdir):
+    def save(self, subdir, iteration=0):
         if self.args.checkpoint_save_path is None:
             return
 
+        # Every rank writes its own shards, nothing is gathered to rank 0
         save_path = os.path.join(self.args.checkpoint_save_path, subdir)
-        print_rank_0(f"Saving model to {save_path}")
-        state_dict = self.model.state_dict()
-
-        flow.save(state_dict, save_path, consistent_dst_rank=0)
+        self.checkpoint.save(save_path, iteration)
+
+    def load(self, path):
+        # ``path`` is either a checkpoint or a --save directory holding iter_* ones
+        if not os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            latest = latest_checkpoint(path)
+            if latest is None:
+                raise FileNotFoundError(f"no complete checkpoint found in {path}")
+            path = latest
+        return self.checkpoint.load(path)
 
 
 class GPTGraph(flow.nn.Graph):
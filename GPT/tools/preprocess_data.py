@@ -0,0 +1,224 @@
+"""
+Build the indexed binary dataset read by ``GPTDataLoader`` from raw JSONL or text.
+
+Documents are streamed from ``--input``, tokenized with the GPT-2 BPE tokenizer by a pool
+of worker processes and written into shards of ``--docs-per-shard`` documents under
+``<output-prefix>_shards/``. A shard becomes visible only when it is complete, so an
+interrupted run can be restarted with the same arguments and skips finished shards.
+Finally, the shards are merged into ``<output-prefix>_<json-key>_document.{bin,idx}``,
+which is the value to pass as ``--dataset``.
+
+Example:
+    python3 tools/preprocess_data.py \\
+        --input openwebtext.jsonl \\
+        --output-prefix /dataset/gpt/owt \\
+        --vocab-file gpt2-vocab.json \\
+        --merge-file gpt2-merges.txt \\
+        --append-eod \\
+        --workers 32
+"""
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+# The GPT-2 BPE tokenizer is maintained in NLP/GPT2, it is shared rather than copied
+sys.path.append(
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(__file__), os.path.pardir, os.path.pardir, "NLP", "GPT2"
+        )
+    )
+)
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import shutil
+import time
+
+from oneflow_gpt.indexed_dataset import (
+    MMapIndexedDatasetBuilder,
+    best_fitting_dtype,
+    index_file_path,
+    merge_indexed_datasets,
+)
+from tokenizer import build_tokenizer
+
+
+class Encoder(object):
+    def __init__(self, args):
+        self.args = args
+
+    def initializer(self):
+        # Each worker process builds its own tokenizer (and BPE cache)
+        Encoder.tokenizer = build_tokenizer(
+            vocab_file=self.args.vocab_file,
+            merges_file=self.args.merge_file,
+            tokenizer_type=self.args.tokenizer_type,
+        )
+
+    def encode(self, line):
+        if self.args.input_format == "jsonl":
+            text = json.loads(line)[self.args.json_key] if line.strip() else ""
+        else:
+            text = line.rstrip("\n")
+        token_ids = Encoder.tokenizer.tokenize(text) if text else []
+        if len(token_ids) > 0 and self.args.append_eod:
+            token_ids.append(Encoder.tokenizer.eod)
+        return token_ids, len(line.encode("utf-8"))
+
+
+class Progress(object):
+    def __init__(self, log_interval):
+        self.log_interval = log_interval
+        self.start_time = time.perf_counter()
+        self.num_docs = 0
+        self.num_bytes = 0
+
+    def update(self, num_bytes):
+        self.num_docs += 1
+        self.num_bytes += num_bytes
+        if self.num_docs % self.log_interval == 0:
+            self.print()
+
+    def print(self):
+        elapsed = time.perf_counter() - self.start_time
+        print(
+            f"processed {self.num_docs} documents"
+            f" ({self.num_docs / elapsed:.2f} docs/s,"
+            f" {self.num_bytes / elapsed / 1024 / 1024:.2f} MB/s)",
+            flush=True,
+        )
+
+
+def shard_prefix(args, shard_idx):
+    return os.path.join(args.output_prefix + "_shards", f"shard_{shard_idx:05d}")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Preprocess GPT training data")
+    group = parser.add_argument_group(title="input data")
+    group.add_argument("--input", type=str, required=True, help="Path to input file")
+    group.add_argument(
+        "--input-format",
+        type=str,
+        default="jsonl",
+        choices=["jsonl", "text"],
+        help="jsonl: one json object per line; text: one document per line",
+    )
+    group.add_argument(
+        "--json-key",
+        type=str,
+        default="text",
+        help="Key of the document text in each json object",
+    )
+
+    group = parser.add_argument_group(title="tokenizer")
+    group.add_argument(
+        "--tokenizer-type",
+        type=str,
+        default="GPT2BPETokenizer",
+        choices=["GPT2BPETokenizer"],
+        help="What type of tokenizer to use.",
+    )
+    group.add_argument("--vocab-file", type=str, required=True, help="Path to vocab")
+    group.add_argument(
+        "--merge-file", type=str, required=True, help="Path to BPE merge file"
+    )
+    group.add_argument(
+        "--append-eod",
+        action="store_true",
+        help="Append an <eod> token to the end of a document.",
+    )
+
+    group = parser.add_argument_group(title="output data")
+    group.add_argument(
+        "--output-prefix",
+        type=str,
+        required=True,
+        help="Path to binary output file without suffix",
+    )
+    group.add_argument(
+        "--docs-per-shard",
+        type=int,
+        default=1000000,
+        help="Number of input lines written to each resumable shard",
+    )
+    group.add_argument(
+        "--keep-shards",
+        action="store_true",
+        help="Do not delete the shards after merging them",
+    )
+
+    group = parser.add_argument_group(title="runtime")
+    group.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes"
+    )
+    group.add_argument(
+        "--chunk-size",
+        type=int,
+        default=64,
+        help="Number of documents sent to a worker at a time",
+    )
+    group.add_argument(
+        "--log-interval",
+        type=int,
+        default=10000,
+        help="Interval between progress updates",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    os.makedirs(args.output_prefix + "_shards", exist_ok=True)
+
+    encoder = Encoder(args)
+    encoder.initializer()
+    dtype = best_fitting_dtype(Encoder.tokenizer.vocab_size)
+    pool = multiprocessing.Pool(args.workers, initializer=encoder.initializer)
+    progress = Progress(args.log_interval)
+
+    shard_prefixes = []
+    with open(args.input, "r", encoding="utf-8") as fin:
+        for shard_idx in itertools.count():
+            lines = itertools.islice(fin, args.docs_per_shard)
+            first_line = next(lines, None)
+            if first_line is None:
+                break
+            lines = itertools.chain([first_line], lines)
+            prefix = shard_prefix(args, shard_idx)
+            shard_prefixes.append(prefix)
+
+            if os.path.exists(index_file_path(prefix)):
+                # Finished in an earlier run, only advance the input
+                num_lines = sum(1 for _ in lines)
+                print(f"skipping finished shard {prefix} ({num_lines} lines)")
+                continue
+
+            builder = MMapIndexedDatasetBuilder(prefix, dtype=dtype)
+            for token_ids, num_bytes in pool.imap(
+                encoder.encode, lines, args.chunk_size
+            ):
+                progress.update(num_bytes)
+                if len(token_ids) > 0:
+                    builder.add_document(token_ids)
+            builder.finalize()
+            print(f"finished shard {prefix}", flush=True)
+
+    pool.close()
+    pool.join()
+    progress.print()
+
+    output_prefix = f"{args.output_prefix}_{args.json_key}_document"
+    print(f"merging {len(shard_prefixes)} shards into {output_prefix}")
+    merge_indexed_datasets(shard_prefixes, output_prefix)
+    if not args.keep_shards:
+        shutil.rmtree(args.output_prefix + "_shards")
+
+
+if __name__ == "__main__":
+    main()
@@ -214,6 +214,7 @@ def main():
         weight_decay_excludes=["bias", "LayerNorm", "layer_norm"],
         clip_grad_max_norm=1,
         clip_grad_norm_type=2.0,
+        multi_tensor=args.multi_tensor_lamb,
     )
 
     steps = args.epochs * len(train_data_loader)
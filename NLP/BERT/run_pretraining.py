@@ -4,7 +4,6 @@ from functools import partial
 from typing import Dict
 
 
-import numpy as np
 import oneflow as flow
 from oneflow import nn
 
@@ -15,8 +14,8 @@ from modeling import BertForPreTraining
 from utils.ofrecord_data_utils import OfRecordDataLoader
 from utils.lr_scheduler import PolynomialLR
 from utils.optimizer import build_optimizer
-from utils.metric import Metric
-from utils.comm import ttol, tton
+from utils.metric import DeviceMetric
+from utils.comm import ttol
 from utils.checkpoint import save_model
 
 import config
@@ -138,37 +137,43 @@ def get_config():
         const=True,
         dest="metric_local",
     )
+    parser.add_argument(
+        "--multi-tensor-lamb",
+        type=str2bool,
+        default=False,
+        nargs="?",
+        const=True,
+        dest="multi_tensor_lamb",
+        help="Update each LAMB param group as flat buffers in eager mode",
+    )
 
     args = parser.parse_args()
     return args
 
 
-def pretrain(graph: nn.Graph, metric_local: bool) -> Dict:
+def pretrain(graph: nn.Graph) -> Dict:
 
     # NOTE(xyliao): when using gradient accumulation, graph call 1 step for 1 mini-batch(n micro-batch)
     next_sent_output, next_sent_labels, loss, mlm_loss, nsp_loss = graph()
 
-    # to local
-    next_sent_output = ttol(next_sent_output, metric_local)
-    next_sent_labels = ttol(next_sent_labels, metric_local)
+    # Local shards only, the metric is reduced across ranks when it is printed
+    next_sent_output = ttol(next_sent_output)
+    next_sent_labels = ttol(next_sent_labels)
 
-    # next sentence prediction accuracy
+    # next sentence prediction accuracy, kept on device
     correct = (
         next_sent_output.argmax(dim=1)
         .to(dtype=next_sent_labels.dtype)
         .eq(next_sent_labels.squeeze(1))
         .to(dtype=flow.float32)
         .sum()
-        .numpy()
-        .item()
     )
-    pred_acc = np.array(correct / next_sent_labels.nelement())
 
     return {
-        "total_loss": tton(loss.mean(), metric_local),
-        "mlm_loss": tton(mlm_loss.mean(), metric_local),
-        "nsp_loss": tton(nsp_loss.mean(), metric_local),
-        "pred_acc": pred_acc,
+        "total_loss": loss.mean(),
+        "mlm_loss": mlm_loss.mean(),
+        "nsp_loss": nsp_loss.mean(),
+        "pred_acc": (correct, next_sent_labels.nelement()),
     }
 
 
@@ -179,24 +184,24 @@ def validation(
     print_interval: int,
     metric_local: bool,
 ) -> float:
-    total_correct = 0
-    total_element = 0
+    metric = DeviceMetric(desc="bert validation", keys=["pred_acc"], local=metric_local)
     for i in range(iter_per_epoch):
 
         start_t = time.time()
 
         next_sent_output, next_sent_labels = graph()
 
-        next_sent_output = tton(next_sent_output, metric_local)
-        next_sent_labels = tton(next_sent_labels, metric_local)
-        end_t = time.time()
+        next_sent_output = ttol(next_sent_output)
+        next_sent_labels = ttol(next_sent_labels)
 
         # next sentence prediction accuracy
         correct = (
-            next_sent_output.argmax(axis=-1) == next_sent_labels.squeeze(1)
-        ).sum()
-        total_correct += correct
-        total_element += next_sent_labels.size
+            (next_sent_output.argmax(dim=-1) == next_sent_labels.squeeze(1))
+            .to(dtype=flow.float32)
+            .sum()
+        )
+        metric.accumulate({"pred_acc": (correct, next_sent_labels.nelement())})
+        end_t = time.time()
 
         if (i + 1) % print_interval == 0 and flow.env.get_rank() == 0:
             print(
@@ -205,13 +210,14 @@ def validation(
                 )
             )
 
+    val_acc = metric.compute()["pred_acc"]
     if flow.env.get_rank() == 0:
         print(
             "Epoch {}, val iter {}, total accuracy {:.2f}".format(
-                epoch, (i + 1), total_correct * 100.0 / total_element
+                epoch, (i + 1), val_acc * 100.0
             )
         )
-    return total_correct / total_element
+    return val_acc
 
 
 def main():
@@ -442,26 +448,23 @@ def main():
 
     bert_eval_graph = BertEvalGraph()
 
-    train_total_losses = []
-
     for epoch in range(args.epochs):
-        metric = Metric(
+        metric = DeviceMetric(
             desc="bert pretrain",
             print_steps=args.loss_print_every_n_iters,
             batch_size=args.train_global_batch_size * args.grad_acc_steps,
             keys=["total_loss", "mlm_loss", "nsp_loss", "pred_acc"],
+            local=args.metric_local,
         )
 
         # Train
         bert_model.train()
 
         for step in range(len(train_data_loader)):
-            bert_outputs = pretrain(bert_graph, args.metric_local)
-
-            if flow.env.get_rank() == 0:
-                metric.metric_cb(step, epoch=epoch)(bert_outputs)
+            bert_outputs = pretrain(bert_graph)
 
-            train_total_losses.append(bert_outputs["total_loss"])
+            # Every rank takes part in the reduction at print steps
+            metric.metric_cb(step, epoch=epoch)(bert_outputs)
 
     # Eval
     bert_model.eval()
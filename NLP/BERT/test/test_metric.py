@@ -0,0 +1,43 @@
+"""
+Run on 2 ranks:
+    python3 -m oneflow.distributed.launch --nproc_per_node 2 test/test_metric.py
+"""
+import os
+import sys
+import unittest
+
+import oneflow as flow
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.metric import DeviceMetric
+
+
+def _local_correct(rank):
+    # rank 0 predicts 3 of 4 samples right, rank 1 none of 2
+    correct = [3.0, 0.0][rank % 2]
+    count = [4, 2][rank % 2]
+    return flow.tensor([correct], device="cuda"), count
+
+
+class TestDeviceMetric(unittest.TestCase):
+    def test_local_shards_are_reduced(self):
+        rank = flow.env.get_rank()
+        world_size = flow.env.get_world_size()
+        self.assertEqual(world_size, 2)
+
+        metric = DeviceMetric(keys=["pred_acc"])
+        metric.accumulate({"pred_acc": _local_correct(rank)})
+        self.assertAlmostEqual(metric.compute()["pred_acc"], 3.0 / 6.0, places=5)
+
+    def test_local_metric(self):
+        rank = flow.env.get_rank()
+        metric = DeviceMetric(keys=["pred_acc"], local=True)
+        correct, count = _local_correct(rank)
+        metric.accumulate({"pred_acc": (correct, count)})
+        self.assertAlmostEqual(
+            metric.compute()["pred_acc"], float(correct.numpy()[0]) / count, places=5
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
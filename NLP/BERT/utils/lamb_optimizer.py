@@ -78,6 +78,18 @@ class LAMB(Optimizer):
         centered (bool, optional) : if ``True``, compute the centered RMSProp,
             the gradient is normalized by an estimation of its variance
         weight_decay (float, optional): weight decay (L2 penalty) (default: 0)
+        multi_tensor (bool, optional): in eager mode, update each param group as a few
+            flat buffers instead of launching one ``lamb_update`` per parameter
+            (default: False)
+
+    With ``multi_tensor``, the first ``step`` copies the parameters of every param group
+    into one contiguous buffer and allocates flat grad, ``exp_avg`` and ``exp_avg_sq``
+    buffers next to it. Each parameter, its grad and its moments in ``state_dict`` are
+    re-pointed at their slices of these buffers, so backward writes the grads in place
+    and every later step updates the whole group with a handful of element-wise
+    launches; the per-parameter trust ratios are reduced with one ``scatter_add`` over
+    segment ids. Parameters without grad are left untouched, as in the per-parameter
+    path. Graph mode is not affected.
 
     For example: 
 
@@ -134,6 +146,7 @@ class LAMB(Optimizer):
         weight_decay: float = 0,
         amsgrad: bool = False,
         do_bias_correction: bool = True,
+        multi_tensor: bool = False,
     ):
         assert lr >= 0.0, f"Invalid learning rate: {lr}"
         assert eps >= 0.0, f"Invalid epsilon value: {eps}"
@@ -156,6 +169,8 @@ class LAMB(Optimizer):
         options["do_bias_correction"] = do_bias_correction
 
         super().__init__(parameters, options)
+        self.multi_tensor = multi_tensor
+        self._buckets = None
 
         for param_group in self.param_groups:
             for param in param_group.parameters:
@@ -183,6 +198,9 @@ class LAMB(Optimizer):
             loss = None
             if closure is not None:
                 loss = closure()
+            if self.multi_tensor:
+                self._multi_tensor_step()
+                return loss
             for param_group in self.param_groups:
                 kwargs = {
                     "learning_rate_val": param_group["lr"],
@@ -209,6 +227,139 @@ class LAMB(Optimizer):
             self._state["step"] = self._state["step"] + 1
             return loss
 
+    def _build_buckets(self):
+        self._buckets = []
+        for param_group in self.param_groups:
+            params = [p for p in param_group.parameters if p.requires_grad]
+            if len(params) == 0:
+                self._buckets.append(None)
+                continue
+            assert all(
+                p.device == params[0].device and p.dtype == params[0].dtype
+                for p in params
+            ), "multi-tensor LAMB needs one device and dtype per param group"
+
+            flat_param = flow.cat([p.detach().reshape(-1) for p in params])
+            bucket = {
+                "params": params,
+                "sizes": [p.numel() for p in params],
+                "param": flat_param,
+                "grad": flow.zeros_like(flat_param),
+                "exp_avg": flow.zeros_like(flat_param),
+                "exp_avg_sq": flow.zeros_like(flat_param),
+            }
+            segment_ids = []
+            for i, (p, param_view, grad_view) in enumerate(
+                zip(params, self._views(bucket, "param"), self._views(bucket, "grad"))
+            ):
+                # The parameter and its grad become views of the flat buffers, so
+                # updating the buffer updates the model and backward fills the buffer
+                p.data = param_view
+                if p.grad is not None:
+                    grad_view.copy_(p.grad)
+                p.grad = grad_view
+                segment_ids.append(
+                    flow.full((p.numel(),), i, dtype=flow.int64, device=p.device)
+                )
+            bucket["grad_views"] = self._views(bucket, "grad")
+            bucket["segment_ids"] = flow.cat(segment_ids)
+            self._bind_state(bucket)
+            self._buckets.append(bucket)
+
+    def _views(self, bucket, key):
+        """Views of the flat buffer ``bucket[key]`` shaped like each parameter."""
+        views = []
+        offset = 0
+        for p, numel in zip(bucket["params"], bucket["sizes"]):
+            views.append(bucket[key].narrow(0, offset, numel).view(*p.shape))
+            offset += numel
+        return views
+
+    def _bind_state(self, bucket):
+        """Keeps the moments of each parameter in ``_state`` as views of the flat
+        moments, so ``state_dict`` and ``load_state_dict`` see them."""
+        for key in ("exp_avg", "exp_avg_sq"):
+            for p, view in zip(bucket["params"], self._views(bucket, key)):
+                if key in self._state[p]:
+                    view.copy_(self._state[p][key])
+                self._state[p][key] = view
+
+    def load_state_dict(self, state_dict):
+        super().load_state_dict(state_dict)
+        if self._buckets is not None:
+            for bucket in self._buckets:
+                if bucket is not None:
+                    self._bind_state(bucket)
+
+    def _multi_tensor_step(self):
+        if self._buckets is None:
+            self._build_buckets()
+        self._state["step"] = self._state["step"] + 1
+        step = self._state["step"]
+
+        for param_group, bucket in zip(self.param_groups, self._buckets):
+            if bucket is None:
+                continue
+            beta1, beta2 = param_group["betas"]
+            if param_group["do_bias_correction"]:
+                bias_correction1 = 1.0 - beta1 ** step
+                bias_correction2 = 1.0 - beta2 ** step
+            else:
+                bias_correction1 = bias_correction2 = 1.0
+
+            used = []
+            for p, grad_view in zip(bucket["params"], bucket["grad_views"]):
+                used.append(p.grad is not None)
+                if p.grad is not None and p.grad is not grad_view:
+                    # the grad was replaced, e.g. by zero_grad(set_to_none=True)
+                    grad_view.copy_(p.grad)
+                    p.grad = grad_view
+
+            param, grad = bucket["param"], bucket["grad"]
+            m, v = bucket["exp_avg"], bucket["exp_avg_sq"]
+            segment_ids = bucket["segment_ids"]
+            new_m = m * beta1 + grad * (1.0 - beta1)
+            new_v = v * beta2 + grad * grad * (1.0 - beta2)
+            if all(used):
+                active = None
+                m.copy_(new_m)
+                v.copy_(new_v)
+            else:
+                # Like the per-parameter path, params without grad are not updated
+                active = flow.gather(
+                    flow.tensor(used, dtype=flow.bool, device=param.device),
+                    0,
+                    segment_ids,
+                )
+                m.copy_(flow.where(active, new_m, m))
+                v.copy_(flow.where(active, new_v, v))
+
+            update = (m / bias_correction1) / (
+                flow.sqrt(v / bias_correction2) + param_group["eps"]
+            )
+            if param_group["weight_decay"] > 0:
+                update = update + param * param_group["weight_decay"]
+            if active is not None:
+                update = update * active.to(dtype=update.dtype)
+
+            # Per-parameter trust ratio ||w|| / ||update||, reduced over segments
+            norms = flow.zeros(
+                2, len(bucket["params"]), dtype=param.dtype, device=param.device
+            )
+            norms = flow.scatter_add(
+                norms,
+                1,
+                segment_ids.unsqueeze(0).expand(2, segment_ids.shape[0]),
+                flow.stack([param * param, update * update]),
+            )
+            norms = flow.sqrt(norms)
+            w_norm, u_norm = norms[0], norms[1]
+            trust_ratio = flow.where(
+                (w_norm > 0) & (u_norm > 0), w_norm / u_norm, flow.ones_like(w_norm)
+            )
+            scale = flow.gather(trust_ratio, 0, segment_ids) * param_group["lr"]
+            param.sub_(update * scale)
+
     def _generate_conf_for_graph(self, train_conf, vars_conf):
         new_opt_confs = []
         for param_group in self.param_groups:
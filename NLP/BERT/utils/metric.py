@@ -2,6 +2,8 @@ from collections import OrderedDict
 import time
 import os
 
+import oneflow as flow
+
 
 class StopWatch(object):
     def __init__(self):
@@ -102,3 +104,119 @@ class Metric(object):
                 self._clear()
 
         return callback
+
+
+class DeviceMetric(Metric):
+    def __init__(
+        self,
+        desc="train",
+        print_steps=-1,
+        batch_size=256,
+        keys=[],
+        local=False,
+        placement=None,
+        nvidia_smi_report_step=10,
+    ):
+        r"""accumulate metric on device and only copy it to host at print steps
+
+        Callback outputs map every key to a tensor, or to ``(tensor, count)``. The sum
+        of the tensor is added to the running sum of the key on device, ``count``
+        (``tensor.nelement()`` by default) to its count on host. At a print step the
+        sums and counts of all keys are reduced across ranks with a single collective
+        and every rank must call the callback.
+
+        Args:
+            local: `bool` report the metric of the local rank, without the collective
+            placement: placement of the collective, taken from the consistent outputs
+                or all devices of the type of the sums by default
+        """
+        self.local = local
+        self.placement = placement
+        self.rank = flow.env.get_rank()
+        self.world_size = flow.env.get_world_size()
+        super().__init__(
+            desc=desc,
+            print_steps=print_steps,
+            batch_size=batch_size,
+            keys=keys,
+            nvidia_smi_report_step=nvidia_smi_report_step,
+        )
+
+    def _clear(self):
+        super()._clear()
+        self.sums = None
+        self.counts = [0.0] * len(self.keys)
+
+    def accumulate(self, outputs):
+        values = []
+        for i, key in enumerate(self.keys):
+            value, count = outputs[key], None
+            if isinstance(value, tuple):
+                value, count = value
+            if value.is_consistent:
+                self.placement = value.placement
+                partial = value.sbp[0] == flow.sbp.partial_sum
+                value = value.to_local()
+                # the local parts of a partial sum add up to the value, count it once
+                if partial and self.rank != 0:
+                    count = 0
+            if count is None:
+                count = value.nelement()
+            values.append(value.sum().to(dtype=flow.float32))
+            self.counts[i] += count
+
+        step_sums = flow.stack(values)
+        self.sums = step_sums if self.sums is None else self.sums + step_sums
+
+    def compute(self):
+        """Mean of every key, the only point where the sums are copied to host."""
+        counts = flow.tensor(self.counts, dtype=flow.float32, device=self.sums.device)
+        totals = flow.cat([self.sums, counts])
+        if not self.local and self.world_size > 1:
+            placement = self.placement
+            if placement is None:
+                placement = flow.env.all_device_placement(self.sums.device.type)
+            totals = (
+                totals.to_consistent(placement=placement, sbp=flow.sbp.partial_sum)
+                .to_consistent(sbp=flow.sbp.broadcast)
+                .to_local()
+            )
+        totals = totals.numpy()
+        num_keys = len(self.keys)
+        return OrderedDict(
+            (key, totals[i] / max(totals[num_keys + i], 1.0))
+            for i, key in enumerate(self.keys)
+        )
+
+    def metric_cb(self, step=0, **kwargs):
+        def callback(outputs):
+            if step == 0:
+                self._clear()
+
+            if step == self.nvidia_smi_report_step and self.rank == 0:
+                cmd = "nvidia-smi --query-gpu=utilization.gpu,memory.used --format=csv"
+                os.system(cmd)
+
+            self.accumulate(outputs)
+            self.num_samples += self.batch_size
+
+            if (step + 1) % self.print_steps == 0:
+                self.metric_dict["step"] = step
+                for k, v in kwargs.items():
+                    self.metric_dict[k] = v
+                values = self.compute()
+                throughput = self.num_samples / self.timer.split()
+                self.update_and_save("throughput", throughput, step)
+                for key, value in values.items():
+                    self.update_and_save(key, value, step, **kwargs)
+                if self.rank == 0:
+                    print(
+                        ", ".join(
+                            ("{}: {}" if type(v) is int else "{}: {:.3f}").format(k, v)
+                            for k, v in self.metric_dict.items()
+                        ),
+                        time.time(),
+                    )
+                self._clear()
+
+        return callback
@@ -13,6 +13,7 @@ def build_optimizer(
     weight_decay_excludes: List[str],
     clip_grad_max_norm: float = None,
     clip_grad_norm_type: float = None,
+    multi_tensor: bool = False,
 ):
     assert optim_name in [
         "adamw",
@@ -49,7 +50,7 @@ def build_optimizer(
     if optim_name == "adamw":
         return flow.optim.AdamW(all_params)
     elif optim_name == "lamb":
-        return LAMB(all_params)
+        return LAMB(all_params, multi_tensor=multi_tensor)
 
 
 def build_sgd_optimizer(
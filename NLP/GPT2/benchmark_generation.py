@@ -0,0 +1,120 @@
+"""
+Decoding throughput of GPT-2 with and without the preallocated KV cache.
+
+Example:
+    python benchmark_generation.py --lengths 64 128 256 512 --batch_size 1
+"""
+import argparse
+import time
+
+import numpy as np
+import oneflow as flow
+
+from model_config import GPT2Config
+from model import GPT2LMHeadModel, GPT2KVCache
+
+
+def decode_full_prefix(model, context, length):
+    """Baseline: re-run the whole prefix through the model for every new token."""
+    generated = context
+    for _ in range(length):
+        logits = model(generated)[0]
+        next_token = logits[:, -1, :].argmax(-1)
+        generated = flow.cat((generated, next_token.unsqueeze(-1)), dim=1)
+    return generated
+
+
+def decode_kv_cache(model, context, length):
+    """Prefill once, then feed only the newest token against a GPT2KVCache."""
+    kv_cache = GPT2KVCache(
+        model.transformer.config,
+        batch_size=context.size(0),
+        max_length=context.size(1) + length,
+        dtype=model.transformer.wte.weight.dtype,
+        device=context.device,
+    )
+    generated = [context]
+    input_ids = context
+    for _ in range(length):
+        logits = model(input_ids, past_key_values=kv_cache, use_cache=True)[0]
+        input_ids = logits[:, -1, :].argmax(-1).unsqueeze(-1)
+        generated.append(input_ids)
+    return flow.cat(generated, dim=1)
+
+
+def benchmark(decode_fn, model, context, length, warmup, iters):
+    for _ in range(warmup):
+        decode_fn(model, context, length).numpy()
+    start = time.time()
+    for _ in range(iters):
+        # .numpy() waits for the device, so the timing covers the whole decode
+        decode_fn(model, context, length).numpy()
+    elapsed = (time.time() - start) / iters
+    return context.size(0) * length / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--restore_file", default=None, type=str)
+    parser.add_argument("--prompt_length", type=int, default=16)
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[32, 64, 128, 256, 512]
+    )
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--iters", type=int, default=3)
+    parser.add_argument(
+        "--skip_baseline",
+        action="store_true",
+        help="Only measure the KV-cache decoder",
+    )
+    parser.add_argument(
+        "--no_cuda", action="store_true", help="Avoid using CUDA when available"
+    )
+    args = parser.parse_args()
+
+    device = flow.device("cuda" if not args.no_cuda else "cpu")
+    config = GPT2Config()
+    model = GPT2LMHeadModel(config)
+    if args.restore_file is not None:
+        model.load_state_dict(flow.load(args.restore_file))
+    model.tie_weights()
+    model.to(device)
+    model.eval()
+
+    context = flow.tensor(
+        np.random.randint(
+            0, config.vocab_size, size=(args.batch_size, args.prompt_length)
+        ),
+        dtype=flow.long,
+        device=device,
+    )
+
+    print(
+        "{:>8} {:>16} {:>16} {:>8}".format(
+            "length", "full tok/s", "cache tok/s", "speedup"
+        )
+    )
+    with flow.no_grad():
+        for length in args.lengths:
+            if args.prompt_length + length > config.max_position_embeddings:
+                print("skip length {}: exceeds max positions".format(length))
+                continue
+            cached = benchmark(
+                decode_kv_cache, model, context, length, args.warmup, args.iters
+            )
+            if args.skip_baseline:
+                print("{:>8} {:>16} {:>16.1f} {:>8}".format(length, "-", cached, "-"))
+                continue
+            full = benchmark(
+                decode_full_prefix, model, context, length, args.warmup, args.iters
+            )
+            print(
+                "{:>8} {:>16.1f} {:>16.1f} {:>7.2f}x".format(
+                    length, full, cached, cached / full
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Batched multi-prompt generation for GPT-2.
+
+Prompts of different lengths are left-padded into one batch and decoded together against
+a shared :class:`GPT2KVCache`. Every request carries its own sampling parameters and stop
+condition, and finished requests are dropped from the batch so the remaining ones decode
+faster.
+
+Example:
+    python generation.py --restore_file gpt2_oneflow_model --prompts_file prompts.txt
+"""
+import argparse
+
+import numpy as np
+import oneflow as flow
+
+from model_config import GPT2Config
+from model import GPT2LMHeadModel, GPT2KVCache
+from tokenizer import build_tokenizer
+
+
+def top_k_top_p_filtering(logits, top_k=0, top_p=0.0, filter_value=-float("Inf")):
+    """ Filter a distribution of logits using top-k and/or nucleus (top-p) filtering
+        Args:
+            logits: logits distribution shape (batch size, vocabulary size)
+            top_k > 0: keep only top k tokens with highest probability (top-k filtering).
+            top_p > 0.0: keep the top tokens with cumulative probability >= top_p (nucleus filtering).
+                Nucleus filtering is described in Holtzman et al. (http://arxiv.org/abs/1904.09751)
+            top_k and top_p are either python scalars or per-row tensors of shape (batch size,).
+    """
+    batch_size, vocab_size = logits.size()
+    if not isinstance(top_k, flow.Tensor):
+        top_k = flow.full((batch_size,), top_k, dtype=flow.long, device=logits.device)
+    if not isinstance(top_p, flow.Tensor):
+        top_p = flow.full(
+            (batch_size,), top_p, dtype=logits.dtype, device=logits.device
+        )
+    top_k = top_k.clamp(0, vocab_size).view(batch_size, 1)
+    top_p = top_p.view(batch_size, 1)
+
+    sorted_logits, _ = flow.sort(logits, dim=-1, descending=True)
+    ranks = flow.arange(vocab_size, device=logits.device).view(1, vocab_size)
+    # top_k == 0 disables top-k filtering for that row
+    remove = (ranks >= top_k) & (top_k > 0)
+    sorted_logits = flow.where(
+        remove, flow.zeros_like(sorted_logits) + filter_value, sorted_logits
+    )
+
+    sorted_probs = sorted_logits.softmax(-1)
+    # Keep tokens until the cumulative probability reaches top_p, including the first
+    # token above the threshold
+    cumulative_probs = flow.cumsum(sorted_probs, dim=-1) - sorted_probs
+    remove = remove | ((cumulative_probs > top_p) & (top_p > 0.0) & (top_p < 1.0))
+
+    # Everything below the smallest kept logit of a row is filtered out
+    num_kept = flow.logical_not(remove).sum(-1, keepdim=True).to(flow.long)
+    threshold = sorted_logits.gather(1, (num_kept - 1).clamp(min=0))
+    return flow.where(
+        logits < threshold, flow.zeros_like(logits) + filter_value, logits
+    )
+
+
+def sample_next_tokens(logits, temperature, top_k, top_p):
+    """
+    Pick the next token of every row. Rows with ``temperature <= 0`` decode greedily, the
+    others sample from the filtered distribution with the Gumbel-max trick.
+    """
+    do_sample = temperature > 0
+    scale = flow.where(do_sample, temperature, flow.ones_like(temperature))
+    logits = logits / scale.view(-1, 1)
+    logits = top_k_top_p_filtering(logits, top_k=top_k, top_p=top_p)
+    uniform = flow.rand(*logits.size(), device=logits.device).clamp(1e-10, 1.0)
+    gumbel = -flow.log(-flow.log(uniform))
+    scores = logits + gumbel * do_sample.to(logits.dtype).view(-1, 1)
+    return scores.argmax(-1)
+
+
+class GenerationRequest(object):
+    """ One prompt and its decoding parameters.
+
+        Args:
+            prompt_ids: list of token ids
+            max_new_tokens: maximum number of tokens to generate
+            temperature: softmax temperature, 0 means greedy decoding
+            top_k: top-k filtering, 0 disables it
+            top_p: nucleus filtering, 0.0 disables it
+            eos_token_id: stop as soon as this token is generated
+    """
+
+    def __init__(
+        self,
+        prompt_ids,
+        max_new_tokens=20,
+        temperature=1.0,
+        top_k=0,
+        top_p=0.0,
+        eos_token_id=None,
+    ):
+        assert len(prompt_ids) > 0, "prompt must not be empty"
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.eos_token_id = eos_token_id
+        self.output_ids = []
+        self.finished = False
+
+    def append(self, token_id):
+        self.output_ids.append(token_id)
+        if token_id == self.eos_token_id or len(self.output_ids) >= self.max_new_tokens:
+            self.finished = True
+
+
+class BatchGenerator(object):
+    """ Decode a list of :class:`GenerationRequest` together.
+
+        The prompts are left-padded to the longest one, with position ids counted from
+        the first real token of every row and padding masked out of the attention.
+    """
+
+    def __init__(self, model, pad_token_id=0, device="cuda"):
+        self.model = model
+        self.config = model.transformer.config
+        self.pad_token_id = pad_token_id
+        self.device = flow.device(device) if isinstance(device, str) else device
+
+    def _prepare_inputs(self, requests):
+        prompt_length = max(len(r.prompt_ids) for r in requests)
+        input_ids = np.full(
+            (len(requests), prompt_length), self.pad_token_id, dtype=np.int64
+        )
+        attention_mask = np.zeros((len(requests), prompt_length), dtype=np.int64)
+        for i, r in enumerate(requests):
+            input_ids[i, prompt_length - len(r.prompt_ids) :] = r.prompt_ids
+            attention_mask[i, prompt_length - len(r.prompt_ids) :] = 1
+        position_ids = np.maximum(attention_mask.cumsum(-1) - 1, 0)
+        return input_ids, attention_mask, position_ids
+
+    def _tensor(self, array, dtype):
+        return flow.tensor(array, dtype=dtype, device=self.device)
+
+    def generate(self, requests):
+        requests = [r for r in requests if not r.finished and r.max_new_tokens > 0]
+        if len(requests) == 0:
+            return requests
+        input_ids, attention_mask, position_ids = self._prepare_inputs(requests)
+        prompt_length = input_ids.shape[1]
+        max_length = prompt_length + max(r.max_new_tokens for r in requests)
+        if max_length > self.config.max_position_embeddings:
+            raise ValueError(
+                "Can't decode {} positions, the model supports at most {}".format(
+                    max_length, self.config.max_position_embeddings
+                )
+            )
+
+        kv_cache = GPT2KVCache(
+            self.config,
+            batch_size=len(requests),
+            max_length=max_length,
+            dtype=self.model.transformer.wte.weight.dtype,
+            device=self.device,
+        )
+        # Columns past the prompt become valid as tokens are generated
+        full_mask = np.zeros((len(requests), max_length), dtype=np.int64)
+        full_mask[:, :prompt_length] = attention_mask
+        full_mask[:, prompt_length:] = 1
+        full_mask = self._tensor(full_mask, flow.long)
+
+        temperature = self._tensor([r.temperature for r in requests], flow.float32)
+        top_k = self._tensor([r.top_k for r in requests], flow.long)
+        top_p = self._tensor([r.top_p for r in requests], flow.float32)
+        next_positions = self._tensor(attention_mask.sum(-1), flow.long).view(-1, 1)
+
+        active = list(requests)
+        input_ids = self._tensor(input_ids, flow.long)
+        position_ids = self._tensor(position_ids, flow.long)
+        with flow.no_grad():
+            while len(active) > 0:
+                key_length = kv_cache.length + input_ids.size(1)
+                logits = self.model(
+                    input_ids,
+                    position_ids=position_ids,
+                    past_key_values=kv_cache,
+                    use_cache=True,
+                    attention_mask=full_mask[:, :key_length],
+                )[0]
+                next_tokens = sample_next_tokens(
+                    logits[:, -1, :], temperature, top_k, top_p
+                )
+                # The only host transfer of the step
+                for r, token_id in zip(active, next_tokens.numpy().tolist()):
+                    r.append(token_id)
+
+                keep = [i for i, r in enumerate(active) if not r.finished]
+                if len(keep) == 0:
+                    break
+                input_ids = next_tokens.view(-1, 1)
+                position_ids = next_positions
+                next_positions = next_positions + 1
+                if len(keep) < len(active):
+                    keep_index = self._tensor(keep, flow.long)
+                    kv_cache.index_select(keep_index)
+                    full_mask = full_mask.index_select(0, keep_index)
+                    temperature = temperature.index_select(0, keep_index)
+                    top_k = top_k.index_select(0, keep_index)
+                    top_p = top_p.index_select(0, keep_index)
+                    input_ids = input_ids.index_select(0, keep_index)
+                    position_ids = position_ids.index_select(0, keep_index)
+                    next_positions = next_positions.index_select(0, keep_index)
+                    active = [active[i] for i in keep]
+        return requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vocab_file", default="gpt2-vocab.json", type=str)
+    parser.add_argument("--merges_file", default="gpt2-merges.txt", type=str)
+    parser.add_argument(
+        "--restore_file",
+        default="gpt2_oneflow_model",
+        type=str,
+        help="Path to pre-trained model",
+    )
+    parser.add_argument(
+        "--prompts_file", type=str, required=True, help="One prompt per line"
+    )
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--length", type=int, default=20)
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--top_k", type=int, default=0)
+    parser.add_argument("--top_p", type=float, default=0.9)
+    parser.add_argument(
+        "--no_cuda", action="store_true", help="Avoid using CUDA when available"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42, help="random seed for initialization"
+    )
+    args = parser.parse_args()
+
+    device = flow.device("cuda" if not args.no_cuda else "cpu")
+    np.random.seed(args.seed)
+    flow.manual_seed(args.seed)
+
+    tokenizer = build_tokenizer(
+        vocab_file=args.vocab_file,
+        merges_file=args.merges_file,
+        tokenizer_type="GPT2BPETokenizer",
+    )
+    config = GPT2Config()
+    model = GPT2LMHeadModel(config)
+    if args.restore_file is not None:
+        model.load_state_dict(flow.load(args.restore_file))
+    model.tie_weights()
+    model.to(device)
+    model.eval()
+
+    with open(args.prompts_file, "r", encoding="utf-8") as f:
+        prompts = [line.rstrip("\n") for line in f if line.strip()]
+
+    generator = BatchGenerator(model, pad_token_id=tokenizer.eod, device=device)
+    for start in range(0, len(prompts), args.batch_size):
+        batch = [
+            GenerationRequest(
+                tokenizer.tokenize(prompt),
+                max_new_tokens=args.length,
+                temperature=args.temperature,
+                top_k=args.top_k,
+                top_p=args.top_p,
+                eos_token_id=tokenizer.eod,
+            )
+            for prompt in prompts[start : start + args.batch_size]
+        ]
+        generator.generate(batch)
+        for prompt, r in zip(prompts[start : start + args.batch_size], batch):
+            print("=" * 40)
+            print(prompt + tokenizer.detokenize(r.output_ids))
+
+
+if __name__ == "__main__":
+    main()
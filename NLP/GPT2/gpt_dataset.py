@@ -1,45 +1,136 @@
 import os
-import tqdm
-import random
-import pickle
+import struct
+import multiprocessing
 
 import numpy as np
 import oneflow as flow
 import oneflow.nn as nn
 
 
+_INDEX_MAGIC = b"GPTTOKS\x00"
+_INDEX_VERSION = 1
+# magic, version, token itemsize, number of chunks
+_INDEX_HEADER = struct.Struct("<8sQBQ")
+
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_chunk(text):
+    return _worker_tokenizer.tokenize(text)
+
+
+def _read_chunks(file_path, lines_per_chunk):
+    with open(file_path, "r", encoding="utf-8") as f:
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) == lines_per_chunk:
+                yield "".join(lines)
+                lines = []
+        if len(lines) > 0:
+            yield "".join(lines)
+
+
+def token_dtype(vocab_size):
+    return np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+def build_token_store(
+    file_path, tokenizer, prefix, num_workers=None, lines_per_chunk=1024
+):
+    """
+    Tokenize ``file_path`` into ``prefix.bin`` (all token ids as one flat uint16/uint32
+    array) and ``prefix.idx`` (header plus the int64 token offset of every chunk).
+
+    The text is streamed in chunks of ``lines_per_chunk`` lines that are tokenized by a
+    pool of ``num_workers`` processes, so memory use does not grow with the corpus.
+    """
+    dtype = token_dtype(tokenizer.vocab_size)
+    num_workers = num_workers or multiprocessing.cpu_count()
+    offsets = [0]
+    # Write to temporary files first so an interrupted build is never picked up as cache
+    with open(prefix + ".bin.tmp", "wb") as bin_file:
+        with multiprocessing.Pool(
+            num_workers, initializer=_init_worker, initargs=(tokenizer,)
+        ) as pool:
+            for token_ids in pool.imap(
+                _encode_chunk, _read_chunks(file_path, lines_per_chunk)
+            ):
+                np.asarray(token_ids, dtype=dtype).tofile(bin_file)
+                offsets.append(offsets[-1] + len(token_ids))
+
+    with open(prefix + ".idx.tmp", "wb") as idx_file:
+        idx_file.write(
+            _INDEX_HEADER.pack(
+                _INDEX_MAGIC,
+                _INDEX_VERSION,
+                np.dtype(dtype).itemsize,
+                len(offsets) - 1,
+            )
+        )
+        np.asarray(offsets, dtype=np.int64).tofile(idx_file)
+
+    os.replace(prefix + ".bin.tmp", prefix + ".bin")
+    os.replace(prefix + ".idx.tmp", prefix + ".idx")
+
+
+class TokenStore(object):
+    """Read-only, memory-mapped view of a token store written by :func:`build_token_store`."""
+
+    def __init__(self, prefix):
+        with open(prefix + ".idx", "rb") as f:
+            magic, version, itemsize, num_chunks = _INDEX_HEADER.unpack(
+                f.read(_INDEX_HEADER.size)
+            )
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError("{}.idx is not a token store index".format(prefix))
+        self.dtype = {2: np.uint16, 4: np.uint32}[itemsize]
+        self.offsets = np.memmap(
+            prefix + ".idx",
+            dtype=np.int64,
+            mode="r",
+            offset=_INDEX_HEADER.size,
+            shape=(num_chunks + 1,),
+        )
+        num_tokens = int(self.offsets[-1])
+        # np.memmap can't map an empty file
+        if num_tokens > 0:
+            self.tokens = np.memmap(
+                prefix + ".bin", dtype=self.dtype, mode="r", shape=(num_tokens,)
+            )
+        else:
+            self.tokens = np.zeros((0,), dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.tokens)
+
+
 class GPTDataset(flow.utils.data.Dataset):
     def __init__(
-        self, file_path, tokenizer, block_size: int,
+        self, file_path, tokenizer, block_size: int, num_workers=None,
     ):
         self.tokenizer = tokenizer
         self.block_size = block_size
 
         directory, filename = os.path.split(file_path)
-        cached_file = os.path.join(directory, f"cached_{block_size}_{filename}")
-        if os.path.exists(cached_file):
-            print("loading features from cached file")
-            with open(cached_file, "rb") as handle:
-                self.examples = pickle.load(handle)
+        # The token store does not depend on block_size, one build serves every seq_len
+        prefix = os.path.join(directory, f"cached_tokens_{filename}")
+        if os.path.exists(prefix + ".idx"):
+            print("loading tokens from cached token store")
         else:
-            print("creating features from dataset file")
-            self.examples = []
-            with open(file_path, "r", encoding="utf-8") as f:
-                text = f.read()
-
-            tokenized_text = self.tokenizer.tokenize(text)
-            while len(tokenized_text) >= self.block_size:
-                self.examples.append(tokenized_text[:block_size])
-                tokenized_text = tokenized_text[block_size:]
-
-            print("saving features into cached file")
-            with open(cached_file, "wb") as handle:
-                pickle.dump(self.examples, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            print("creating token store from dataset file")
+            build_token_store(file_path, tokenizer, prefix, num_workers=num_workers)
+        self.store = TokenStore(prefix)
 
     def __len__(self):
-        return len(self.examples)
+        return len(self.store) // self.block_size
 
     def __getitem__(self, index):
-        example = self.examples[index]
-        # return np.array(example, dtype=np.long)
-        return flow.tensor(example, dtype=flow.long)
+        start = index * self.block_size
+        # Slicing the memmap is zero-copy, only the block itself is widened to int64
+        return self.store.tokens[start : start + self.block_size].astype(np.int64)
@@ -61,6 +61,211 @@ class Conv1D(nn.Module):
         return x
 
 
+class _KVCacheBuffers(object):
+    """
+    Per-layer ``(batch, head, max_length, head_features)`` key and value buffers,
+    allocated once. Subclasses decide where a forward pass writes into them through
+    ``update(layer_idx, key, value)`` and ``advance(num_tokens)``.
+    """
+
+    def __init__(self, config, batch_size, max_length, dtype=flow.float32, device=None):
+        self.num_heads = config.num_attention_heads
+        self.head_dim = config.hidden_size // self.num_heads
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.device = device
+        shape = (batch_size, self.num_heads, max_length, self.head_dim)
+        self.keys = [
+            flow.zeros(shape, dtype=dtype, device=device)
+            for _ in range(config.num_hidden_layers)
+        ]
+        self.values = [
+            flow.zeros(shape, dtype=dtype, device=device)
+            for _ in range(config.num_hidden_layers)
+        ]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, layer_idx):
+        return _LayerKVCache(self, layer_idx)
+
+    def __iter__(self):
+        return (_LayerKVCache(self, i) for i in range(len(self.keys)))
+
+
+class GPT2KVCache(_KVCacheBuffers):
+    """
+    Preallocated per-layer key/value buffers for incremental decoding.
+
+    Every layer owns a ``(batch, head, max_length, head_features)`` buffer for keys and
+    one for values. A forward pass writes the new keys/values at ``[length, length + q)``
+    and attends over ``[0, length + q)``, so decoding a token never reallocates or
+    concatenates the prefix.
+    """
+
+    def __init__(self, config, batch_size, max_length, dtype=flow.float32, device=None):
+        super(GPT2KVCache, self).__init__(
+            config, batch_size, max_length, dtype=dtype, device=device
+        )
+        self.length = 0
+
+    @property
+    def past_length(self):
+        return self.length
+
+    def update(self, layer_idx, key, value):
+        start = self.length
+        end = start + key.size(-2)
+        if end > self.max_length:
+            raise ValueError(
+                "KV cache overflow: {} tokens exceed max_length {}".format(
+                    end, self.max_length
+                )
+            )
+        self.keys[layer_idx][:, :, start:end, :] = key
+        self.values[layer_idx][:, :, start:end, :] = value
+        return (
+            self.keys[layer_idx][:, :, :end, :],
+            self.values[layer_idx][:, :, :end, :],
+        )
+
+    def index_select(self, batch_indices):
+        """Keep only the rows in ``batch_indices``, e.g. to drop finished sequences."""
+        self.keys = [k.index_select(0, batch_indices) for k in self.keys]
+        self.values = [v.index_select(0, batch_indices) for v in self.values]
+        self.batch_size = batch_indices.size(0)
+
+    def advance(self, num_tokens):
+        self.length += num_tokens
+
+    def reset(self):
+        self.length = 0
+
+
+class GPT2SlabKVCache(_KVCacheBuffers):
+    """
+    Fixed pool of ``num_slots`` sequences of up to ``max_length`` tokens each, allocated once.
+
+    Sequences come and go independently and sit at different lengths. Active sequences are
+    packed into slots ``[0, num_active)``: releasing a slot moves the last active sequence
+    into it, so a decode step only touches views of the front of the buffers.
+
+    Before every forward, call :meth:`begin_prefill` to write one prompt into one slot, or
+    :meth:`begin_decode` to append one token to every active slot.
+    """
+
+    def __init__(self, config, num_slots, max_length, dtype=flow.float32, device=None):
+        super(GPT2SlabKVCache, self).__init__(
+            config, num_slots, max_length, dtype=dtype, device=device
+        )
+        self.num_slots = num_slots
+        self.num_active = 0
+        self.slot_lengths = [0] * num_slots
+        self._prefill_slot = None
+        self._positions = None
+
+    @property
+    def past_length(self):
+        # a prefill starts a new sequence, decode steps pass their own position ids
+        return 0
+
+    @property
+    def num_free(self):
+        return self.num_slots - self.num_active
+
+    def allocate(self):
+        if self.num_active == self.num_slots:
+            raise RuntimeError("No free slot in the KV cache")
+        slot = self.num_active
+        self.num_active += 1
+        self.slot_lengths[slot] = 0
+        return slot
+
+    def release(self, slot):
+        """
+        Free ``slot``. Returns the slot whose sequence was moved into ``slot`` to keep
+        the active slots packed, or None if nothing moved.
+        """
+        last = self.num_active - 1
+        self.num_active -= 1
+        if slot == last:
+            return None
+        length = self.slot_lengths[last]
+        for buffers in (self.keys, self.values):
+            for buf in buffers:
+                buf[slot, :, :length, :] = buf[last, :, :length, :]
+        self.slot_lengths[slot] = length
+        return last
+
+    def begin_prefill(self, slot):
+        self._prefill_slot = slot
+        self._positions = None
+
+    def begin_decode(self):
+        """Returns ``(position_ids, attention_mask)`` for a one-token decode step."""
+        self._prefill_slot = None
+        lengths = self.slot_lengths[: self.num_active]
+        span = max(lengths) + 1
+        if span > self.max_length:
+            raise ValueError(
+                "KV cache overflow: {} tokens exceed max_length {}".format(
+                    span, self.max_length
+                )
+            )
+        self._positions = flow.tensor(lengths, dtype=flow.long, device=self.device)
+        attention_mask = flow.arange(span, device=self.device).view(
+            1, span
+        ) <= self._positions.view(-1, 1)
+        return self._positions.view(-1, 1), attention_mask
+
+    def update(self, layer_idx, key, value):
+        keys, values = self.keys[layer_idx], self.values[layer_idx]
+        if self._prefill_slot is not None:
+            slot, length = self._prefill_slot, key.size(-2)
+            if length > self.max_length:
+                raise ValueError(
+                    "KV cache overflow: {} tokens exceed max_length {}".format(
+                        length, self.max_length
+                    )
+                )
+            keys[slot : slot + 1, :, :length, :] = key
+            values[slot : slot + 1, :, :length, :] = value
+            return (
+                keys[slot : slot + 1, :, :length, :],
+                values[slot : slot + 1, :, :length, :],
+            )
+
+        n = self.num_active
+        rows = flow.arange(n, device=self.device)
+        keys[rows, :, self._positions] = key[:, :, 0, :]
+        values[rows, :, self._positions] = value[:, :, 0, :]
+        span = max(self.slot_lengths[:n]) + 1
+        return keys[:n, :, :span, :], values[:n, :, :span, :]
+
+    def advance(self, num_tokens):
+        if self._prefill_slot is not None:
+            self.slot_lengths[self._prefill_slot] = num_tokens
+        else:
+            for slot in range(self.num_active):
+                self.slot_lengths[slot] += num_tokens
+
+    def reset(self):
+        self.num_active = 0
+        self.slot_lengths = [0] * self.num_slots
+
+
+class _LayerKVCache(object):
+    """View of one layer of a KV cache, passed to ``GPT2Attention`` as ``layer_past``."""
+
+    def __init__(self, cache, layer_idx):
+        self.cache = cache
+        self.layer_idx = layer_idx
+
+    def update(self, key, value):
+        return self.cache.update(self.layer_idx, key, value)
+
+
 class GPT2Attention(nn.Module):
     def __init__(self, config):
         super(GPT2Attention, self).__init__()
@@ -86,7 +291,7 @@ class GPT2Attention(nn.Module):
         self.attn_dropout = nn.Dropout(config.attn_pdrop)
         self.resid_dropout = nn.Dropout(config.resid_pdrop)
 
-    def _attn(self, query, key, value):
+    def _attn(self, query, key, value, attention_mask=None):
         attn_weights = flow.matmul(query, key.transpose(-2, -1))
 
         if self.scale_attn_weights:
@@ -99,6 +304,8 @@ class GPT2Attention(nn.Module):
         attn_weights = flow.where(
             causal_mask, attn_weights, self.masked_bias.to(attn_weights.dtype)
         )
+        if attention_mask is not None:
+            attn_weights = attn_weights + attention_mask
 
         attn_weights = nn.Softmax(dim=-1)(attn_weights)
         attn_weights = self.attn_dropout(attn_weights)
@@ -126,7 +333,9 @@ class GPT2Attention(nn.Module):
         new_shape = (bsz, seq_len, num_heads * attn_head_size)
         return tensor.view(*new_shape)
 
-    def forward(self, hidden_states, layer_past=None, use_cache=False):
+    def forward(
+        self, hidden_states, layer_past=None, use_cache=False, attention_mask=None
+    ):
         hidden_states = self.c_attn(hidden_states)
         query, key, value = flow.chunk(hidden_states, chunks=3, dim=2)
 
@@ -134,7 +343,9 @@ class GPT2Attention(nn.Module):
         key = self._split_heads(key, self.num_heads, self.head_dim)
         value = self._split_heads(value, self.num_heads, self.head_dim)
 
-        if layer_past is not None:
+        if isinstance(layer_past, _LayerKVCache):
+            key, value = layer_past.update(key, value)
+        elif layer_past is not None:
             past_key, past_value = layer_past
             key = flow.cat((past_key, key), dim=-2)
             value = flow.cat((past_value, value), dim=-2)
@@ -144,7 +355,7 @@ class GPT2Attention(nn.Module):
         else:
             present = None
 
-        attn_output, attn_weights = self._attn(query, key, value)
+        attn_output, attn_weights = self._attn(query, key, value, attention_mask)
 
         attn_output = self._merge_heads(attn_output, self.num_heads, self.head_dim)
         attn_output = self.c_proj(attn_output)
@@ -182,10 +393,12 @@ class GPT2Block(nn.Module):
         self.ln_2 = LayerNorm(hidden_size, eps=config.layer_norm_epsilon)
         self.mlp = GPT2MLP(inner_dim, config)
 
-    def forward(self, hidden_states, layer_past=None, use_cache=False):
+    def forward(
+        self, hidden_states, layer_past=None, use_cache=False, attention_mask=None
+    ):
         residual = hidden_states
         hidden_states = self.ln_1(hidden_states)
-        attn_outputs = self.attn(hidden_states, layer_past, use_cache)
+        attn_outputs = self.attn(hidden_states, layer_past, use_cache, attention_mask)
         attn_output = attn_outputs[0]
         outputs = attn_outputs[1:]
         hidden_states = attn_output + residual
@@ -207,6 +420,7 @@ class GPT2Block(nn.Module):
 class GPT2Model(nn.Module):
     def __init__(self, config):
         super(GPT2Model, self).__init__()
+        self.config = config
         self.embed_dim = config.hidden_size
 
         self.wte = nn.Embedding(config.vocab_size, self.embed_dim)
@@ -227,7 +441,12 @@ class GPT2Model(nn.Module):
         use_cache=False,
         output_attentions=False,
         output_hidden_states=False,
+        attention_mask=None,
     ):
+        """
+        ``attention_mask`` is an optional ``(batch, past_length + seq_length)`` tensor
+        with 1 for tokens to attend to and 0 for padding.
+        """
         input_shape = input_ids.size()
         input_ids = input_ids.view(-1, input_ids.size(-1))
         batch_size = input_ids.shape[0]
@@ -237,9 +456,13 @@ class GPT2Model(nn.Module):
         if token_type_ids is not None:
             token_type_ids = token_type_ids.view(-1, input_shape[-1])
 
+        kv_cache = None
         if past_key_values is None:
             past_length = 0
             past_key_values = [None] * len(self.h)
+        elif isinstance(past_key_values, _KVCacheBuffers):
+            kv_cache = past_key_values
+            past_length = kv_cache.past_length
         else:
             past_length = past_key_values[0][0].size(-2)
 
@@ -262,6 +485,12 @@ class GPT2Model(nn.Module):
 
         hidden_states = self.drop(hidden_states)
 
+        if attention_mask is not None:
+            # (batch, key_length) -> additive (batch, 1, 1, key_length)
+            attention_mask = attention_mask.view(batch_size, 1, 1, -1)
+            attention_mask = attention_mask.to(hidden_states.dtype)
+            attention_mask = (1.0 - attention_mask) * -10000.0
+
         presents = () if use_cache else None
         all_attentions = () if output_attentions else None
         all_hidden_states = () if output_hidden_states else None
@@ -269,14 +498,19 @@ class GPT2Model(nn.Module):
         for i, (block, layer_past) in enumerate(zip(self.h, past_key_values)):
             if output_hidden_states:
                 all_hidden_states = all_hidden_states + (hidden_states,)
-            outputs = block(hidden_states, layer_past, use_cache)
+            outputs = block(hidden_states, layer_past, use_cache, attention_mask)
             hidden_states = outputs[0]
-            if use_cache is True:
+            if use_cache is True and kv_cache is None:
                 presents = presents + (outputs[1],)
 
             if output_attentions:
                 all_attentions = all_attentions + (outputs[2 if use_cache else 1],)
 
+        if kv_cache is not None:
+            kv_cache.advance(input_shape[-1])
+            if use_cache:
+                presents = kv_cache
+
         hidden_states = self.ln_f(hidden_states)
         output_shape = (input_shape[0], input_shape[1], hidden_states.size(-1))
         hidden_states = hidden_states.view(*output_shape)
@@ -334,6 +568,7 @@ class GPT2LMHeadModel(nn.Module):
         use_cache=False,
         output_attentions=False,
         output_hidden_states=False,
+        attention_mask=None,
     ):
         transformer_outputs = self.transformer(
             input_ids,
@@ -343,6 +578,7 @@ class GPT2LMHeadModel(nn.Module):
             use_cache,
             output_attentions,
             output_hidden_states,
+            attention_mask,
         )
         hidden_states = transformer_outputs[0]
         lm_logits = self.lm_head(hidden_states)
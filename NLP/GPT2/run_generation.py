@@ -27,7 +27,8 @@ import numpy as np
 
 from model_config import GPT2Config
 
-from model import GPT2LMHeadModel
+from model import GPT2LMHeadModel, GPT2KVCache
+from generation import top_k_top_p_filtering
 from tokenizer import build_tokenizer
 
 
@@ -46,37 +47,6 @@ def set_seed(args):
     flow.manual_seed(args.seed)
 
 
-def top_k_top_p_filtering(logits, top_k=0, top_p=0.0, filter_value=-float("Inf")):
-    """ Filter a distribution of logits using top-k and/or nucleus (top-p) filtering
-        Args:
-            logits: logits distribution shape (vocabulary size)
-            top_k > 0: keep only top k tokens with highest probability (top-k filtering).
-            top_p > 0.0: keep the top tokens with cumulative probability >= top_p (nucleus filtering).
-                Nucleus filtering is described in Holtzman et al. (http://arxiv.org/abs/1904.09751)
-        From: https://gist.github.com/thomwolf/1a5a29f6962089e871b94cbd09daf317
-    """
-    top_k = min(top_k, logits.size(-1))  # Safety check
-    if top_k > 0:
-        # Remove all tokens with a probability less than the last token of the top-k
-        indices_to_remove = logits < flow.topk(logits, top_k)[0][..., -1, None]
-        logits[indices_to_remove] = filter_value
-
-    # todo: support top_p
-    # if top_p > 0.0:
-    #     sorted_logits, sorted_indices = flow.sort(logits, descending=True)
-    #     cumulative_probs = flow.cumsum(flow.softmax(sorted_logits, dim=-1), dim=-1)
-
-    #     # Remove tokens with cumulative probability above the threshold
-    #     sorted_indices_to_remove = cumulative_probs > top_p
-    #     # Shift the indices to the right to keep also the first token above the threshold
-    #     sorted_indices_to_remove[..., 1:] = sorted_indices_to_remove[..., :-1].clone()
-    #     sorted_indices_to_remove[..., 0] = 0
-
-    #     indices_to_remove = sorted_indices[sorted_indices_to_remove]
-    #     logits[indices_to_remove] = filter_value
-    return logits
-
-
 def sample_sequence(
     model,
     length,
@@ -87,14 +57,27 @@ def sample_sequence(
     top_p=0.0,
     device="cuda",
 ):
+    """ Generate ``length`` tokens after ``context``.
+
+        The prompt is run through the model once (prefill) to fill a preallocated
+        :class:`GPT2KVCache`, after which every step feeds only the newest token.
+    """
     context = flow.tensor(context, dtype=flow.long, device=device)
     context = context.unsqueeze(0).repeat(num_samples, 1)
-    generated = context
-    past_key_values = None
+    config = model.transformer.config
+    kv_cache = GPT2KVCache(
+        config,
+        batch_size=num_samples,
+        max_length=context.size(1) + length,
+        dtype=model.transformer.wte.weight.dtype,
+        device=context.device,
+    )
+    generated = [context]
+    input_ids = context
     with flow.no_grad():
         for _ in trange(length):
-            outputs = model(generated, past_key_values=past_key_values, use_cache=True)
-            logits, past_key_values = outputs[:2]
+            outputs = model(input_ids, past_key_values=kv_cache, use_cache=True)
+            logits = outputs[0]
             next_token_logits = logits[:, -1, :] / temperature
             filtered_logits = top_k_top_p_filtering(
                 next_token_logits, top_k=top_k, top_p=top_p
@@ -102,8 +85,9 @@ def sample_sequence(
             probs = filtered_logits.softmax(-1)
             next_token = probs.argmax(-1)
             # next_token = flow.multinomial(flow.softmax(filtered_logits, dim=-1), num_samples=1)
-            generated = flow.cat((generated, next_token.unsqueeze(0)), dim=1)
-    return generated
+            input_ids = next_token.unsqueeze(-1)
+            generated.append(input_ids)
+    return flow.cat(generated, dim=1)
 
 
 def main():
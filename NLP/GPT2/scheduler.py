@@ -0,0 +1,307 @@
+"""
+Continuous batching for GPT-2 inference.
+
+New requests join the running decode batch at token boundaries instead of waiting for the
+whole batch to finish. Finished sequences are evicted right away and their slot in the
+:class:`GPT2SlabKVCache` is reused, so the cache is allocated once for the lifetime of the
+scheduler.
+
+Example:
+    python scheduler.py --restore_file gpt2_oneflow_model --num_requests 256 --num_slots 32
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import oneflow as flow
+
+from model_config import GPT2Config
+from model import GPT2LMHeadModel, GPT2SlabKVCache
+from generation import GenerationRequest, sample_next_tokens
+
+
+class ScheduledRequest(GenerationRequest):
+    """ A :class:`GenerationRequest` with the timestamps recorded by the scheduler. """
+
+    def __init__(self, prompt_ids, **kwargs):
+        super(ScheduledRequest, self).__init__(prompt_ids, **kwargs)
+        self.enqueue_time = None
+        self.admit_time = None
+        self.first_token_time = None
+        self.finish_time = None
+        self.done = None
+
+    @property
+    def queueing_latency(self):
+        return self.admit_time - self.enqueue_time
+
+    @property
+    def time_to_first_token(self):
+        return self.first_token_time - self.enqueue_time
+
+    @property
+    def latency(self):
+        return self.finish_time - self.enqueue_time
+
+
+class SchedulerStats(object):
+    """ Aggregated latency and throughput of finished requests. """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.num_requests = 0
+        self.num_tokens = 0
+        self.num_steps = 0
+        self.queueing_latency = 0.0
+        self.time_to_first_token = 0.0
+        self.start_time = None
+        self.end_time = None
+
+    def update(self, request):
+        self.num_requests += 1
+        self.num_tokens += len(request.output_ids)
+        self.queueing_latency += request.queueing_latency
+        self.time_to_first_token += request.time_to_first_token
+
+    def summary(self):
+        n = max(self.num_requests, 1)
+        elapsed = (self.end_time or time.perf_counter()) - (
+            self.start_time or time.perf_counter()
+        )
+        return {
+            "requests": self.num_requests,
+            "tokens": self.num_tokens,
+            "decode_steps": self.num_steps,
+            "avg_queueing_latency": self.queueing_latency / n,
+            "avg_time_to_first_token": self.time_to_first_token / n,
+            "tokens_per_sec": self.num_tokens / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class ContinuousBatchingScheduler(object):
+    """ Decode requests in a batch that admits and evicts sequences at token boundaries.
+
+        Args:
+            model: a GPT2LMHeadModel in eval mode
+            num_slots: maximum number of sequences decoded together
+            max_length: maximum prompt + generated length of one sequence
+            device: device of the model
+    """
+
+    def __init__(self, model, num_slots=32, max_length=None, device="cuda"):
+        self.model = model
+        config = model.transformer.config
+        if max_length is None:
+            max_length = config.max_position_embeddings
+        self.max_length = min(max_length, config.max_position_embeddings)
+        self.device = flow.device(device) if isinstance(device, str) else device
+        self.kv_cache = GPT2SlabKVCache(
+            config,
+            num_slots,
+            self.max_length,
+            dtype=model.transformer.wte.weight.dtype,
+            device=self.device,
+        )
+        self.slots = [None] * num_slots
+        self.waiting = asyncio.Queue()
+        self.stats = SchedulerStats()
+        self._stopped = False
+
+    async def submit(self, request):
+        """Queue ``request`` and wait until it has finished."""
+        if len(request.prompt_ids) + request.max_new_tokens > self.max_length:
+            raise ValueError(
+                "Request needs {} positions, the scheduler supports at most {}".format(
+                    len(request.prompt_ids) + request.max_new_tokens, self.max_length
+                )
+            )
+        request.enqueue_time = time.perf_counter()
+        request.done = asyncio.get_event_loop().create_future()
+        await self.waiting.put(request)
+        await request.done
+        return request
+
+    def stop(self):
+        self._stopped = True
+
+    def _prefill(self, request):
+        slot = self.kv_cache.allocate()
+        self.slots[slot] = request
+        request.admit_time = time.perf_counter()
+        input_ids = flow.tensor(
+            [request.prompt_ids], dtype=flow.long, device=self.device
+        )
+        position_ids = flow.arange(
+            input_ids.size(1), dtype=flow.long, device=self.device
+        ).view(1, -1)
+        self.kv_cache.begin_prefill(slot)
+        logits = self.model(
+            input_ids,
+            position_ids=position_ids,
+            past_key_values=self.kv_cache,
+            use_cache=True,
+        )[0]
+        next_tokens = sample_next_tokens(
+            logits[:, -1, :],
+            flow.tensor([request.temperature], device=self.device),
+            flow.tensor([request.top_k], dtype=flow.long, device=self.device),
+            flow.tensor([request.top_p], device=self.device),
+        )
+        request.append(next_tokens.numpy().tolist()[0])
+        request.first_token_time = time.perf_counter()
+
+    def _decode(self):
+        active = self.slots[: self.kv_cache.num_active]
+        input_ids = flow.tensor(
+            [[r.output_ids[-1]] for r in active], dtype=flow.long, device=self.device
+        )
+        position_ids, attention_mask = self.kv_cache.begin_decode()
+        logits = self.model(
+            input_ids,
+            position_ids=position_ids,
+            past_key_values=self.kv_cache,
+            use_cache=True,
+            attention_mask=attention_mask,
+        )[0]
+        next_tokens = sample_next_tokens(
+            logits[:, -1, :],
+            flow.tensor([r.temperature for r in active], device=self.device),
+            flow.tensor([r.top_k for r in active], dtype=flow.long, device=self.device),
+            flow.tensor([r.top_p for r in active], device=self.device),
+        )
+        for r, token_id in zip(active, next_tokens.numpy().tolist()):
+            r.append(token_id)
+        self.stats.num_steps += 1
+
+    def _evict_finished(self):
+        slot = 0
+        while slot < self.kv_cache.num_active:
+            request = self.slots[slot]
+            if not request.finished:
+                slot += 1
+                continue
+            request.finish_time = time.perf_counter()
+            self.stats.update(request)
+            request.done.set_result(request)
+            moved = self.kv_cache.release(slot)
+            self.slots[slot] = None
+            if moved is not None:
+                # ``slot`` now holds the moved sequence, check it on the next iteration
+                self.slots[slot], self.slots[moved] = self.slots[moved], None
+
+    def _admit(self, admitted):
+        with flow.no_grad():
+            for request in admitted:
+                self._prefill(request)
+
+    def _step(self):
+        with flow.no_grad():
+            self._decode()
+        self.stats.end_time = time.perf_counter()
+
+    async def run(self):
+        """Serve requests until :meth:`stop` is called."""
+        loop = asyncio.get_event_loop()
+        while not self._stopped:
+            if self.kv_cache.num_active == 0 and self.waiting.empty():
+                try:
+                    request = await asyncio.wait_for(self.waiting.get(), timeout=0.1)
+                except asyncio.TimeoutError:
+                    continue
+                await self.waiting.put(request)
+            if self.stats.start_time is None:
+                self.stats.start_time = time.perf_counter()
+
+            admitted = []
+            while self.kv_cache.num_free > len(admitted) and not self.waiting.empty():
+                admitted.append(self.waiting.get_nowait())
+            # Run the model off the event loop so submissions keep flowing in.
+            # Futures are resolved on the loop thread, between the two model calls.
+            if len(admitted) > 0:
+                await loop.run_in_executor(None, self._admit, admitted)
+                self._evict_finished()
+            if self.kv_cache.num_active > 0:
+                await loop.run_in_executor(None, self._step)
+                self._evict_finished()
+
+
+async def _run_synthetic_load(scheduler, requests, arrival_rate):
+    server = asyncio.ensure_future(scheduler.run())
+    pending = []
+    for request in requests:
+        pending.append(asyncio.ensure_future(scheduler.submit(request)))
+        if arrival_rate > 0:
+            await asyncio.sleep(np.random.exponential(1.0 / arrival_rate))
+    await asyncio.gather(*pending)
+    scheduler.stop()
+    await server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--restore_file", default=None, type=str)
+    parser.add_argument("--num_slots", type=int, default=32)
+    parser.add_argument("--max_length", type=int, default=256)
+    parser.add_argument("--num_requests", type=int, default=256)
+    parser.add_argument(
+        "--arrival_rate",
+        type=float,
+        default=0.0,
+        help="Requests per second (Poisson), 0 submits everything at once",
+    )
+    parser.add_argument("--min_prompt_length", type=int, default=8)
+    parser.add_argument("--max_prompt_length", type=int, default=64)
+    parser.add_argument("--min_new_tokens", type=int, default=8)
+    parser.add_argument("--max_new_tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument(
+        "--no_cuda", action="store_true", help="Avoid using CUDA when available"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42, help="random seed for initialization"
+    )
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    flow.manual_seed(args.seed)
+    device = flow.device("cuda" if not args.no_cuda else "cpu")
+
+    config = GPT2Config()
+    model = GPT2LMHeadModel(config)
+    if args.restore_file is not None:
+        model.load_state_dict(flow.load(args.restore_file))
+    model.tie_weights()
+    model.to(device)
+    model.eval()
+
+    requests = [
+        ScheduledRequest(
+            np.random.randint(
+                0,
+                config.vocab_size,
+                size=np.random.randint(
+                    args.min_prompt_length, args.max_prompt_length + 1
+                ),
+            ).tolist(),
+            max_new_tokens=np.random.randint(
+                args.min_new_tokens, args.max_new_tokens + 1
+            ),
+            temperature=args.temperature,
+        )
+        for _ in range(args.num_requests)
+    ]
+    scheduler = ContinuousBatchingScheduler(
+        model, num_slots=args.num_slots, max_length=args.max_length, device=device
+    )
+    asyncio.get_event_loop().run_until_complete(
+        _run_synthetic_load(scheduler, requests, args.arrival_rate)
+    )
+    for key, value in scheduler.stats.summary().items():
+        print("{}: {}".format(key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -19,9 +19,12 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import sys
 import json
+import heapq
 import logging
+import multiprocessing
 import os
 import regex as re
+from collections import OrderedDict
 from io import open
 
 try:
@@ -48,6 +51,19 @@ PRETRAINED_VOCAB_POSITIONAL_EMBEDDINGS_SIZE_MAP = {
 VOCAB_NAME = "vocab.json"
 MERGES_NAME = "merges.txt"
 SPECIAL_TOKENS_NAME = "special_tokens.txt"
+DEFAULT_CACHE_SIZE = 100000
+
+_worker_tokenizer = None
+
+
+def _init_encode_worker(tokenizer):
+    # Every worker process owns a copy of the tokenizer, and with it its own BPE cache
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_in_worker(text):
+    return _worker_tokenizer.encode(text)
 
 
 @lru_cache()
@@ -95,6 +111,7 @@ class GPT2Tokenizer(object):
     """
     GPT-2 BPE tokenizer. Peculiarities:
         - Byte-level BPE
+        - BPE results of the ``cache_size`` most recently used words are kept in an LRU cache
     """
 
     @classmethod
@@ -187,6 +204,7 @@ class GPT2Tokenizer(object):
         errors="replace",
         special_tokens=None,
         max_len=None,
+        cache_size=DEFAULT_CACHE_SIZE,
     ):
         self.max_len = max_len if max_len is not None else int(1e12)
         self.encoder = json.load(open(vocab_file))
@@ -197,7 +215,8 @@ class GPT2Tokenizer(object):
         bpe_data = open(merges_file, encoding="utf-8").read().split("\n")[1:-1]
         bpe_merges = [tuple(merge.split()) for merge in bpe_data]
         self.bpe_ranks = dict(zip(bpe_merges, range(len(bpe_merges))))
-        self.cache = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
 
         # Should haved added re.IGNORECASE so BPE merges can happen for
         # capitalized versions of contractions
@@ -229,45 +248,64 @@ class GPT2Tokenizer(object):
 
     def bpe(self, token):
         if token in self.cache:
+            self.cache.move_to_end(token)
             return self.cache[token]
-        word = tuple(token)
-        pairs = get_pairs(word)
-
-        if not pairs:
+        if len(token) < 2:
             return token
 
-        while True:
-            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float("inf")))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except BaseException:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-                    new_word.append(first + second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = " ".join(word)
+        word = " ".join(self._merge(token))
         self.cache[token] = word
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
         return word
 
+    def _merge(self, token):
+        """
+        Apply the BPE merges to ``token``, lowest rank first.
+
+        Symbols form a linked list and candidate pairs sit in a heap keyed by
+        ``(rank, position)``, so every merge costs O(log n) instead of a scan over all
+        pairs. Entries whose symbols were changed by an earlier merge are skipped when
+        popped. Equal ranks mean the same pair, and those pop left to right, which
+        matches merging all occurrences of the best pair in one pass.
+        """
+        symbols = list(token)
+        next_index = list(range(1, len(symbols))) + [-1]
+        prev_index = list(range(-1, len(symbols) - 1))
+
+        heap = []
+        for i in range(len(symbols) - 1):
+            rank = self.bpe_ranks.get((symbols[i], symbols[i + 1]))
+            if rank is not None:
+                heap.append((rank, i, symbols[i], symbols[i + 1]))
+        heapq.heapify(heap)
+
+        while heap:
+            _, i, first, second = heapq.heappop(heap)
+            j = next_index[i]
+            # Symbols only ever grow, so an unchanged string means an unchanged symbol
+            if symbols[i] != first or j == -1 or symbols[j] != second:
+                continue
+            merged = first + second
+            symbols[i] = merged
+            symbols[j] = None
+            next_index[i] = next_index[j]
+            if next_index[j] != -1:
+                prev_index[next_index[j]] = i
+
+            left = prev_index[i]
+            if left != -1:
+                rank = self.bpe_ranks.get((symbols[left], merged))
+                if rank is not None:
+                    heapq.heappush(heap, (rank, left, symbols[left], merged))
+            right = next_index[i]
+            if right != -1:
+                rank = self.bpe_ranks.get((merged, symbols[right]))
+                if rank is not None:
+                    heapq.heappush(heap, (rank, i, merged, symbols[right]))
+
+        return [symbol for symbol in symbols if symbol is not None]
+
     def tokenize(self, text):
         """ Tokenize a string. """
         bpe_tokens = []
@@ -318,6 +356,18 @@ class GPT2Tokenizer(object):
     def encode(self, text):
         return self.convert_tokens_to_ids(self.tokenize(text))
 
+    def encode_batch(self, texts, num_workers=None, chunksize=16):
+        """ Encode a list of documents with a pool of ``num_workers`` processes.
+            Results keep the order of ``texts``.
+        """
+        num_workers = num_workers or multiprocessing.cpu_count()
+        if num_workers <= 1:
+            return [self.encode(text) for text in texts]
+        with multiprocessing.Pool(
+            num_workers, initializer=_init_encode_worker, initargs=(self,)
+        ) as pool:
+            return pool.map(_encode_in_worker, texts, chunksize=chunksize)
+
     def decode(self, tokens):
         text = "".join([self.decoder[token] for token in tokens])
         text = bytearray([self.byte_decoder[c] for c in text]).decode(
@@ -139,6 +139,9 @@ class _GPT2BPETokenizer(AbstractTokenizer):
     def tokenize(self, text):
         return self.tokenizer.encode(text)
 
+    def tokenize_batch(self, texts, num_workers=None):
+        return self.tokenizer.encode_batch(texts, num_workers=num_workers)
+
     def detokenize(self, token_ids):
         return self.tokenizer.decode(token_ids)
 
@@ -39,6 +39,12 @@ def main():
     parser.add_argument(
         "--num_workers", type=int, default=0, help="dataloader worker size"
     )
+    parser.add_argument(
+        "--preprocess_workers",
+        type=int,
+        default=None,
+        help="processes used to tokenize the dataset, defaults to cpu count",
+    )
 
     parser.add_argument("--lr", type=float, default=3e-4, help="learning rate of adam")
     parser.add_argument(
@@ -68,10 +74,17 @@ def main():
     )
 
     print("building train dataset")
-    train_dataset = GPTDataset(args.train_dataset, tokenizer, args.seq_len)
+    train_dataset = GPTDataset(
+        args.train_dataset,
+        tokenizer,
+        args.seq_len,
+        num_workers=args.preprocess_workers,
+    )
 
     print("building test dataset")
-    test_dataset = GPTDataset(args.test_dataset, tokenizer, args.seq_len)
+    test_dataset = GPTDataset(
+        args.test_dataset, tokenizer, args.seq_len, num_workers=args.preprocess_workers,
+    )
 
     print("building train dataloader")
     train_data_loader = DataLoader(
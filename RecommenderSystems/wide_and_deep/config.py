@@ -42,7 +42,40 @@ def get_args(print_args=True):
         "--dataset_format",
         type=str,
         default="ofrecord",
-        help="ofrecord, onerec or synthetic",
+        help="ofrecord, onerec, parquet or synthetic",
+    )
+    parser.add_argument(
+        "--label_column", type=str, default="label", help="parquet label column"
+    )
+    parser.add_argument(
+        "--dense_columns",
+        type=str_list,
+        default=["I{}".format(i) for i in range(1, 14)],
+        help="comma separated parquet dense columns",
+    )
+    parser.add_argument(
+        "--wide_sparse_columns",
+        type=str_list,
+        default=["C1_C2", "C3_C4"],
+        help="comma separated parquet wide sparse columns",
+    )
+    parser.add_argument(
+        "--deep_sparse_columns",
+        type=str_list,
+        default=["C{}".format(i) for i in range(1, 27)],
+        help="comma separated parquet deep sparse columns",
+    )
+    parser.add_argument(
+        "--shuffle_buffer_size",
+        type=int,
+        default=1 << 20,
+        help="parquet rows shuffled together",
+    )
+    parser.add_argument(
+        "--data_num_workers",
+        type=int,
+        default=4,
+        help="threads reading parquet row groups",
     )
     parser.add_argument("--data_part_num", type=int, default=256)
     parser.add_argument(
@@ -51,6 +84,19 @@ def get_args(print_args=True):
     parser.add_argument("--data_part_name_suffix_length", type=int, default=-1)
     parser.add_argument("--eval_batchs", type=int, default=20)
     parser.add_argument("--eval_interval", type=int, default=1000)
+    parser.add_argument(
+        "--eval_auc_mode",
+        type=str,
+        default="histogram",
+        choices=["histogram", "exact"],
+        help="histogram: binned AUC computed on device, exact: sorted on host",
+    )
+    parser.add_argument(
+        "--eval_auc_bins",
+        type=int,
+        default=65536,
+        help="number of bins of the histogram AUC",
+    )
     parser.add_argument("--batch_size", type=int, default=16384)
     parser.add_argument("--batch_size_per_proc", type=int, default=None)
     parser.add_argument("--learning_rate", type=float, default=1e-3)
@@ -59,6 +105,32 @@ def get_args(print_args=True):
     parser.add_argument("--deep_embedding_vec_size", type=int, default=16)
     parser.add_argument("--deep_dropout_rate", type=float, default=0.5)
     parser.add_argument("--num_dense_fields", type=int, default=13)
+    parser.add_argument(
+        "--dedup_sparse_ids",
+        action="store_true",
+        help="look up each distinct sparse id once per batch (eager mode only)",
+    )
+    parser.add_argument(
+        "--embedding_cache_size",
+        type=int,
+        default=0,
+        help="keep the embedding tables in host memory and cache this many rows on "
+        "device, 0 keeps the whole tables on device",
+    )
+    parser.add_argument(
+        "--embedding_cache_policy",
+        type=str,
+        default="lru",
+        choices=["lru", "lfu"],
+        help="eviction policy of the embedding cache",
+    )
+    parser.add_argument(
+        "--embedding_table_dir",
+        type=str,
+        default="",
+        help="memory-map the cached embedding tables from this directory instead of "
+        "keeping them in RAM",
+    )
     parser.add_argument("--max_iter", type=int, default=30000)
     parser.add_argument("--loss_print_every_n_iter", type=int, default=100)
     parser.add_argument("--num_wide_sparse_fields", type=int, default=2)
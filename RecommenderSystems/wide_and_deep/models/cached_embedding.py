@@ -0,0 +1,308 @@
+import os
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import oneflow as flow
+import oneflow.nn as nn
+
+
+__all__ = ["CachedEmbedding"]
+
+
+_Plan = namedtuple(
+    "_Plan",
+    ["slots", "inverse", "shape", "evict_slots", "evict_ids", "load_slots", "rows"],
+)
+
+
+class CachedEmbedding(nn.Module):
+    """Embedding whose full table lives in host memory, with the hot rows cached on
+    ``device``.
+
+    The table holds, for each of the ``vocab_size`` ids, the embedding and its two Adam
+    moments. It is kept in RAM, or in ``table_path`` (memory-mapped, created on first
+    use and reused afterwards). Checkpoints hold a copy of the table, written by
+    ``save_table`` and restored by ``load_table``. The device cache holds ``cache_size`` rows, evicted by least recent (``"lru"``) or least
+    frequent (``"lfu"``) use. The ids of a batch are deduplicated, the missing rows
+    loaded and the evicted dirty rows written back to the table by a background thread;
+    ``prefetch`` starts this work for the next batch while the current one runs.
+
+    The cache is not updated by a regular optimizer: ``step`` applies a lazy Adam update
+    to the rows looked up by the last training batch, so the moments stay with their id
+    when a row is evicted. The cache must hold at least the distinct ids of two batches.
+    """
+
+    def __init__(
+        self,
+        vocab_size,
+        embed_size,
+        cache_size,
+        table_path=None,
+        policy="lru",
+        device="cuda",
+        lr=1e-3,
+        betas=(0.9, 0.999),
+        eps=1e-8,
+        padding_idx=0,
+    ):
+        super(CachedEmbedding, self).__init__()
+        assert policy in ("lru", "lfu")
+        self.vocab_size = vocab_size
+        self.embed_size = embed_size
+        self.cache_size = cache_size
+        self.policy = policy
+        self.device = flow.device(device)
+        self.lr = lr
+        self.betas = betas
+        self.eps = eps
+        self.padding_idx = padding_idx
+        self.num_steps = 0
+
+        self.table = self._open_table(table_path)
+        self.weight = nn.Parameter(
+            flow.zeros(cache_size, embed_size, dtype=flow.float32, device=self.device)
+        )
+        self.exp_avg = flow.zeros(cache_size, embed_size, device=self.device)
+        self.exp_avg_sq = flow.zeros(cache_size, embed_size, device=self.device)
+
+        self.slot_of_id = np.empty(vocab_size, dtype=np.int64)
+        self.id_of_slot = np.empty(cache_size, dtype=np.int64)
+        self.last_used = np.empty(cache_size, dtype=np.int64)
+        self.dirty = np.empty(cache_size, dtype=np.bool_)
+        self.freq = np.zeros(vocab_size, dtype=np.int64) if policy == "lfu" else None
+        self.num_hits = 0
+        self.num_lookups = 0
+
+        # a single worker keeps plans and write backs in submission order
+        self._executor = ThreadPoolExecutor(1)
+        self._reset_cache()
+
+    def _reset_cache(self):
+        """Empties the device cache, the table is left as it is."""
+        self.slot_of_id.fill(-1)
+        self.id_of_slot.fill(-1)
+        self.last_used.fill(-1)
+        self.dirty.fill(False)
+        if self.freq is not None:
+            self.freq.fill(0)
+        self.seq = 0
+        self._pending = None
+        self._prefetched_ids = None
+        self._step_slots = None
+
+    def _open_table(self, table_path):
+        shape = (self.vocab_size, 3, self.embed_size)
+        if table_path is not None and os.path.exists(table_path):
+            return np.lib.format.open_memmap(table_path, mode="r+")
+        if table_path is None:
+            table = np.zeros(shape, dtype=np.float32)
+        else:
+            table = np.lib.format.open_memmap(
+                table_path + ".tmp", mode="w+", dtype=np.float32, shape=shape
+            )
+        rng = np.random.RandomState(0)
+        chunk = 1 << 20
+        for start in range(0, self.vocab_size, chunk):
+            stop = min(start + chunk, self.vocab_size)
+            table[start:stop, 0] = rng.uniform(
+                -0.05, 0.05, size=(stop - start, self.embed_size)
+            )
+            table[start:stop, 1:] = 0
+        if table_path is not None:
+            table.flush()
+            del table
+            os.replace(table_path + ".tmp", table_path)
+            table = np.lib.format.open_memmap(table_path, mode="r+")
+        return table
+
+    def _plan(self, ids, count_stats):
+        """Assigns cache slots to ``ids`` and reads the missing rows, runs on the worker."""
+        self.seq += 1
+        unique, inverse = np.unique(ids, return_inverse=True)
+        slots = self.slot_of_id[unique]
+        miss = slots < 0
+        miss_ids = unique[miss]
+        self.last_used[slots[~miss]] = self.seq
+        if self.freq is not None:
+            self.freq[unique] += 1
+        if count_stats:
+            self.num_lookups += len(unique)
+            self.num_hits += len(unique) - len(miss_ids)
+
+        load_slots = np.zeros(0, dtype=np.int64)
+        evict_slots = np.zeros(0, dtype=np.int64)
+        evict_ids = np.zeros(0, dtype=np.int64)
+        if len(miss_ids) > 0:
+            # slots of this batch and of the previous one (not stepped yet) stay
+            candidates = np.flatnonzero(self.last_used < self.seq - 1)
+            if len(candidates) < len(miss_ids):
+                raise RuntimeError(
+                    "embedding cache of {} rows is too small for {} new ids".format(
+                        self.cache_size, len(miss_ids)
+                    )
+                )
+            owners = self.id_of_slot[candidates]
+            if self.freq is None:
+                score = self.last_used[candidates]
+            else:
+                score = np.where(owners >= 0, self.freq[np.maximum(owners, 0)], -1)
+            if len(miss_ids) < len(candidates):
+                chosen = np.argpartition(score, len(miss_ids) - 1)[: len(miss_ids)]
+            else:
+                chosen = np.arange(len(candidates))
+            load_slots = candidates[chosen]
+            owners = owners[chosen]
+            evicted = owners >= 0
+            evict_slots, evict_ids = load_slots[evicted], owners[evicted]
+            self.slot_of_id[evict_ids] = -1
+
+            self.slot_of_id[miss_ids] = load_slots
+            self.id_of_slot[load_slots] = miss_ids
+            self.last_used[load_slots] = self.seq
+            slots[miss] = load_slots
+
+        return _Plan(
+            slots,
+            inverse,
+            ids.shape,
+            evict_slots,
+            evict_ids,
+            load_slots,
+            self.table[miss_ids],
+        )
+
+    def _write_rows(self, ids, rows):
+        self.table[ids] = rows
+
+    def _index(self, slots):
+        return flow.tensor(slots, dtype=flow.int64, device=self.device)
+
+    def _install_plan(self, plan):
+        """Writes back the evicted dirty rows and loads the new ones into the cache."""
+        dirty = self.dirty[plan.evict_slots]
+        if dirty.any():
+            evict_slots = plan.evict_slots[dirty]
+            index = self._index(evict_slots)
+            rows = flow.stack(
+                [self.weight[index], self.exp_avg[index], self.exp_avg_sq[index]],
+                dim=1,
+            ).numpy()
+            self._executor.submit(self._write_rows, plan.evict_ids[dirty], rows)
+        if len(plan.load_slots) > 0:
+            index = self._index(plan.load_slots)
+            rows = flow.tensor(plan.rows, device=self.device)
+            with flow.no_grad():
+                self.weight[index] = rows[:, 0]
+                self.exp_avg[index] = rows[:, 1]
+                self.exp_avg_sq[index] = rows[:, 2]
+            self.dirty[plan.load_slots] = False
+
+    def _apply_pending(self):
+        if self._pending is not None:
+            self._install_plan(self._pending.result())
+            self._pending = None
+
+    def _to_numpy(self, ids):
+        if isinstance(ids, flow.Tensor):
+            ids = ids.numpy()
+        return np.asarray(ids, dtype=np.int64)
+
+    def prefetch(self, ids):
+        """Starts loading the rows of the ids of the next batch in the background."""
+        self._apply_pending()
+        ids = self._to_numpy(ids)
+        self._pending = self._executor.submit(self._plan, ids, True)
+        self._prefetched_ids = ids
+
+    def forward(self, ids):
+        ids = self._to_numpy(ids)
+        prefetched = self._prefetched_ids is not None and np.array_equal(
+            ids, self._prefetched_ids
+        )
+        self._prefetched_ids = None
+        self._apply_pending()
+        plan = self._executor.submit(self._plan, ids, not prefetched).result()
+        self._install_plan(plan)
+        if self.training:
+            self._step_slots = plan.slots
+        index = self._index(plan.slots[plan.inverse].reshape(plan.shape))
+        return flow._C.gather(self.weight, index, axis=0)
+
+    def step(self):
+        """Lazy Adam update of the rows looked up by the last training batch."""
+        if self._step_slots is None or self.weight.grad is None:
+            return
+        slots = self._step_slots
+        if self.padding_idx is not None:
+            slots = slots[self.id_of_slot[slots] != self.padding_idx]
+        self._step_slots = None
+        self.num_steps += 1
+        beta1, beta2 = self.betas
+        bias_correction1 = 1 - beta1 ** self.num_steps
+        bias_correction2 = 1 - beta2 ** self.num_steps
+
+        index = self._index(slots)
+        with flow.no_grad():
+            grad = self.weight.grad[index]
+            exp_avg = self.exp_avg[index] * beta1 + grad * (1 - beta1)
+            exp_avg_sq = self.exp_avg_sq[index] * beta2 + grad * grad * (1 - beta2)
+            denom = flow.sqrt(exp_avg_sq / bias_correction2) + self.eps
+            self.weight[index] = (
+                self.weight[index] - self.lr * (exp_avg / bias_correction1) / denom
+            )
+            self.exp_avg[index] = exp_avg
+            self.exp_avg_sq[index] = exp_avg_sq
+            self.weight.grad.zero_()
+        self.dirty[slots] = True
+
+    def hit_rate(self, reset=True):
+        """Fraction of the distinct ids of each batch found in the cache."""
+        rate = self.num_hits / self.num_lookups if self.num_lookups > 0 else 0.0
+        if reset:
+            self.num_hits = 0
+            self.num_lookups = 0
+        return rate
+
+    def flush(self):
+        """Writes every dirty cached row back to the table."""
+        self._apply_pending()
+        slots = np.flatnonzero(self.dirty)
+        if len(slots) > 0:
+            index = self._index(slots)
+            rows = flow.stack(
+                [self.weight[index], self.exp_avg[index], self.exp_avg_sq[index]],
+                dim=1,
+            ).numpy()
+            self._executor.submit(self._write_rows, self.id_of_slot[slots], rows)
+            self.dirty[slots] = False
+        self._executor.submit(lambda: None).result()
+        if isinstance(self.table, np.memmap):
+            self.table.flush()
+
+    def save_table(self, path):
+        """Writes the table to ``path + ".npy"`` and the step count of the lazy Adam to
+        ``path + ".json"``, after flushing the cache."""
+        self.flush()
+        np.save(path + ".npy", self.table)
+        with open(path + ".json", "w") as f:
+            json.dump({"num_steps": self.num_steps}, f)
+
+    def load_table(self, path):
+        """Restores a table written by ``save_table`` and empties the cache."""
+        if self._pending is not None:
+            self._pending.result()
+        self._executor.submit(lambda: None).result()
+        saved = np.load(path + ".npy", mmap_mode="r")
+        if saved.shape != self.table.shape:
+            raise ValueError(
+                "{}: table shape {} != {}".format(path, saved.shape, self.table.shape)
+            )
+        chunk = 1 << 20
+        for start in range(0, self.vocab_size, chunk):
+            self.table[start : start + chunk] = saved[start : start + chunk]
+        if isinstance(self.table, np.memmap):
+            self.table.flush()
+        with open(path + ".json", "r") as f:
+            self.num_steps = json.load(f)["num_steps"]
+        self._reset_cache()
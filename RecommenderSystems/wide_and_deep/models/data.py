@@ -1,4 +1,8 @@
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import oneflow as flow
 import oneflow.nn as nn
 import glob
@@ -51,6 +55,23 @@ def make_data_loader(args, mode, is_global=False, data_format="ofrecord"):
             sbp=sbp,
         )
         return onerec_data_loader
+    elif data_format == "parquet":
+        parquet_data_loader = ParquetDataLoader(
+            data_dir=args.data_dir,
+            label_column=args.label_column,
+            dense_columns=args.dense_columns,
+            wide_sparse_columns=args.wide_sparse_columns,
+            deep_sparse_columns=args.deep_sparse_columns,
+            batch_size=batch_size_per_proc,
+            total_batch_size=total_batch_size,
+            mode=mode,
+            shuffle=True,
+            shuffle_buffer_size=args.shuffle_buffer_size,
+            num_workers=args.data_num_workers,
+            placement=placement,
+            sbp=sbp,
+        )
+        return parquet_data_loader
     elif data_format == "synthetic":
         synthetic_data_loader = SyntheticDataLoader(
             num_dense_fields=args.num_dense_fields,
@@ -63,7 +84,9 @@ def make_data_loader(args, mode, is_global=False, data_format="ofrecord"):
         )
         return synthetic_data_loader
     else:
-        raise ValueError("data format must be one of ofrecord, onerec or synthetic")
+        raise ValueError(
+            "data format must be one of ofrecord, onerec, parquet or synthetic"
+        )
 
 
 class OFRecordDataLoader(nn.Module):
@@ -177,6 +200,166 @@ class OneRecDataLoader(nn.Module):
         return labels, dense_fields, wide_sparse_fields, deep_sparse_fields
 
 
+class ParquetDataLoader(nn.Module):
+    """Reads Parquet files, e.g. the output of NVTabular, one row group at a time.
+
+    Files are memory-mapped and ``num_workers`` threads read and decode the columns of
+    the next row groups while batches are assembled by a background thread. The row
+    groups of each epoch are shuffled with the same seed on every rank and dealt out
+    round robin, so every rank reads its own part of the data; batches are drawn from a
+    buffer of at least ``shuffle_buffer_size`` rows, reshuffled at each refill.
+
+    A column of a field group is either a scalar column (one field) or a fixed-size
+    list column (one field per element). The sparse ids must already be unique across
+    fields, as in the OFRecord dataset.
+    """
+
+    def __init__(
+        self,
+        data_dir: str = "/dataset/wdl_parquet",
+        label_column: str = "label",
+        dense_columns=None,
+        wide_sparse_columns=None,
+        deep_sparse_columns=None,
+        batch_size: int = 1,
+        total_batch_size: int = 1,
+        mode: str = "train",
+        shuffle: bool = True,
+        shuffle_buffer_size: int = 0,
+        num_workers: int = 4,
+        prefetch: int = 4,
+        seed: int = 0,
+        placement=None,
+        sbp=None,
+    ):
+        super(ParquetDataLoader, self).__init__()
+        import pyarrow.parquet as pq
+
+        assert mode in ("train", "val")
+        self.pq = pq
+        self.total_batch_size = total_batch_size
+        self.placement = placement
+        self.sbp = sbp
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.num_workers = num_workers
+        self.seed = seed
+        self.rank = flow.env.get_rank()
+        self.world_size = flow.env.get_world_size()
+        if placement is not None:
+            # every rank reads its own part of the global batch
+            assert total_batch_size % self.world_size == 0
+            batch_size = total_batch_size // self.world_size
+        self.batch_size = batch_size
+
+        self.column_groups = [
+            [label_column],
+            dense_columns or ["I{}".format(i) for i in range(1, 14)],
+            wide_sparse_columns or ["C1_C2", "C3_C4"],
+            deep_sparse_columns or ["C{}".format(i) for i in range(1, 27)],
+        ]
+        self.dtypes = [np.int32, np.float32, np.int32, np.int32]
+        self.columns = [c for group in self.column_groups for c in group]
+
+        files = sorted(glob.glob(os.path.join(data_dir, mode, "*.parquet")))
+        assert len(files) > 0, "no parquet file in {}".format(
+            os.path.join(data_dir, mode)
+        )
+        self.row_groups = [
+            (path, i)
+            for path in files
+            for i in range(pq.ParquetFile(path).metadata.num_row_groups)
+        ]
+        assert len(self.row_groups) >= self.world_size, (
+            "{} row groups can not be shared by {} ranks, write smaller row "
+            "groups".format(len(self.row_groups), self.world_size)
+        )
+
+        self._local = threading.local()
+        self._batches = queue.Queue(maxsize=prefetch)
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _read_row_group(self, path, index):
+        files = getattr(self._local, "files", None)
+        if files is None:
+            files = self._local.files = {}
+        if path not in files:
+            files[path] = self.pq.ParquetFile(path, memory_map=True)
+        table = files[path].read_row_group(index, columns=self.columns)
+        fields = []
+        for group, dtype in zip(self.column_groups, self.dtypes):
+            arrays = []
+            for name in group:
+                column = table.column(name).combine_chunks()
+                if hasattr(column, "flatten"):
+                    arrays.append(
+                        column.flatten().to_numpy().reshape(table.num_rows, -1)
+                    )
+                else:
+                    arrays.append(column.to_numpy().reshape(table.num_rows, 1))
+            fields.append(np.concatenate(arrays, axis=1).astype(dtype, copy=False))
+        return fields
+
+    def _local_row_groups(self):
+        rng = np.random.RandomState(self.seed)
+        while True:
+            order = (
+                rng.permutation(len(self.row_groups))
+                if self.shuffle
+                else np.arange(len(self.row_groups))
+            )
+            for i in order[self.rank :: self.world_size]:
+                yield self.row_groups[i]
+
+    def _produce(self):
+        try:
+            self._produce_batches()
+        except Exception as e:
+            # raised again by forward
+            self._batches.put(e)
+
+    def _produce_batches(self):
+        rng = np.random.RandomState(self.seed + self.rank)
+        row_groups = self._local_row_groups()
+        buffer = None
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            reading = [
+                executor.submit(self._read_row_group, *next(row_groups))
+                for _ in range(self.num_workers)
+            ]
+            while True:
+                while buffer is None or len(buffer[0]) < max(
+                    self.batch_size, self.shuffle_buffer_size
+                ):
+                    fields = reading.pop(0).result()
+                    reading.append(
+                        executor.submit(self._read_row_group, *next(row_groups))
+                    )
+                    if buffer is not None:
+                        fields = [
+                            np.concatenate([old, new])
+                            for old, new in zip(buffer, fields)
+                        ]
+                    if self.shuffle:
+                        perm = rng.permutation(len(fields[0]))
+                        fields = [f[perm] for f in fields]
+                    buffer = fields
+                self._batches.put([f[: self.batch_size] for f in buffer])
+                buffer = [f[self.batch_size :] for f in buffer]
+
+    def forward(self):
+        batch = self._batches.get()
+        if isinstance(batch, Exception):
+            raise batch
+        tensors = [flow.tensor(f) for f in batch]
+        if self.placement is not None:
+            tensors = [
+                t.to_global(placement=self.placement, sbp=self.sbp) for t in tensors
+            ]
+        return tuple(tensors)
+
+
 class SyntheticDataLoader(nn.Module):
     def __init__(
         self,
@@ -0,0 +1,131 @@
+import oneflow as flow
+
+
+__all__ = ["unique_ids", "dedup_lookup", "sharded_lookup"]
+
+
+def unique_ids(ids):
+    """Returns the sorted distinct values of ``ids`` and, for every element of ``ids``,
+    the index of its value among them."""
+    flat = ids.reshape(-1)
+    sorted_ids, order = flow.sort(flat)
+    is_new = flow.cat(
+        [
+            flow.ones(1, dtype=flow.int64, device=flat.device),
+            (sorted_ids[1:] != sorted_ids[:-1]).to(dtype=flow.int64),
+        ]
+    )
+    group = flow.cumsum(is_new, dim=0) - 1
+    num_unique = int(group[-1:].numpy()[0]) + 1
+    unique = flow.scatter(
+        flow.zeros(num_unique, dtype=flat.dtype, device=flat.device),
+        0,
+        group,
+        sorted_ids,
+    )
+    inverse = flow.scatter(flow.zeros_like(group), 0, order.to(dtype=flow.int64), group)
+    return unique, inverse.reshape(ids.shape)
+
+
+def _no_padding_grad(rows, ids, padding_idx):
+    """``rows`` unchanged, but the rows of ``padding_idx`` get no gradient, like the
+    padding row of ``nn.Embedding``."""
+    if padding_idx is None:
+        return rows
+    keep = (ids != padding_idx).to(dtype=rows.dtype).unsqueeze(1)
+    return rows * keep + rows.detach() * (1 - keep)
+
+
+def dedup_lookup(weight, ids, padding_idx=None):
+    """Gathers the rows of ``weight`` for ``ids``, reading each distinct id once so its
+    gradient is accumulated into a single row before the update. The row of
+    ``padding_idx`` is not updated."""
+    unique, inverse = unique_ids(ids)
+    rows = _no_padding_grad(flow._C.gather(weight, unique, axis=0), unique, padding_idx)
+    return flow._C.gather(rows, inverse, axis=0)
+
+
+def _all_to_all(x):
+    """Sends ``x[r]`` to rank ``r``, returns what was received stacked by source rank."""
+    world_size = flow.env.get_world_size()
+    inputs = [x[r] for r in range(world_size)]
+    outputs = [flow.zeros_like(inputs[0]) for _ in range(world_size)]
+    flow.comm.all_to_all(outputs, inputs)
+    return flow.stack(outputs)
+
+
+class _AllToAll(flow.autograd.Function):
+    @staticmethod
+    def forward(ctx, x):
+        return _all_to_all(x)
+
+    @staticmethod
+    def backward(ctx, grad):
+        # every rank sends the gradients back to the rank that sent it the rows
+        return _all_to_all(grad)
+
+
+def _padded(x, start, stop, length, value):
+    """``x[start:stop]`` padded with ``value`` to ``length`` rows."""
+    if stop - start == length:
+        return x[start:stop]
+    padding = (
+        flow.zeros(length - (stop - start), dtype=x.dtype, device=x.device) + value
+    )
+    return flow.cat([x[start:stop], padding]) if stop > start else padding
+
+
+def sharded_lookup(weight, ids, rows_per_rank, padding_idx=None):
+    """Model parallel lookup into ``weight``, a global tensor split by rows where rank
+    ``r`` holds ids ``[r * rows_per_rank, (r + 1) * rows_per_rank)``.
+
+    ``ids`` is split by samples. Every rank deduplicates its ids and sends each owner
+    only the distinct ids it holds, the owners send back the rows and the result is
+    split by samples like ``ids``. The messages of an exchange are padded to the
+    largest one, since all-to-all needs equal sizes. The row of ``padding_idx`` is not
+    updated.
+    """
+    rank = flow.env.get_rank()
+    world_size = flow.env.get_world_size()
+    local_ids = ids.to_local()
+    device = local_ids.device
+    unique, inverse = unique_ids(local_ids)
+
+    # unique is sorted, so the ids of every owner are contiguous
+    bounds = flow.tensor(
+        [(r + 1) * rows_per_rank for r in range(world_size)],
+        dtype=unique.dtype,
+        device=device,
+    )
+    ends = (unique.unsqueeze(0) < bounds.unsqueeze(1)).to(dtype=flow.int64).sum(dim=1)
+    ends = ends.numpy().tolist()
+    starts = [0] + ends[:-1]
+    send_counts = [stop - start for start, stop in zip(starts, ends)]
+
+    counts = flow.zeros(world_size, world_size, dtype=flow.int64, device=device)
+    counts[rank] = flow.tensor(send_counts, dtype=flow.int64, device=device)
+    if world_size > 1:
+        flow.comm.all_reduce(counts)
+    counts = counts.numpy()
+    length = max(int(counts.max()), 1)
+
+    # the padding asks every owner for its first row, which is dropped on return
+    send_ids = flow.stack(
+        [
+            _padded(unique, starts[r], ends[r], length, r * rows_per_rank)
+            for r in range(world_size)
+        ]
+    )
+    recv_ids = _all_to_all(send_ids) if world_size > 1 else send_ids
+    rows = flow._C.gather(weight.to_local(), recv_ids - rank * rows_per_rank, axis=0)
+    recv_rows = _AllToAll.apply(rows) if world_size > 1 else rows
+    unique_rows = flow.cat(
+        [
+            recv_rows[r, : send_counts[r]]
+            for r in range(world_size)
+            if send_counts[r] > 0
+        ]
+    )
+    unique_rows = _no_padding_grad(unique_rows, unique, padding_idx)
+    out = flow._C.gather(unique_rows, inverse, axis=0)
+    return out.to_global(placement=ids.placement, sbp=flow.sbp.split(0))
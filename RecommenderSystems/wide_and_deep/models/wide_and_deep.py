@@ -1,7 +1,10 @@
+import os
 from collections import OrderedDict
 import oneflow as flow
 import oneflow.nn as nn
 from typing import Any
+from .cached_embedding import CachedEmbedding
+from .id_dedup import dedup_lookup, sharded_lookup
 
 
 __all__ = ["make_wide_and_deep_module"]
@@ -29,10 +32,56 @@ class Dense(nn.Module):
 
 
 class Embedding(nn.Embedding):
-    def __init__(self, vocab_size, embed_size):
+    def __init__(self, vocab_size, embed_size, dedup=False):
         super(Embedding, self).__init__(vocab_size, embed_size, padding_idx=0)
         for param in self.parameters():
             nn.init.uniform_(param, a=-0.05, b=0.05)
+        self.dedup = dedup
+
+    def forward(self, indices):
+        if self.dedup:
+            return dedup_lookup(self.weight, indices, self.padding_idx)
+        return super(Embedding, self).forward(indices)
+
+
+class ShardedEmbedding(Embedding):
+    """Embedding split by rows over all devices, looked up with the deduplicated ids
+    of every rank exchanged all-to-all."""
+
+    def __init__(self, vocab_size, embed_size):
+        world_size = flow.env.get_world_size()
+        rows_per_rank = (vocab_size + world_size - 1) // world_size
+        super(ShardedEmbedding, self).__init__(rows_per_rank, embed_size)
+        self.rows_per_rank = rows_per_rank
+        self.to_global(flow.env.all_device_placement("cuda"), flow.sbp.split(0))
+
+    def forward(self, indices):
+        return sharded_lookup(
+            self.weight, indices, self.rows_per_rank, self.padding_idx
+        )
+
+
+def _make_embedding(
+    vocab_size,
+    embed_size,
+    cache_size,
+    table_dir,
+    name,
+    cache_policy,
+    learning_rate,
+    dedup,
+):
+    if cache_size <= 0:
+        return Embedding(vocab_size, embed_size, dedup)
+    table_path = os.path.join(table_dir, name + ".npy") if table_dir else None
+    return CachedEmbedding(
+        vocab_size,
+        embed_size,
+        cache_size,
+        table_path=table_path,
+        policy=cache_policy,
+        lr=learning_rate,
+    )
 
 
 class GlobalWideAndDeep(nn.Module):
@@ -46,19 +95,29 @@ class GlobalWideAndDeep(nn.Module):
         hidden_size: int = 1024,
         hidden_units_num: int = 7,
         deep_dropout_rate: float = 0.5,
+        dedup_sparse_ids: bool = False,
     ):
         super(GlobalWideAndDeep, self).__init__()
 
-        self.wide_embedding = Embedding(wide_vocab_size // flow.env.get_world_size(), 1)
-        self.wide_embedding.to_global(
-            flow.env.all_device_placement("cuda"), flow.sbp.split(0)
-        )
-        self.deep_embedding = Embedding(
-            deep_vocab_size, deep_embedding_vec_size // flow.env.get_world_size()
-        )
-        self.deep_embedding.to_global(
-            flow.env.all_device_placement("cuda"), flow.sbp.split(1)
-        )
+        self.dedup_sparse_ids = dedup_sparse_ids
+        if dedup_sparse_ids:
+            self.wide_embedding = ShardedEmbedding(wide_vocab_size, 1)
+            self.deep_embedding = ShardedEmbedding(
+                deep_vocab_size, deep_embedding_vec_size
+            )
+        else:
+            self.wide_embedding = Embedding(
+                wide_vocab_size // flow.env.get_world_size(), 1
+            )
+            self.wide_embedding.to_global(
+                flow.env.all_device_placement("cuda"), flow.sbp.split(0)
+            )
+            self.deep_embedding = Embedding(
+                deep_vocab_size, deep_embedding_vec_size // flow.env.get_world_size()
+            )
+            self.deep_embedding.to_global(
+                flow.env.all_device_placement("cuda"), flow.sbp.split(1)
+            )
         deep_feature_size = (
             deep_embedding_vec_size * num_deep_sparse_fields + num_dense_fields
         )
@@ -92,20 +151,26 @@ class GlobalWideAndDeep(nn.Module):
     def forward(
         self, dense_fields, wide_sparse_fields, deep_sparse_fields
     ) -> flow.Tensor:
-        wide_sparse_fields = wide_sparse_fields.to_global(sbp=flow.sbp.broadcast)
-        wide_embedding = self.wide_embedding(wide_sparse_fields)
+        if self.dedup_sparse_ids:
+            # the sharded embeddings take and return tensors split by samples
+            wide_embedding = self.wide_embedding(wide_sparse_fields)
+            deep_embedding = self.deep_embedding(deep_sparse_fields)
+        else:
+            wide_sparse_fields = wide_sparse_fields.to_global(sbp=flow.sbp.broadcast)
+            wide_embedding = self.wide_embedding(wide_sparse_fields)
+            deep_sparse_fields = deep_sparse_fields.to_global(sbp=flow.sbp.broadcast)
+            deep_embedding = self.deep_embedding(deep_sparse_fields)
         wide_embedding = wide_embedding.view(
             -1, wide_embedding.shape[-1] * wide_embedding.shape[-2]
         )
         wide_scores = flow.sum(wide_embedding, dim=1, keepdim=True)
-        wide_scores = wide_scores.to_global(
-            sbp=flow.sbp.split(0), grad_sbp=flow.sbp.broadcast
-        )
-        deep_sparse_fields = deep_sparse_fields.to_global(sbp=flow.sbp.broadcast)
-        deep_embedding = self.deep_embedding(deep_sparse_fields)
-        deep_embedding = deep_embedding.to_global(
-            sbp=flow.sbp.split(0), grad_sbp=flow.sbp.split(2)
-        )
+        if not self.dedup_sparse_ids:
+            wide_scores = wide_scores.to_global(
+                sbp=flow.sbp.split(0), grad_sbp=flow.sbp.broadcast
+            )
+            deep_embedding = deep_embedding.to_global(
+                sbp=flow.sbp.split(0), grad_sbp=flow.sbp.split(2)
+            )
         deep_embedding = deep_embedding.view(
             -1, deep_embedding.shape[-1] * deep_embedding.shape[-2]
         )
@@ -126,10 +191,33 @@ class LocalWideAndDeep(nn.Module):
         hidden_size: int = 1024,
         hidden_units_num: int = 7,
         deep_dropout_rate: float = 0.5,
+        embedding_cache_size: int = 0,
+        embedding_table_dir: str = "",
+        embedding_cache_policy: str = "lru",
+        learning_rate: float = 1e-3,
+        dedup_sparse_ids: bool = False,
     ):
         super(LocalWideAndDeep, self).__init__()
-        self.wide_embedding = Embedding(wide_vocab_size, 1,)
-        self.deep_embedding = Embedding(deep_vocab_size, deep_embedding_vec_size)
+        self.wide_embedding = _make_embedding(
+            wide_vocab_size,
+            1,
+            embedding_cache_size,
+            embedding_table_dir,
+            "wide_embedding",
+            embedding_cache_policy,
+            learning_rate,
+            dedup_sparse_ids,
+        )
+        self.deep_embedding = _make_embedding(
+            deep_vocab_size,
+            deep_embedding_vec_size,
+            embedding_cache_size,
+            embedding_table_dir,
+            "deep_embedding",
+            embedding_cache_policy,
+            learning_rate,
+            dedup_sparse_ids,
+        )
         deep_feature_size = (
             deep_embedding_vec_size * num_deep_sparse_fields + num_dense_fields
         )
@@ -170,6 +258,10 @@ class LocalWideAndDeep(nn.Module):
 
 
 def make_wide_and_deep_module(args, is_global):
+    if args.embedding_cache_size > 0:
+        assert (
+            not is_global and flow.env.get_world_size() == 1
+        ), "embedding cache only supports training on a single device"
     if is_global:
         model = GlobalWideAndDeep(
             wide_vocab_size=args.wide_vocab_size,
@@ -180,6 +272,7 @@ def make_wide_and_deep_module(args, is_global):
             hidden_size=args.hidden_size,
             hidden_units_num=args.hidden_units_num,
             deep_dropout_rate=args.deep_dropout_rate,
+            dedup_sparse_ids=args.dedup_sparse_ids,
         )
     else:
         model = LocalWideAndDeep(
@@ -191,6 +284,11 @@ def make_wide_and_deep_module(args, is_global):
             hidden_size=args.hidden_size,
             hidden_units_num=args.hidden_units_num,
             deep_dropout_rate=args.deep_dropout_rate,
+            embedding_cache_size=args.embedding_cache_size,
+            embedding_table_dir=args.embedding_table_dir,
+            embedding_cache_policy=args.embedding_cache_policy,
+            learning_rate=args.learning_rate,
+            dedup_sparse_ids=args.dedup_sparse_ids,
         )
         model = model.to("cuda")
     return model
@@ -0,0 +1,126 @@
+"""
+Run on CPU:
+    python3 -m unittest test/test_cached_embedding.py
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import oneflow as flow
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.cached_embedding import CachedEmbedding
+
+
+VOCAB_SIZE = 40
+EMBED_SIZE = 4
+LR = 0.01
+BETAS = (0.9, 0.999)
+EPS = 1e-8
+
+
+def _make_batches(num_batches, seed=0):
+    rng = np.random.RandomState(seed)
+    return [
+        (
+            rng.randint(0, VOCAB_SIZE, size=(3, 2)),
+            rng.uniform(-1, 1, size=(3, 2, EMBED_SIZE)).astype(np.float32),
+        )
+        for _ in range(num_batches)
+    ]
+
+
+def _dense_lazy_adam(table, batches):
+    """Reference: the whole table in memory, the rows of each batch updated by Adam."""
+    table = table.copy()
+    for step, (ids, coef) in enumerate(batches, 1):
+        # the loss is sum(embedding * coef), so the gradient of a row is the sum of
+        # the coefficients of its occurrences
+        grad = np.zeros((VOCAB_SIZE, EMBED_SIZE), dtype=np.float32)
+        np.add.at(grad, ids.reshape(-1), coef.reshape(-1, EMBED_SIZE))
+        rows = np.unique(ids)
+        rows = rows[rows != 0]
+        g = grad[rows]
+        exp_avg = table[rows, 1] * BETAS[0] + g * (1 - BETAS[0])
+        exp_avg_sq = table[rows, 2] * BETAS[1] + g * g * (1 - BETAS[1])
+        denom = np.sqrt(exp_avg_sq / (1 - BETAS[1] ** step)) + EPS
+        table[rows, 0] -= LR * (exp_avg / (1 - BETAS[0] ** step)) / denom
+        table[rows, 1] = exp_avg
+        table[rows, 2] = exp_avg_sq
+    return table
+
+
+class TestCachedEmbedding(unittest.TestCase):
+    def _train(self, policy, prefetch):
+        embedding = CachedEmbedding(
+            VOCAB_SIZE,
+            EMBED_SIZE,
+            cache_size=16,
+            policy=policy,
+            device="cpu",
+            lr=LR,
+            betas=BETAS,
+            eps=EPS,
+        )
+        initial_table = np.array(embedding.table)
+        batches = _make_batches(30)
+        for i, (ids, coef) in enumerate(batches):
+            out = embedding(flow.tensor(ids))
+            if prefetch and i + 1 < len(batches):
+                # like the trainer, the next batch is planned before the backward pass
+                embedding.prefetch(flow.tensor(batches[i + 1][0]))
+            (out * flow.tensor(coef)).sum().backward()
+            embedding.step()
+        embedding.flush()
+        self.assertGreater(embedding.hit_rate(), 0.0)
+        expected = _dense_lazy_adam(initial_table, batches)
+        np.testing.assert_allclose(embedding.table, expected, rtol=1e-5, atol=1e-6)
+
+    def test_lru(self):
+        self._train("lru", prefetch=False)
+
+    def test_lru_prefetch(self):
+        self._train("lru", prefetch=True)
+
+    def test_lfu(self):
+        self._train("lfu", prefetch=False)
+
+    def test_lfu_prefetch(self):
+        self._train("lfu", prefetch=True)
+
+    def test_save_load_table(self):
+        embedding = CachedEmbedding(VOCAB_SIZE, EMBED_SIZE, cache_size=16, device="cpu")
+        batches = _make_batches(10)
+        for i, (ids, coef) in enumerate(batches):
+            (embedding(flow.tensor(ids)) * flow.tensor(coef)).sum().backward()
+            embedding.step()
+            if i == 4:
+                with tempfile.TemporaryDirectory() as save_dir:
+                    path = os.path.join(save_dir, "embedding")
+                    embedding.save_table(path)
+                    saved_table = np.array(embedding.table)
+                    restored = CachedEmbedding(
+                        VOCAB_SIZE, EMBED_SIZE, cache_size=16, device="cpu"
+                    )
+                    restored.load_table(path)
+        np.testing.assert_array_equal(restored.table, saved_table)
+        self.assertEqual(restored.num_steps, 5)
+
+        # the restored embedding continues exactly like the original one
+        for ids, coef in batches[5:]:
+            (restored(flow.tensor(ids)) * flow.tensor(coef)).sum().backward()
+            restored.step()
+        embedding.flush()
+        restored.flush()
+        np.testing.assert_allclose(restored.table, embedding.table, rtol=1e-6)
+
+    def test_cache_too_small(self):
+        embedding = CachedEmbedding(VOCAB_SIZE, EMBED_SIZE, cache_size=4, device="cpu")
+        with self.assertRaises(RuntimeError):
+            embedding(flow.tensor(np.arange(1, 7).reshape(3, 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
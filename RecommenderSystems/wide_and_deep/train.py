@@ -4,16 +4,16 @@ import sys
 sys.path.append(
     os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 )
-import numpy as np
 import oneflow as flow
-from sklearn.metrics import roc_auc_score
 from config import get_args
 from models.data import make_data_loader
 from models.wide_and_deep import make_wide_and_deep_module
+from models.cached_embedding import CachedEmbedding
 from oneflow.nn.parallel import DistributedDataParallel as DDP
 from graph import WideAndDeepValGraph, WideAndDeepTrainGraph
 import warnings
 import utils.logger as log
+from utils.metrics import make_eval_metrics
 
 
 class Trainer(object):
@@ -35,15 +35,33 @@ class Trainer(object):
                 UserWarning,
             )
             self.execution_mode = "eager"
+        if args.embedding_cache_size > 0 and self.execution_mode == "graph":
+            warnings.warn(
+                """the embedding cache only supports eager execution_mode, but it is graph""",
+                UserWarning,
+            )
+            self.execution_mode = "eager"
+        if args.dedup_sparse_ids and self.execution_mode == "graph":
+            warnings.warn(
+                """dedup_sparse_ids only supports eager execution_mode, but it is graph""",
+                UserWarning,
+            )
+            self.execution_mode = "eager"
         self.is_global = (
             flow.env.get_world_size() > 1 and not args.ddp
-        ) or args.execution_mode == "graph"
+        ) or self.execution_mode == "graph"
         self.rank = flow.env.get_rank()
         self.world_size = flow.env.get_world_size()
         self.cur_iter = 0
         self.eval_interval = args.eval_interval
         self.eval_batchs = args.eval_batchs
         self.init_logger()
+        self.eval_metrics = make_eval_metrics(
+            args.eval_auc_mode,
+            num_bins=args.eval_auc_bins,
+            capacity=args.eval_batchs
+            * (args.batch_size if self.is_global else args.batch_size_per_proc),
+        )
         self.train_dataloader = make_data_loader(
             args, "train", self.is_global, self.dataset_format
         )
@@ -51,8 +69,23 @@ class Trainer(object):
             args, "val", self.is_global, self.dataset_format
         )
         self.wdl_module = make_wide_and_deep_module(args, self.is_global)
+        cached_embeddings = [
+            (name, m)
+            for name, m in self.wdl_module.named_modules()
+            if isinstance(m, CachedEmbedding)
+        ]
+        self.cached_embedding_names = [name for name, _ in cached_embeddings]
+        self.cached_embeddings = [m for _, m in cached_embeddings]
+        self.next_train_batch = None
         self.init_model()
-        self.opt = flow.optim.Adam(self.wdl_module.parameters(), lr=args.learning_rate)
+        # cached embeddings apply their own sparse updates
+        cached_params = set(
+            id(p) for m in self.cached_embeddings for p in m.parameters()
+        )
+        self.opt = flow.optim.Adam(
+            [p for p in self.wdl_module.parameters() if id(p) not in cached_params],
+            lr=args.learning_rate,
+        )
 
         self.loss = flow.nn.BCELoss(reduction="none").to("cuda")
         if self.execution_mode == "graph":
@@ -89,10 +122,20 @@ class Trainer(object):
         self.train_logger.register_metric(
             "latency", log.LatencyMeter(), "latency(ms): {:.16f}", True
         )
+        if self.args.embedding_cache_size > 0:
+            self.train_logger.register_metric(
+                "cache_hit_rate", log.IterationMeter(), "cache_hit_rate: {:.4f}"
+            )
 
         self.val_logger = log.make_logger(self.rank, print_ranks)
         self.val_logger.register_metric("iter", log.IterationMeter(), "iter: {}/{}")
         self.val_logger.register_metric("auc", log.IterationMeter(), "eval_auc: {}")
+        self.val_logger.register_metric(
+            "logloss", log.IterationMeter(), "eval_logloss: {}"
+        )
+        self.val_logger.register_metric(
+            "calibration", log.IterationMeter(), "eval_calibration: {}"
+        )
 
     def meter(
         self, loss=None, do_print=False,
@@ -101,6 +144,9 @@ class Trainer(object):
         if loss is not None:
             self.train_logger.meter("loss", loss)
         self.train_logger.meter("latency")
+        if do_print and len(self.cached_embeddings) > 0:
+            hit_rates = [m.hit_rate() for m in self.cached_embeddings]
+            self.train_logger.meter("cache_hit_rate", sum(hit_rates) / len(hit_rates))
         if do_print:
             self.train_logger.print_metrics()
 
@@ -110,10 +156,10 @@ class Trainer(object):
             loss=loss, do_print=do_print,
         )
 
-    def meter_eval(self, auc):
+    def meter_eval(self, metrics):
         self.val_logger.meter("iter", (self.cur_iter, self.max_iter))
-        if auc is not None:
-            self.val_logger.meter("auc", auc)
+        for key, value in metrics.items():
+            self.val_logger.meter(key, value)
         self.val_logger.print_metrics()
 
     def load_state_dict(self):
@@ -125,6 +171,8 @@ class Trainer(object):
         else:
             return
         self.wdl_module.load_state_dict(state_dict)
+        for name, m in zip(self.cached_embedding_names, self.cached_embeddings):
+            m.load_table(os.path.join(self.args.model_load_dir, name))
 
     def save(self, subdir):
         if self.save_path is None or self.save_path == "":
@@ -139,6 +187,9 @@ class Trainer(object):
             flow.save(state_dict, save_path)
         else:
             return
+        # the state dict only holds the device cache of a cached embedding
+        for name, m in zip(self.cached_embedding_names, self.cached_embeddings):
+            m.save_table(os.path.join(save_path, name))
 
     def __call__(self):
         self.train()
@@ -158,25 +209,24 @@ class Trainer(object):
                 self.eval(self.save_model_after_each_eval)
         if self.eval_after_training:
             self.eval(True)
+        for m in self.cached_embeddings:
+            m.flush()
 
     def eval(self, save_model=False):
         if self.eval_batchs <= 0:
             return
         self.wdl_module.eval()
-        labels = np.array([[0]])
-        preds = np.array([[0]])
+        self.eval_metrics.reset()
         for _ in range(self.eval_batchs):
             if self.execution_mode == "graph":
                 pred, label = self.eval_graph()
             else:
                 pred, label = self.inference()
-            label_ = label.numpy().astype(np.float32)
-            labels = np.concatenate((labels, label_), axis=0)
-            preds = np.concatenate((preds, pred.numpy()), axis=0)
-        auc = roc_auc_score(labels[1:], preds[1:])
-        self.meter_eval(auc)
+            self.eval_metrics.update(pred, label)
+        metrics = self.eval_metrics.compute()
+        self.meter_eval(metrics)
         if save_model:
-            sub_save_dir = f"iter_{self.cur_iter}_val_auc_{auc}"
+            sub_save_dir = f"iter_{self.cur_iter}_val_auc_{metrics['auc']}"
             self.save(sub_save_dir)
         self.wdl_module.train()
 
@@ -189,8 +239,9 @@ class Trainer(object):
         ) = self.val_dataloader()
         labels = labels.to("cuda").to(dtype=flow.float32)
         dense_fields = dense_fields.to("cuda")
-        wide_sparse_fields = wide_sparse_fields.to("cuda")
-        deep_sparse_fields = deep_sparse_fields.to("cuda")
+        if len(self.cached_embeddings) == 0:
+            wide_sparse_fields = wide_sparse_fields.to("cuda")
+            deep_sparse_fields = deep_sparse_fields.to("cuda")
         with flow.no_grad():
             predicts = self.wdl_module(
                 dense_fields, wide_sparse_fields, deep_sparse_fields
@@ -198,17 +249,33 @@ class Trainer(object):
         return predicts, labels
 
     def forward(self):
+        if self.next_train_batch is None:
+            self.next_train_batch = self.train_dataloader()
         (
             labels,
             dense_fields,
             wide_sparse_fields,
             deep_sparse_fields,
-        ) = self.train_dataloader()
+        ) = self.next_train_batch
+        self.next_train_batch = None
         labels = labels.to("cuda").to(dtype=flow.float32)
         dense_fields = dense_fields.to("cuda")
-        wide_sparse_fields = wide_sparse_fields.to("cuda")
-        deep_sparse_fields = deep_sparse_fields.to("cuda")
+        if len(self.cached_embeddings) == 0:
+            # cached embeddings look up ids on host
+            wide_sparse_fields = wide_sparse_fields.to("cuda")
+            deep_sparse_fields = deep_sparse_fields.to("cuda")
         predicts = self.wdl_module(dense_fields, wide_sparse_fields, deep_sparse_fields)
+        if len(self.cached_embeddings) > 0:
+            # load the rows of the next batch while this one runs
+            self.next_train_batch = self.train_dataloader()
+            (
+                _,
+                _,
+                next_wide_sparse_fields,
+                next_deep_sparse_fields,
+            ) = self.next_train_batch
+            self.wdl_module.wide_embedding.prefetch(next_wide_sparse_fields)
+            self.wdl_module.deep_embedding.prefetch(next_deep_sparse_fields)
         loss = self.loss(predicts, labels)
         reduce_loss = flow.mean(loss)
         return reduce_loss
@@ -217,6 +284,8 @@ class Trainer(object):
         loss = self.forward()
         loss.backward()
         self.opt.step()
+        for m in self.cached_embeddings:
+            m.step()
         self.opt.zero_grad()
         return loss
 
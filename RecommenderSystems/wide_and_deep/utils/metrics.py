@@ -0,0 +1,154 @@
+import numpy as np
+import oneflow as flow
+
+
+__all__ = ["make_eval_metrics", "HistogramMetrics", "ExactMetrics"]
+
+
+_EPS = 1e-7
+
+
+def make_eval_metrics(mode, num_bins=65536, capacity=0):
+    if mode == "histogram":
+        return HistogramMetrics(num_bins)
+    elif mode == "exact":
+        return ExactMetrics(capacity)
+    else:
+        raise ValueError("eval auc mode must be one of histogram or exact")
+
+
+def _to_local(tensor):
+    return tensor.to_local() if tensor.is_global else tensor
+
+
+def _auc_from_counts(pos, neg):
+    """AUC from the positive and negative counts of groups of ascending scores,
+    pairs within a group count as ties."""
+    pos = pos.astype(np.float64)
+    neg = neg.astype(np.float64)
+    num_pos, num_neg = pos.sum(), neg.sum()
+    if num_pos == 0 or num_neg == 0:
+        return float("nan")
+    neg_below = np.cumsum(neg) - neg
+    return float(np.sum(pos * (neg_below + 0.5 * neg)) / (num_pos * num_neg))
+
+
+def _summarize(auc, logloss_sum, pred_sum, label_sum, count):
+    return {
+        "auc": auc,
+        "logloss": logloss_sum / count if count > 0 else float("nan"),
+        # predicted over observed click rate
+        "calibration": pred_sum / label_sum if label_sum > 0 else float("nan"),
+    }
+
+
+class HistogramMetrics(object):
+    """AUC, logloss and calibration accumulated on the device of the predictions.
+
+    Predictions are counted into ``num_bins`` equal-width bins per label, so memory
+    does not grow with the number of samples and only the histogram is copied to host.
+    Samples falling into the same bin count as ties, which bounds the AUC error by the
+    fraction of positive/negative pairs sharing a bin. Every rank counts its local
+    samples and ``compute`` sums them over all ranks.
+    """
+
+    def __init__(self, num_bins=65536):
+        self.num_bins = num_bins
+        self.reset()
+
+    def reset(self):
+        self.hist = None
+        self.sums = None
+
+    def update(self, preds, labels):
+        preds = _to_local(preds).reshape(-1)
+        labels = _to_local(labels).reshape(-1).to(dtype=flow.float32)
+        if self.hist is None:
+            self.hist = flow.zeros(
+                2 * self.num_bins, dtype=flow.int64, device=preds.device
+            )
+            self.sums = flow.zeros(3, dtype=flow.float64, device=preds.device)
+
+        bins = flow.clamp(
+            (preds * self.num_bins).to(dtype=flow.int64), 0, self.num_bins - 1
+        )
+        index = bins + labels.to(dtype=flow.int64) * self.num_bins
+        self.hist = flow.scatter_add(self.hist, 0, index, flow.ones_like(index))
+
+        p = flow.clamp(preds, _EPS, 1 - _EPS)
+        logloss = -(labels * flow.log(p) + (1 - labels) * flow.log(1 - p))
+        batch_sums = flow.stack([logloss.sum(), preds.sum(), labels.sum()])
+        self.sums = self.sums + batch_sums.to(dtype=flow.float64)
+
+    def compute(self):
+        if self.hist is None:
+            return _summarize(float("nan"), 0.0, 0.0, 0.0, 0)
+        if flow.env.get_world_size() > 1:
+            flow.comm.all_reduce(self.hist)
+            flow.comm.all_reduce(self.sums)
+        neg, pos = self.hist.numpy().reshape(2, self.num_bins)
+        logloss_sum, pred_sum, label_sum = self.sums.numpy().tolist()
+        return _summarize(
+            _auc_from_counts(pos, neg),
+            logloss_sum,
+            pred_sum,
+            label_sum,
+            int(neg.sum() + pos.sum()),
+        )
+
+
+class ExactMetrics(object):
+    """Exact AUC, logloss and calibration.
+
+    Predictions and labels are copied into host buffers preallocated for ``capacity``
+    samples (doubled when full) and sorted once in ``compute``. Global tensors are
+    gathered, so every rank evaluates all samples; local tensors are evaluated per rank.
+    """
+
+    def __init__(self, capacity=0):
+        self.preds = np.empty(max(capacity, 1), dtype=np.float32)
+        self.labels = np.empty(max(capacity, 1), dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.size = 0
+
+    def _grow(self, size):
+        capacity = max(size, 2 * len(self.preds))
+        for name in ("preds", "labels"):
+            buf = np.empty(capacity, dtype=np.float32)
+            buf[: self.size] = getattr(self, name)[: self.size]
+            setattr(self, name, buf)
+
+    def update(self, preds, labels):
+        preds = preds.numpy().reshape(-1)
+        labels = labels.numpy().reshape(-1)
+        end = self.size + len(preds)
+        if end > len(self.preds):
+            self._grow(end)
+        self.preds[self.size : end] = preds
+        self.labels[self.size : end] = labels
+        self.size = end
+
+    def compute(self):
+        preds = self.preds[: self.size]
+        labels = self.labels[: self.size].astype(np.float64)
+        if self.size == 0:
+            return _summarize(float("nan"), 0.0, 0.0, 0.0, 0)
+
+        order = np.argsort(preds)
+        sorted_preds = preds[order]
+        # one group per distinct prediction
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_preds)) + 1))
+        pos = np.add.reduceat(labels[order], starts)
+        neg = np.diff(np.append(starts, self.size)) - pos
+
+        p = np.clip(preds.astype(np.float64), _EPS, 1 - _EPS)
+        logloss_sum = -np.sum(labels * np.log(p) + (1 - labels) * np.log(1 - p))
+        return _summarize(
+            _auc_from_counts(pos, neg),
+            float(logloss_sum),
+            float(preds.sum(dtype=np.float64)),
+            float(labels.sum()),
+            self.size,
+        )
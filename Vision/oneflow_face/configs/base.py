@@ -26,6 +26,8 @@ config.weight_decay = 5e-4
 config.batch_size = 128
 config.lr = 0.1  # batch size is 512
 config.val_image_num = {"lfw": 12000, "cfp_fp": 14000, "agedb_30": 12000}
+# decoded verification images are cached here, next to the .bin files if None
+config.val_cache_dir = None
 if config.dataset == "emore":
     config.ofrecord_path = "/train_tmp/faces_emore"
     config.num_classes = 85742
@@ -0,0 +1,126 @@
+"""
+Micro-benchmark of the threshold sweeps in verification.py against the
+per-threshold loops they replace, on synthetic pair sets of the size of the
+usual verification benchmarks.
+
+Run from Vision/oneflow_face:
+    python3 -m eval.benchmark_verification
+"""
+import argparse
+import time
+
+import numpy as np
+
+from eval import verification
+
+
+BENCHMARKS = {"lfw": 6000, "cfp_fp": 7000, "agedb_30": 6000}
+
+
+def calculate_roc_reference(thresholds, dist, actual_issame, nrof_folds=10):
+    k_fold = verification.LFold(n_splits=nrof_folds, shuffle=False)
+    tprs = np.zeros((nrof_folds, len(thresholds)))
+    fprs = np.zeros((nrof_folds, len(thresholds)))
+    accuracy = np.zeros((nrof_folds))
+    indices = np.arange(len(actual_issame))
+    for fold_idx, (train_set, test_set) in enumerate(k_fold.split(indices)):
+        acc_train = np.zeros((len(thresholds)))
+        for threshold_idx, threshold in enumerate(thresholds):
+            _, _, acc_train[threshold_idx] = verification.calculate_accuracy(
+                threshold, dist[train_set], actual_issame[train_set]
+            )
+        best_threshold_index = np.argmax(acc_train)
+        for threshold_idx, threshold in enumerate(thresholds):
+            (
+                tprs[fold_idx, threshold_idx],
+                fprs[fold_idx, threshold_idx],
+                _,
+            ) = verification.calculate_accuracy(
+                threshold, dist[test_set], actual_issame[test_set]
+            )
+        _, _, accuracy[fold_idx] = verification.calculate_accuracy(
+            thresholds[best_threshold_index], dist[test_set], actual_issame[test_set]
+        )
+    return np.mean(tprs, 0), np.mean(fprs, 0), accuracy
+
+
+def calculate_far_reference(thresholds, dist, actual_issame):
+    far_train = np.zeros(len(thresholds))
+    for threshold_idx, threshold in enumerate(thresholds):
+        _, far_train[threshold_idx] = verification.calculate_val_far(
+            threshold, dist, actual_issame
+        )
+    return far_train
+
+
+def synthetic_pairs(nrof_pairs, dim=512, seed=0):
+    rng = np.random.RandomState(seed)
+    actual_issame = np.arange(nrof_pairs) % 2 == 0
+    embeddings1 = rng.randn(nrof_pairs, dim)
+    noise = np.where(actual_issame[:, np.newaxis], 0.8, 3.0)
+    embeddings2 = embeddings1 + noise * rng.randn(nrof_pairs, dim) / np.sqrt(dim)
+    embeddings1 /= np.linalg.norm(embeddings1, axis=1, keepdims=True)
+    embeddings2 /= np.linalg.norm(embeddings2, axis=1, keepdims=True)
+    return embeddings1, embeddings2, actual_issame
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nfolds", type=int, default=10)
+    args = parser.parse_args()
+
+    roc_thresholds = np.arange(0, 4, 0.01)
+    val_thresholds = np.arange(0, 4, 0.001)
+    for name, nrof_pairs in BENCHMARKS.items():
+        embeddings1, embeddings2, actual_issame = synthetic_pairs(nrof_pairs)
+        dist = np.sum(np.square(embeddings1 - embeddings2), 1)
+
+        t_new, (tpr, fpr, accuracy) = timed(
+            verification.calculate_roc,
+            roc_thresholds,
+            embeddings1,
+            embeddings2,
+            actual_issame,
+            nrof_folds=args.nfolds,
+        )
+        t_ref, (ref_tpr, ref_fpr, ref_accuracy) = timed(
+            calculate_roc_reference,
+            roc_thresholds,
+            dist,
+            actual_issame,
+            nrof_folds=args.nfolds,
+        )
+        assert np.allclose(tpr, ref_tpr) and np.allclose(fpr, ref_fpr)
+        assert np.allclose(accuracy, ref_accuracy)
+        print(
+            "{} ({} pairs) roc: {:.2f} ms vs {:.2f} ms per-threshold, {:.1f}x".format(
+                name, nrof_pairs, t_new * 1e3, t_ref * 1e3, t_ref / t_new
+            )
+        )
+
+        t_new, (_, fp, tn, _) = timed(
+            verification.calculate_threshold_counts,
+            val_thresholds,
+            dist,
+            actual_issame,
+        )
+        far = fp / (fp + tn)
+        t_ref, ref_far = timed(
+            calculate_far_reference, val_thresholds, dist, actual_issame
+        )
+        assert np.allclose(far, ref_far)
+        print(
+            "{} ({} pairs) far sweep: {:.2f} ms vs {:.2f} ms per-threshold, {:.1f}x".format(
+                name, nrof_pairs, t_new * 1e3, t_ref * 1e3, t_ref / t_new
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,7 @@
 import datetime
 import os
 import pickle
+import tempfile
 
 
 import numpy as np
@@ -87,27 +88,43 @@ def calculate_roc(
             dist = np.sum(np.square(diff), 1)
 
         # Find the best threshold for the fold
-        acc_train = np.zeros((nrof_thresholds))
-        for threshold_idx, threshold in enumerate(thresholds):
-            _, _, acc_train[threshold_idx] = calculate_accuracy(
-                threshold, dist[train_set], actual_issame[train_set]
-            )
+        _, _, acc_train = calculate_accuracy_sweep(
+            thresholds, dist[train_set], actual_issame[train_set]
+        )
         best_threshold_index = np.argmax(acc_train)
-        for threshold_idx, threshold in enumerate(thresholds):
-            (
-                tprs[fold_idx, threshold_idx],
-                fprs[fold_idx, threshold_idx],
-                _,
-            ) = calculate_accuracy(threshold, dist[test_set], actual_issame[test_set])
-        _, _, accuracy[fold_idx] = calculate_accuracy(
-            thresholds[best_threshold_index], dist[test_set], actual_issame[test_set]
+        tprs[fold_idx], fprs[fold_idx], acc_test = calculate_accuracy_sweep(
+            thresholds, dist[test_set], actual_issame[test_set]
         )
+        accuracy[fold_idx] = acc_test[best_threshold_index]
 
     tpr = np.mean(tprs, 0)
     fpr = np.mean(fprs, 0)
     return tpr, fpr, accuracy
 
 
+def calculate_threshold_counts(thresholds, dist, actual_issame):
+    """tp, fp, tn, fn of ``dist < threshold`` for every threshold, from one sort."""
+    actual_issame = np.asarray(actual_issame, dtype=bool)
+    order = np.argsort(dist, kind="stable")
+    # number of pairs predicted same, i.e. with dist < threshold
+    nrof_accept = np.searchsorted(dist[order], thresholds, side="left")
+    cum_same = np.concatenate([[0], np.cumsum(actual_issame[order])])
+    n_same = cum_same[-1]
+    n_diff = dist.size - n_same
+    tp = cum_same[nrof_accept]
+    fp = nrof_accept - tp
+    return tp, fp, n_diff - fp, n_same - tp
+
+
+def calculate_accuracy_sweep(thresholds, dist, actual_issame):
+    """Vectorized :func:`calculate_accuracy` over an array of thresholds."""
+    tp, fp, tn, fn = calculate_threshold_counts(thresholds, dist, actual_issame)
+    tpr = np.where(tp + fn == 0, 0.0, tp / np.maximum(tp + fn, 1))
+    fpr = np.where(fp + tn == 0, 0.0, fp / np.maximum(fp + tn, 1))
+    acc = (tp + tn) / dist.size
+    return tpr, fpr, acc
+
+
 def calculate_accuracy(threshold, dist, actual_issame):
     predict_issame = np.less(dist, threshold)
     tp = np.sum(np.logical_and(predict_issame, actual_issame))
@@ -129,7 +146,6 @@ def calculate_val(
     assert embeddings1.shape[0] == embeddings2.shape[0]
     assert embeddings1.shape[1] == embeddings2.shape[1]
     nrof_pairs = min(len(actual_issame), embeddings1.shape[0])
-    nrof_thresholds = len(thresholds)
     k_fold = LFold(n_splits=nrof_folds, shuffle=False)
 
     val = np.zeros(nrof_folds)
@@ -142,11 +158,10 @@ def calculate_val(
     for fold_idx, (train_set, test_set) in enumerate(k_fold.split(indices)):
 
         # Find the threshold that gives FAR = far_target
-        far_train = np.zeros(nrof_thresholds)
-        for threshold_idx, threshold in enumerate(thresholds):
-            _, far_train[threshold_idx] = calculate_val_far(
-                threshold, dist[train_set], actual_issame[train_set]
-            )
+        _, fp, tn, _ = calculate_threshold_counts(
+            thresholds, dist[train_set], actual_issame[train_set]
+        )
+        far_train = fp / (fp + tn)
         if np.max(far_train) >= far_target:
             f = interpolate.interp1d(far_train, thresholds, kind="slinear")
             threshold = f(far_target)
@@ -201,28 +216,95 @@ def evaluate(embeddings, actual_issame, nrof_folds=10, pca=0):
     return tpr, fpr, accuracy, val, val_std, far
 
 
-def load_bin_cv(path, image_size):
-    bins, issame_list = pickle.load(open(path, "rb"), encoding="bytes")
-    data_list = []
-    for flip in [0, 1]:
-        data = flow.empty(len(issame_list) * 2, 3, image_size[0], image_size[1])
-        data_list.append(data)
-    for i in range(len(issame_list) * 2):
-        _bin = bins[i]
-        img_ori = cv.imdecode(_bin, cv.IMREAD_COLOR)[:, :, ::-1]
-
-        for flip in [0, 1]:
-            img = img_ori.copy()
-            if flip == 1:
-                img = cv.flip(img, 1)
-            img = np.array(img).transpose((2, 0, 1))
-            img = (img - 127.5) * 0.00784313725
-            data_list[flip][i] = flow.tensor(img, dtype=flow.float)
+def _is_writable(directory):
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(directory, os.W_OK)
+
+
+def bin_cache_prefix(path, image_size, cache_dir=None):
+    """
+    Path without extension of the cache of ``path``, in ``cache_dir`` or next to the
+    ``.bin``. If that directory has no cache and is not writable, e.g. a read-only
+    dataset mount, the cache goes to the temporary directory instead.
+    """
+    name = "{}_{}x{}".format(
+        os.path.splitext(os.path.basename(path))[0], image_size[0], image_size[1]
+    )
+    directory = cache_dir if cache_dir is not None else os.path.dirname(path)
+    prefix = os.path.join(directory, name)
+    if os.path.exists(prefix + ".npy") or _is_writable(directory):
+        return prefix
+    fallback = os.path.join(tempfile.gettempdir(), "oneflow_face_verification")
+    logging.warning(
+        "%s is not writable, caching verification images in %s", directory, fallback
+    )
+    os.makedirs(fallback, exist_ok=True)
+    return os.path.join(fallback, name)
 
+
+def build_bin_cache(path, image_size, prefix):
+    """
+    Decode the pair images of ``path`` once into ``prefix.npy``, a uint8 array of shape
+    (2, num_images, 3, height, width) holding the images and their horizontal flips,
+    and save the labels to ``prefix_issame.npy``.
+
+    Both files are written under a temporary name and renamed, so ranks that build the
+    same cache concurrently never see a partial file.
+    """
+    bins, issame_list = pickle.load(open(path, "rb"), encoding="bytes")
+    num_images = len(issame_list) * 2
+    tmp_suffix = ".tmp{}".format(os.getpid())
+    data = np.lib.format.open_memmap(
+        prefix + ".npy" + tmp_suffix,
+        mode="w+",
+        dtype=np.uint8,
+        shape=(2, num_images, 3, image_size[0], image_size[1]),
+    )
+    for i in range(num_images):
+        img = cv.imdecode(bins[i], cv.IMREAD_COLOR)[:, :, ::-1]
+        if img.shape[:2] != tuple(image_size):
+            img = cv.resize(img, (image_size[1], image_size[0]))
+        data[0, i] = img.transpose((2, 0, 1))
+        data[1, i] = img[:, ::-1].transpose((2, 0, 1))
         if i % 1000 == 0:
             logging.info("loading bin:%d", i)
-    logging.info(data_list[0].shape)
-    return data_list, issame_list
+    data.flush()
+    del data
+    with open(prefix + "_issame.npy" + tmp_suffix, "wb") as f:
+        np.save(f, np.asarray(issame_list, dtype=bool))
+    os.replace(prefix + "_issame.npy" + tmp_suffix, prefix + "_issame.npy")
+    os.replace(prefix + ".npy" + tmp_suffix, prefix + ".npy")
+
+
+def prepare_bin_cache(path, image_size, cache_dir=None):
+    """Build the cache of ``path`` unless it exists, return its prefix."""
+    prefix = bin_cache_prefix(path, image_size, cache_dir)
+    if not os.path.exists(prefix + ".npy"):
+        logging.info("building verification cache %s", prefix + ".npy")
+        build_bin_cache(path, image_size, prefix)
+    return prefix
+
+
+def load_bin_cv(path, image_size, cache_dir=None):
+    """
+    Load a verification ``.bin`` as ``([images, flipped_images], issame_list)``.
+
+    The images are uint8 arrays of shape (num_images, 3, height, width), memory-mapped
+    from a cache built on first use (see :func:`prepare_bin_cache`), so later loads and
+    other ranks skip JPEG decoding. They are normalized per batch in :func:`test`.
+    """
+    prefix = prepare_bin_cache(path, image_size, cache_dir)
+    data = np.load(prefix + ".npy", mmap_mode="r")
+    issame_list = np.load(prefix + "_issame.npy").tolist()
+    logging.info(data[0].shape)
+    return [data[0], data[1]], issame_list
+
+
+def _normalize(img):
+    return (img.to(dtype=flow.float32) - 127.5) * 0.00784313725
 
 
 @flow.no_grad()
@@ -243,12 +325,12 @@ def test(data_set, backbone, batch_size, nfolds=10, is_consistent=False):
         while ba < data.shape[0]:
             bb = min(ba + batch_size, data.shape[0])
             count = bb - ba
-            img = data[bb - batch_size : bb]
+            img = flow.tensor(np.ascontiguousarray(data[bb - batch_size : bb]))
             time0 = datetime.datetime.now()
             with flow.no_grad():
                 if is_consistent:
                     img = img.to_consistent(placement=placement, sbp=sbp)
-                net_out = backbone(img.to("cuda"))
+                net_out = backbone(_normalize(img.to("cuda")))
 
             if is_consistent:
                 _embeddings = net_out.to_local().numpy()
@@ -266,11 +348,8 @@ def test(data_set, backbone, batch_size, nfolds=10, is_consistent=False):
     _xnorm = 0.0
     _xnorm_cnt = 0
     for embed in embeddings_list:
-        for i in range(embed.shape[0]):
-            _em = embed[i]
-            _norm = np.linalg.norm(_em)
-            _xnorm += _norm
-            _xnorm_cnt += 1
+        _xnorm += np.linalg.norm(embed, axis=1).sum()
+        _xnorm_cnt += embed.shape[0]
     _xnorm /= _xnorm_cnt
 
     embeddings = embeddings_list[0].copy()
@@ -183,7 +183,12 @@ class Trainer(object):
         )
         # val
         self.callback_verification = CallBackVerification(
-            600, rank, cfg.val_targets, cfg.ofrecord_path, is_consistent=cfg.graph
+            600,
+            rank,
+            cfg.val_targets,
+            cfg.ofrecord_path,
+            is_consistent=cfg.graph,
+            cache_dir=cfg.val_cache_dir,
         )
         # save checkpoint
         self.callback_checkpoint = CallBackModelCheckpoint(rank, cfg.output)
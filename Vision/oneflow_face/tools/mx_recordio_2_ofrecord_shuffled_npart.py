@@ -1,9 +1,24 @@
+"""
+Convert an MXNet RecordIO face dataset (train.rec / train.idx) into ``--num_part``
+shuffled OFRecord parts.
+
+The image indices are shuffled globally with ``--seed`` and split into parts, which
+are written concurrently by ``--num_workers`` processes, each reading the records of
+its parts from the ``.rec`` file. A part is written under a temporary name and
+renamed when complete, together with a ``.done`` file holding its record count and
+sha256, so an interrupted conversion restarted with the same arguments only converts
+the missing parts. At the end every part is re-read and checked against its
+checksum.
+"""
 import os
 import sys
+import json
 import struct
+import hashlib
 import argparse
 import numbers
 import random
+import multiprocessing
 
 from mxnet import recordio
 import oneflow.core.record.record_pb2 as of_record
@@ -27,6 +42,23 @@ def parse_arguement(argv):
     parser.add_argument(
         "--num_part", type=int, default=96, help="num_part of OFRecord to generate.",
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of processes writing parts concurrently.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the global shuffle, must not change when resuming.",
+    )
+    parser.add_argument(
+        "--skip_verify",
+        action="store_true",
+        help="Do not re-read the parts to verify their checksums at the end.",
+    )
     return parser.parse_args(argv)
 
 
@@ -112,11 +144,90 @@ def convert_to_ofrecord(img_data):
     return example
 
 
+_worker_imgrec = None
+
+
+def _init_worker(data_dir):
+    # every process opens its own handle on the .rec file
+    global _worker_imgrec
+    path_imgrec = os.path.join(data_dir, "train.rec")
+    path_imgidx = path_imgrec[0:-4] + ".idx"
+    _worker_imgrec = recordio.MXIndexedRecordIO(
+        path_imgidx, path_imgrec, "r", key_type=int
+    )
+
+
+def _part_name(part_id):
+    return "part-" + "{:0>5d}".format(part_id)
+
+
+def _done_file(output_dir, part_id):
+    return os.path.join(output_dir, "." + _part_name(part_id) + ".done")
+
+
+def convert_part(task):
+    """Write one part, returns ``(part_id, num_records, sha256)``."""
+    output_dir, part_id, imgidx_list = task
+    output_file = os.path.join(output_dir, _part_name(part_id))
+    sha256 = hashlib.sha256()
+    with open(output_file + ".tmp", "wb") as f:
+        for idx in imgidx_list:
+            img_data = {}
+            rec = _worker_imgrec.read_idx(idx)
+            header, s = recordio.unpack(rec)
+            label = header.label
+            if not isinstance(label, numbers.Number):
+                label = label[0]
+            img_data["label"] = int(label)
+            img_data["pixel_data"] = s
+
+            example = convert_to_ofrecord(img_data)
+            data = struct.pack("q", example.ByteSize()) + example.SerializeToString()
+            sha256.update(data)
+            f.write(data)
+    os.replace(output_file + ".tmp", output_file)
+
+    result = {"num_records": len(imgidx_list), "sha256": sha256.hexdigest()}
+    with open(_done_file(output_dir, part_id) + ".tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(
+        _done_file(output_dir, part_id) + ".tmp", _done_file(output_dir, part_id)
+    )
+    return part_id, result["num_records"], result["sha256"]
+
+
+def verify_part(output_dir, part_id):
+    """Re-read a part, check its record framing, count and checksum."""
+    with open(_done_file(output_dir, part_id), "r") as f:
+        expected = json.load(f)
+    sha256 = hashlib.sha256()
+    num_records = 0
+    with open(os.path.join(output_dir, _part_name(part_id)), "rb") as f:
+        while True:
+            size_bytes = f.read(8)
+            if len(size_bytes) == 0:
+                break
+            if len(size_bytes) != 8:
+                return False
+            (size,) = struct.unpack("q", size_bytes)
+            data = f.read(size)
+            if len(data) != size:
+                return False
+            sha256.update(size_bytes)
+            sha256.update(data)
+            num_records += 1
+    return (
+        num_records == expected["num_records"]
+        and sha256.hexdigest() == expected["sha256"]
+    )
+
+
 def main(args):
     # Convert recordio to ofrecord
     imgrec, imgidx_list = load_train_data(data_dir=args.data_dir)
     imgidx_list = list(imgidx_list)
-    random.shuffle(imgidx_list)
+    # the shuffle must be reproducible so that a resumed run assigns the same images
+    random.Random(args.seed).shuffle(imgidx_list)
 
     output_dir = os.path.join(args.output_filepath, "train")
     if not os.path.exists(output_dir):
@@ -125,31 +236,66 @@ def main(args):
     num_images_per_part = (num_images + args.num_part) // args.num_part
     print("num_images", num_images, "num_images_per_part", num_images_per_part)
 
+    meta = {"num_images": num_images, "num_part": args.num_part, "seed": args.seed}
+    meta_file = os.path.join(output_dir, ".convert_meta.json")
+    if os.path.exists(meta_file):
+        with open(meta_file, "r") as f:
+            if json.load(f) != meta:
+                raise ValueError(
+                    "{} was converted with different arguments, remove it or "
+                    "use the same --num_part and --seed".format(output_dir)
+                )
+    else:
+        with open(meta_file, "w") as f:
+            json.dump(meta, f)
+
+    tasks = []
     for part_id in range(args.num_part):
-        part_name = "part-" + "{:0>5d}".format(part_id)
-        output_file = os.path.join(output_dir, part_name)
+        if os.path.exists(_done_file(output_dir, part_id)):
+            continue
         file_idx_start = part_id * num_images_per_part
         file_idx_end = min((part_id + 1) * num_images_per_part, num_images)
-        print("part-" + str(part_id), "start", file_idx_start, "end", file_idx_end)
-        with open(output_file, "wb") as f:
-            for file_idx in range(file_idx_start, file_idx_end):
-                idx = imgidx_list[file_idx]
-                if idx % 10000 == 0:
-                    print("Converting images: {} of {}".format(idx, len(imgidx_list)))
-
-                img_data = {}
-                rec = imgrec.read_idx(idx)
-                header, s = recordio.unpack(rec)
-                label = header.label
-                if not isinstance(label, numbers.Number):
-                    label = label[0]
-                img_data["label"] = int(label)
-                img_data["pixel_data"] = s
-
-                example = convert_to_ofrecord(img_data)
-                size = example.ByteSize()
-                f.write(struct.pack("q", size))
-                f.write(example.SerializeToString())
+        tasks.append((output_dir, part_id, imgidx_list[file_idx_start:file_idx_end]))
+    print(
+        "converting {} of {} parts with {} workers".format(
+            len(tasks), args.num_part, args.num_workers
+        )
+    )
+
+    pool = multiprocessing.Pool(
+        args.num_workers, initializer=_init_worker, initargs=(args.data_dir,)
+    )
+    for i, (part_id, num_records, sha256) in enumerate(
+        pool.imap_unordered(convert_part, tasks)
+    ):
+        print(
+            "[{}/{}] {}: {} records, sha256 {}".format(
+                i + 1, len(tasks), _part_name(part_id), num_records, sha256
+            ),
+            flush=True,
+        )
+    pool.close()
+    pool.join()
+
+    if not args.skip_verify:
+        print("verifying checksums")
+        pool = multiprocessing.Pool(args.num_workers)
+        ok = pool.starmap(
+            verify_part, [(output_dir, part_id) for part_id in range(args.num_part)]
+        )
+        pool.close()
+        pool.join()
+        corrupted = [_part_name(p) for p in range(args.num_part) if not ok[p]]
+        if len(corrupted) > 0:
+            for p in range(args.num_part):
+                if not ok[p]:
+                    os.remove(_done_file(output_dir, p))
+            raise RuntimeError(
+                "checksum mismatch in {}, rerun to convert them again".format(
+                    ", ".join(corrupted)
+                )
+            )
+        print("all {} parts verified".format(args.num_part))
 
 
 if __name__ == "__main__":
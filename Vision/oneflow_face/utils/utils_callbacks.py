@@ -19,6 +19,7 @@ class CallBackVerification(object):
         image_size=(112, 112),
         world_size=1,
         is_consistent=False,
+        cache_dir=None,
     ):
         self.frequent: int = frequent
         self.rank: int = rank
@@ -29,6 +30,8 @@ class CallBackVerification(object):
         self.world_size = world_size
         self.is_consistent = is_consistent
 
+        self.cache_dir = cache_dir
+
         if self.is_consistent:
             self.init_dataset(
                 val_targets=val_targets, data_dir=rec_prefix, image_size=image_size
@@ -62,13 +65,25 @@ class CallBackVerification(object):
             results.append(acc2)
 
     def init_dataset(self, val_targets, data_dir, image_size):
-
+        targets = []
         for name in val_targets:
             path = os.path.join(data_dir, "val", name + ".bin")
             if os.path.exists(path):
-                data_set = verification.load_bin_cv(path, image_size)
-                self.ver_list.append(data_set)
-                self.ver_name_list.append(name)
+                targets.append((name, path))
+
+        if self.is_consistent and flow.env.get_world_size() > 1:
+            # rank 0 decodes the images once while the other ranks wait, then they
+            # memory-map its cache (ranks of other nodes build their own if they
+            # can't see it)
+            if self.rank == 0:
+                for _, path in targets:
+                    verification.prepare_bin_cache(path, image_size, self.cache_dir)
+            flow.comm.barrier()
+
+        for name, path in targets:
+            data_set = verification.load_bin_cv(path, image_size, self.cache_dir)
+            self.ver_list.append(data_set)
+            self.ver_name_list.append(name)
         if len(self.ver_list) == 0:
             logging.info("Val targets is None !")
 
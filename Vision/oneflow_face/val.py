@@ -16,7 +16,9 @@ def main(args):
     backbone = get_model(cfg.network, dropout=0.0, num_features=cfg.embedding_size).to(
         "cuda"
     )
-    val_callback = CallBackVerification(1, 0, cfg.val_targets, cfg.ofrecord_path)
+    val_callback = CallBackVerification(
+        1, 0, cfg.val_targets, cfg.ofrecord_path, cache_dir=cfg.val_cache_dir
+    )
 
     state_dict = flow.load(args.model_path)
 
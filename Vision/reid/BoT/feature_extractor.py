@@ -0,0 +1,154 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import oneflow as flow
+
+from data_loader import read_test_image
+
+
+def state_digest(model):
+    """SHA1 of the parameters and buffers of ``model``, to tag cached features."""
+    sha1 = hashlib.sha1()
+    state = model.state_dict()
+    for name in sorted(state.keys()):
+        array = np.ascontiguousarray(state[name].numpy())
+        sha1.update(name.encode("utf-8"))
+        sha1.update(str(array.dtype).encode("utf-8"))
+        sha1.update(str(array.shape).encode("utf-8"))
+        sha1.update(array.tobytes())
+    return sha1.hexdigest()
+
+
+class FeatureExtractor(object):
+    """Extracts features of test images in batches.
+
+    Images are decoded and resized by a pool of ``num_workers`` threads, ``prefetch``
+    batches ahead of the model, and the features of a batch are copied to host only
+    after the next batch has been launched, so decoding, host to device copies and the
+    forward pass overlap. The last, smaller batch is not dropped.
+
+    With ``cache_file`` the features are written to a memory-mapped ``.npy`` file.
+    Progress is recorded next to it, so an interrupted extraction resumes where it
+    stopped and a finished one is reused as long as the image list and ``tag`` (e.g.
+    the :func:`state_digest` of the model) match.
+    """
+
+    def __init__(
+        self,
+        model,
+        batch_size=64,
+        image_size=(256, 128),
+        num_workers=8,
+        prefetch=2,
+        flush_interval=50,
+        device="cuda",
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.height, self.width = image_size
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.flush_interval = flush_interval
+        self.device = device
+
+    def _fingerprint(self, img_paths, tag):
+        sha1 = hashlib.sha1()
+        for path in img_paths:
+            sha1.update(path.encode("utf-8"))
+            sha1.update(b"\0")
+        return {"num_samples": len(img_paths), "paths": sha1.hexdigest(), "tag": tag}
+
+    def _read_progress(self, cache_file, fingerprint):
+        progress_file = cache_file + ".progress"
+        if not (os.path.exists(cache_file) and os.path.exists(progress_file)):
+            return 0
+        with open(progress_file, "r") as f:
+            progress = json.load(f)
+        if progress.get("fingerprint") != fingerprint:
+            return 0
+        return progress["num_done"]
+
+    def _write_progress(self, cache_file, fingerprint, num_done):
+        tmp_file = cache_file + ".progress.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"fingerprint": fingerprint, "num_done": num_done}, f)
+        os.replace(tmp_file, cache_file + ".progress")
+
+    def extract(self, img_paths, cache_file=None, tag=None):
+        """Returns the (num_images, dim) float32 features of ``img_paths``."""
+        img_paths = [str(path) for path in img_paths]
+        num_samples = len(img_paths)
+        fingerprint = self._fingerprint(img_paths, tag)
+        start = 0
+        features = None
+        if cache_file is not None:
+            start = self._read_progress(cache_file, fingerprint)
+            if start > 0:
+                features = np.lib.format.open_memmap(cache_file, mode="r+")
+            if start == num_samples:
+                print("Reusing features from {}".format(cache_file))
+                return features
+            if start > 0:
+                print("Resuming extraction at {}/{}".format(start, num_samples))
+
+        batch_starts = list(range(start, num_samples, self.batch_size))
+        pending = deque()
+        num_done = start
+        num_batches = 0
+
+        def write(batch_start, batch_features):
+            nonlocal features
+            batch_features = batch_features.numpy()
+            if features is None:
+                shape = (num_samples, batch_features.shape[1])
+                if cache_file is None:
+                    features = np.empty(shape, dtype=np.float32)
+                else:
+                    features = np.lib.format.open_memmap(
+                        cache_file, mode="w+", dtype=np.float32, shape=shape
+                    )
+            features[batch_start : batch_start + len(batch_features)] = batch_features
+            return batch_start + len(batch_features)
+
+        with ThreadPoolExecutor(self.num_workers) as executor:
+
+            def submit(batch_start):
+                paths = img_paths[batch_start : batch_start + self.batch_size]
+                return [
+                    executor.submit(read_test_image, path, self.width, self.height)
+                    for path in paths
+                ]
+
+            decoding = deque(submit(s) for s in batch_starts[: self.prefetch])
+            for i, batch_start in enumerate(batch_starts):
+                imgs = np.stack([f.result() for f in decoding.popleft()])
+                if i + self.prefetch < len(batch_starts):
+                    decoding.append(submit(batch_starts[i + self.prefetch]))
+
+                with flow.no_grad():
+                    pending.append(
+                        (batch_start, self.model(flow.Tensor(imgs).to(self.device)))
+                    )
+                # copy the previous batch to host while this one runs
+                if len(pending) > 1:
+                    num_done = write(*pending.popleft())
+                    num_batches += 1
+                    if (
+                        cache_file is not None
+                        and num_batches % self.flush_interval == 0
+                    ):
+                        features.flush()
+                        self._write_progress(cache_file, fingerprint, num_done)
+
+            while len(pending) > 0:
+                num_done = write(*pending.popleft())
+
+        if cache_file is not None:
+            features.flush()
+            self._write_progress(cache_file, fingerprint, num_done)
+        return features
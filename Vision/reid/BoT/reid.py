@@ -10,9 +10,12 @@ import os.path as osp
 import numpy as np
 from utils.loggers import Logger
 from utils.distance import compute_distance_matrix
+from utils.rank import eval_market1501
+from utils.rerank import re_ranking_features
 from loss import TripletLoss, CrossEntropyLossLS
 from model import ResReid
 from lr_scheduler import WarmupMultiStepLR
+from feature_extractor import FeatureExtractor, state_digest
 
 
 def _parse_args():
@@ -57,6 +60,18 @@ def _parse_args():
         "--evaluate", action="store_true", default=False, help="train or eval"
     )
     parser.add_argument("--eval_freq", type=int, default=20, required=False)
+    parser.add_argument(
+        "--decode_workers",
+        type=int,
+        default=8,
+        help="threads decoding test images during feature extraction",
+    )
+    parser.add_argument(
+        "--feature_cache_dir",
+        type=str,
+        default=None,
+        help="with --evaluate, save query / gallery features here and reuse them",
+    )
     parser.add_argument(
         "--dist_metric",
         type=str,
@@ -65,6 +80,18 @@ def _parse_args():
         help="euclidean or cosine",
     )
     parser.add_argument("--rerank", type=bool, default=False)
+    parser.add_argument(
+        "--eval_chunk_size",
+        type=int,
+        default=256,
+        help="number of query rows evaluated / re-ranked at a time",
+    )
+    parser.add_argument(
+        "--eval_workers",
+        type=int,
+        default=4,
+        help="threads used to evaluate / re-rank query chunks",
+    )
     parser.add_argument(
         "--load_weights",
         type=str,
@@ -118,7 +145,7 @@ def main(args):
     dataset = Market1501(root=args.data_dir)
 
     if args.evaluate:
-        evaluate(model, dataset)
+        evaluate(model, dataset, use_cache=True)
     else:
         optimizer = flow.optim.Adam(
             model.parameters(),
@@ -246,74 +273,72 @@ def DeepSupervision(criterion, xs, y):
     return loss
 
 
-def evaluate(model, dataset):
-    query_dataset = ImageDataset(
-        dataset.query, flag="test", process_size=(args.image_height, args.image_width)
-    )
-    gallery_dataset = ImageDataset(
-        dataset.gallery, flag="test", process_size=(args.image_height, args.image_width)
+def evaluate(model, dataset, use_cache=False):
+    extractor = FeatureExtractor(
+        model,
+        batch_size=args.eval_batch_size,
+        image_size=(args.image_height, args.image_width),
+        num_workers=args.decode_workers,
     )
-    eval_batch = args.eval_batch_size
     model.eval()
     dist_metric = args.dist_metric  # distance metric, ['euclidean', 'cosine']
     rerank = args.rerank  # use person re-ranking
 
-    save_dir = args.log_dir
-    print("Extracting features from query set ...")
-    # query features, query person IDs and query camera IDs
-    qf, q_pids, q_camids = [], [], []
-    q_ind = list(range(len(query_dataset)))
-    for i in range((len(query_dataset) // eval_batch)):
-        imgs, pids, camids = query_dataset.__getbatch__(
-            q_ind[i * eval_batch : (i + 1) * eval_batch]
+    cache_dir = args.feature_cache_dir if use_cache else None
+    tag = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # cached features are only reused for the very same weights
+        tag = state_digest(model)
+
+    def extract(split, samples):
+        img_paths, pids, camids = zip(*samples)
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = osp.join(cache_dir, "{}_features.npy".format(split))
+        features = extractor.extract(img_paths, cache_file, tag=tag)
+        print(
+            "Done, obtained {}-by-{} matrix".format(
+                features.shape[0], features.shape[1]
+            )
+        )
+        return (
+            np.asarray(features),
+            np.asarray(pids, dtype=np.int64),
+            np.asarray(camids, dtype=np.int64),
         )
 
-        imgs = flow.Tensor(np.array(imgs)).to("cuda")
-        with flow.no_grad():
-            features = model(imgs)
-
-        qf.append(features.numpy())
-        q_pids.extend(pids)
-        q_camids.extend(camids)
-
-    qf = np.concatenate(qf, 0)
-    q_pids = np.asarray(q_pids)
-    q_camids = np.asarray(q_camids)
-    print("Done, obtained {}-by-{} matrix".format(qf.shape[0], qf.shape[1]))
+    print("Extracting features from query set ...")
+    # query features, query person IDs and query camera IDs
+    qf, q_pids, q_camids = extract("query", dataset.query)
 
     print("Extracting features from gallery set ...")
     # gallery features, gallery person IDs and gallery camera IDs
-    gf, g_pids, g_camids = [], [], []
-    g_ind = list(range(len(gallery_dataset)))
-    for i in range((len(gallery_dataset) // eval_batch)):
-        imgs, pids, camids = gallery_dataset.__getbatch__(
-            g_ind[i * eval_batch : (i + 1) * eval_batch]
-        )
-
-        imgs = flow.Tensor(np.array(imgs)).to("cuda")
-
-        with flow.no_grad():
-            features = model(imgs)
-        gf.append(features.numpy())
-        g_pids.extend(pids)
-        g_camids.extend(camids)
-
-    gf = np.concatenate(gf, 0)
-    g_pids = np.asarray(g_pids)
-    g_camids = np.asarray(g_camids)
-    print("Done, obtained {}-by-{} matrix".format(gf.shape[0], gf.shape[1]))
-
-    print("Computing distance matrix with metric={} ...".format(dist_metric))
-    distmat = compute_distance_matrix(qf, gf, dist_metric)
+    gf, g_pids, g_camids = extract("gallery", dataset.gallery)
 
     if rerank:
         print("Applying person re-ranking ...")
-        distmat_qq = compute_distance_matrix(qf, qf, dist_metric)
-        distmat_gg = compute_distance_matrix(gf, gf, dist_metric)
-        distmat = re_ranking(distmat, distmat_qq, distmat_gg)
+        distmat = re_ranking_features(
+            qf,
+            gf,
+            dist_metric,
+            chunk_size=args.eval_chunk_size,
+            num_workers=args.eval_workers,
+        )
+    else:
+        print("Computing distance matrix with metric={} ...".format(dist_metric))
+        distmat = compute_distance_matrix(qf, gf, dist_metric)
 
     print("Computing CMC and mAP ...")
-    cmc, mAP = _eval(distmat, q_pids, g_pids, q_camids, g_camids)
+    cmc, mAP = eval_market1501(
+        distmat,
+        q_pids,
+        g_pids,
+        q_camids,
+        g_camids,
+        chunk_size=args.eval_chunk_size,
+        num_workers=args.eval_workers,
+    )
 
     print("=".ljust(30, "=") + " Result " + "=".ljust(30, "="))
     print("mAP: {:.1%}".format(mAP))
@@ -325,147 +350,6 @@ def evaluate(model, dataset):
     return cmc[0], mAP
 
 
-def _eval(distmat, q_pids, g_pids, q_camids, g_camids, max_rank=50):
-    """Evaluation with market1501 metric
-    Key: for each query identity, its gallery images from the same camera view are discarded.
-    """
-    num_q, num_g = distmat.shape
-
-    if num_g < max_rank:
-        max_rank = num_g
-        print("Note: number of gallery samples is quite small, got {}".format(num_g))
-
-    indices = np.argsort(distmat, axis=1)
-    matches = (g_pids[indices] == q_pids[:, np.newaxis]).astype(np.int32)
-
-    # compute cmc curve for each query
-    all_cmc = []
-    all_AP = []
-    num_valid_q = 0.0  # number of valid query
-
-    for q_idx in range(num_q):
-        # get query pid and camid
-        q_pid = q_pids[q_idx]
-        q_camid = q_camids[q_idx]
-
-        # remove gallery samples that have the same pid and camid with query
-        order = indices[q_idx]
-        remove = (g_pids[order] == q_pid) & (g_camids[order] == q_camid)
-        keep = np.invert(remove)
-
-        # compute cmc curve
-        # binary vector, positions with value 1 are correct matches
-        raw_cmc = matches[q_idx][keep]
-        if not np.any(raw_cmc):
-            # this condition is true when query identity does not appear in gallery
-            continue
-
-        cmc = raw_cmc.cumsum()
-        cmc[cmc > 1] = 1
-
-        all_cmc.append(cmc[:max_rank])
-        num_valid_q += 1.0
-
-        # compute average precision
-        # reference: https://en.wikipedia.org/wiki/Evaluation_measures_(information_retrieval)#Average_precision
-        num_rel = raw_cmc.sum()
-        tmp_cmc = raw_cmc.cumsum()
-        tmp_cmc = [x / (i + 1.0) for i, x in enumerate(tmp_cmc)]
-        tmp_cmc = np.asarray(tmp_cmc) * raw_cmc
-        AP = tmp_cmc.sum() / num_rel
-        all_AP.append(AP)
-
-    assert num_valid_q > 0, "Error: all query identities do not appear in gallery"
-
-    all_cmc = np.asarray(all_cmc).astype(np.float32)
-    all_cmc = all_cmc.sum(0) / num_valid_q
-    mAP = np.mean(all_AP)
-
-    return all_cmc, mAP
-
-
-def re_ranking(q_g_dist, q_q_dist, g_g_dist, k1=20, k2=6, lambda_value=0.3):
-    # The following naming, e.g. gallery_num, is different from outer scope.
-    # Don't care about it.
-
-    original_dist = np.concatenate(
-        [
-            np.concatenate([q_q_dist, q_g_dist], axis=1),
-            np.concatenate([q_g_dist.T, g_g_dist], axis=1),
-        ],
-        axis=0,
-    )
-    original_dist = np.power(original_dist, 2).astype(np.float32)
-    original_dist = np.transpose(1.0 * original_dist / np.max(original_dist, axis=0))
-    V = np.zeros_like(original_dist).astype(np.float32)
-    initial_rank = np.argsort(original_dist).astype(np.int32)
-
-    query_num = q_g_dist.shape[0]
-    gallery_num = q_g_dist.shape[0] + q_g_dist.shape[1]
-    all_num = gallery_num
-
-    for i in range(all_num):
-        # k-reciprocal neighbors
-        forward_k_neigh_index = initial_rank[i, : k1 + 1]
-        backward_k_neigh_index = initial_rank[forward_k_neigh_index, : k1 + 1]
-        fi = np.where(backward_k_neigh_index == i)[0]
-        k_reciprocal_index = forward_k_neigh_index[fi]
-        k_reciprocal_expansion_index = k_reciprocal_index
-        for j in range(len(k_reciprocal_index)):
-            candidate = k_reciprocal_index[j]
-            candidate_forward_k_neigh_index = initial_rank[
-                candidate, : int(np.around(k1 / 2.0)) + 1
-            ]
-            candidate_backward_k_neigh_index = initial_rank[
-                candidate_forward_k_neigh_index, : int(np.around(k1 / 2.0)) + 1
-            ]
-            fi_candidate = np.where(candidate_backward_k_neigh_index == candidate)[0]
-            candidate_k_reciprocal_index = candidate_forward_k_neigh_index[fi_candidate]
-            if len(
-                np.intersect1d(candidate_k_reciprocal_index, k_reciprocal_index)
-            ) > 2.0 / 3 * len(candidate_k_reciprocal_index):
-                k_reciprocal_expansion_index = np.append(
-                    k_reciprocal_expansion_index, candidate_k_reciprocal_index
-                )
-
-        k_reciprocal_expansion_index = np.unique(k_reciprocal_expansion_index)
-        weight = np.exp(-original_dist[i, k_reciprocal_expansion_index])
-        V[i, k_reciprocal_expansion_index] = 1.0 * weight / np.sum(weight)
-    original_dist = original_dist[
-        :query_num,
-    ]
-    if k2 != 1:
-        V_qe = np.zeros_like(V, dtype=np.float32)
-        for i in range(all_num):
-            V_qe[i, :] = np.mean(V[initial_rank[i, :k2], :], axis=0)
-        V = V_qe
-        del V_qe
-    del initial_rank
-    invIndex = []
-    for i in range(gallery_num):
-        invIndex.append(np.where(V[:, i] != 0)[0])
-
-    jaccard_dist = np.zeros_like(original_dist, dtype=np.float32)
-
-    # get jaccard_dist
-    for i in range(query_num):
-        temp_min = np.zeros(shape=[1, gallery_num], dtype=np.float32)
-        indNonZero = np.where(V[i, :] != 0)[0]  # q_i's k-reciprocal index
-        indImages = [invIndex[ind] for ind in indNonZero]  #
-        for j in range(len(indNonZero)):
-            temp_min[0, indImages[j]] = temp_min[0, indImages[j]] + np.minimum(
-                V[i, indNonZero[j]], V[indImages[j], indNonZero[j]]  # V_pigj, V_gigj
-            )
-        jaccard_dist[i] = 1 - temp_min / (2.0 - temp_min)
-
-    final_dist = jaccard_dist * (1 - lambda_value) + original_dist * lambda_value
-    del original_dist
-    del V
-    del jaccard_dist
-    final_dist = final_dist[:query_num, query_num:]
-    return final_dist
-
-
 if __name__ == "__main__":
     args = _parse_args()
     main(args)
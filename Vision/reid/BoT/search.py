@@ -0,0 +1,155 @@
+# -*- coding:utf-8 -*-
+"""
+Person search over a gallery of pre-extracted features.
+
+The gallery is a ``(num_gallery, dim)`` float32 ``.npy`` file, opened memory-mapped.
+Queries are either features (``--query_features``) or images encoded with the BoT
+model (``--query_images``). ``--index exact`` scans the gallery block by block;
+``--index ivfpq`` builds (or loads from ``--index_file``) an IVF-PQ index, which is
+meant for galleries of millions of samples, and re-ranks its candidates with the
+exact distances.
+
+Example:
+    python3 search.py --gallery_features gallery.npy --index ivfpq \\
+        --index_file gallery_ivfpq.npz --query_images a.jpg b.jpg --topk 10
+"""
+import argparse
+import os
+
+import numpy as np
+
+from utils.retrieval import ExactIndex, IVFPQIndex, refine_topk
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--gallery_features", type=str, required=True)
+    parser.add_argument("--query_features", type=str, default=None)
+    parser.add_argument("--query_images", type=str, nargs="+", default=None)
+    parser.add_argument(
+        "--load_weights",
+        type=str,
+        default="./reid_oneflow_model",
+        help="model used to encode --query_images",
+    )
+    parser.add_argument("--num_classes", type=int, default=751)
+    parser.add_argument("--image_height", type=int, default=256)
+    parser.add_argument("--image_width", type=int, default=128)
+    parser.add_argument(
+        "--dist_metric", type=str, choices=["euclidean", "cosine"], default="euclidean"
+    )
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument(
+        "--index", type=str, choices=["exact", "ivfpq"], default="exact"
+    )
+    parser.add_argument("--block_size", type=int, default=65536)
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument(
+        "--index_file", type=str, default=None, help="load / save the IVF-PQ index"
+    )
+    parser.add_argument("--num_lists", type=int, default=1024)
+    parser.add_argument("--num_subspaces", type=int, default=16)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument(
+        "--num_train", type=int, default=200000, help="samples used to train IVF-PQ"
+    )
+    parser.add_argument(
+        "--refine_factor",
+        type=int,
+        default=4,
+        help="IVF-PQ candidates re-ranked exactly, as a multiple of --topk",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="save distances and indices (.npz)"
+    )
+    return parser.parse_args()
+
+
+def encode_images(args, paths):
+    import oneflow as flow
+    from data_loader import read_test_image
+    from model import ResReid
+
+    model = ResReid(args.num_classes)
+    model.load_state_dict(flow.load(args.load_weights), strict=False)
+    model = model.to("cuda")
+    model.eval()
+    imgs = np.stack(
+        [read_test_image(path, args.image_width, args.image_height) for path in paths]
+    )
+    with flow.no_grad():
+        return model(flow.Tensor(imgs).to("cuda")).numpy()
+
+
+def build_ivfpq(args, gallery):
+    if args.index_file is not None and os.path.exists(args.index_file):
+        print("Loading index from {}".format(args.index_file))
+        index = IVFPQIndex.load(args.index_file)
+        index.nprobe = args.nprobe
+        return index
+
+    index = IVFPQIndex(
+        gallery.shape[1],
+        num_lists=args.num_lists,
+        num_subspaces=args.num_subspaces,
+        metric=args.dist_metric,
+        nprobe=args.nprobe,
+    )
+    rng = np.random.RandomState(0)
+    train_ids = np.sort(
+        rng.choice(
+            gallery.shape[0], min(args.num_train, gallery.shape[0]), replace=False
+        )
+    )
+    print("Training IVF-PQ on {} samples ...".format(len(train_ids)))
+    index.train(gallery[train_ids])
+    print("Adding {} samples ...".format(gallery.shape[0]))
+    for start in range(0, gallery.shape[0], args.block_size):
+        index.add(gallery[start : start + args.block_size])
+    if args.index_file is not None:
+        index.save(args.index_file)
+    return index
+
+
+def main(args):
+    gallery = np.load(args.gallery_features, mmap_mode="r")
+    if args.query_features is not None:
+        queries = np.load(args.query_features)
+    elif args.query_images is not None:
+        queries = encode_images(args, args.query_images)
+    else:
+        raise ValueError("either --query_features or --query_images is required")
+
+    if args.index == "exact":
+        index = ExactIndex(
+            args.dist_metric, block_size=args.block_size, num_workers=args.num_workers
+        )
+        index.add(gallery)
+        dist, idx = index.search(queries, args.topk)
+    else:
+        index = build_ivfpq(args, gallery)
+        _, candidates = index.search(queries, args.topk * args.refine_factor)
+        dist, idx = refine_topk(
+            queries, candidates, gallery, args.topk, args.dist_metric
+        )
+
+    if args.output is not None:
+        np.savez(args.output, distances=dist, indices=idx)
+    for q in range(min(len(idx), 20)):
+        print(
+            "query {}: {}".format(
+                q,
+                ", ".join(
+                    "{} ({:.4f})".format(i, d)
+                    for i, d in zip(idx[q], dist[q])
+                    if i >= 0
+                ),
+            )
+        )
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    main(args)
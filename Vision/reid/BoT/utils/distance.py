@@ -42,3 +42,33 @@ def cosine_distance(input1, input2):
     dist = cdist(input1, input2, metric="cosine").astype(np.float16)
     distmat = np.power(dist, 2).astype(np.float16)
     return distmat
+
+
+def paired_distance(input1, input2, metric="euclidean"):
+    """Distance between ``input1[i]`` and ``input2[i]``, in the same units as
+    :func:`compute_distance_matrix`.
+
+    Args:
+        input1 (numpy.ndarray): 2-D feature matrix.
+        input2 (numpy.ndarray): 2-D feature matrix with the same shape.
+        metric (str, optional): "euclidean" or "cosine".
+
+    Returns:
+        numpy.ndarray: 1-D distances.
+    """
+    assert input1.shape == input2.shape
+
+    input1 = input1.astype(np.float64)
+    input2 = input2.astype(np.float64)
+    if metric == "euclidean":
+        dist = np.sqrt(np.square(input1 - input2).sum(axis=1))
+    elif metric == "cosine":
+        dist = 1.0 - (input1 * input2).sum(axis=1) / (
+            np.linalg.norm(input1, axis=1) * np.linalg.norm(input2, axis=1)
+        )
+    else:
+        raise ValueError(
+            "Unknown distance metric: {}. "
+            'Please choose either "euclidean" or "cosine"'.format(metric)
+        )
+    return np.power(dist.astype(np.float16), 2).astype(np.float16)
@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _eval_chunk(distmat, q_pids, g_pids, q_camids, g_camids, max_rank):
+    """CMC counts, APs of the valid queries of one chunk of query rows."""
+    indices = np.argsort(distmat, axis=1)
+    g_pids_sorted = g_pids[indices]
+    matches = g_pids_sorted == q_pids[:, np.newaxis]
+    # remove gallery samples that have the same pid and camid with query
+    keep = ~(matches & (g_camids[indices] == q_camids[:, np.newaxis]))
+    del indices, g_pids_sorted
+
+    # binary matrix, positions with value 1 are correct matches
+    matches &= keep
+    valid = matches.any(axis=1)
+    matches, keep = matches[valid], keep[valid]
+    if matches.shape[0] == 0:
+        return np.zeros(max_rank, dtype=np.int64), np.zeros(0)
+
+    # position of every gallery sample among the kept ones
+    kept_rank = np.cumsum(keep, axis=1, dtype=np.int32) - 1
+
+    # cmc: rank of the first correct match
+    first_match = kept_rank[np.arange(matches.shape[0]), matches.argmax(axis=1)]
+    cmc_counts = np.bincount(first_match[first_match < max_rank], minlength=max_rank)
+
+    # average precision
+    # reference: https://en.wikipedia.org/wiki/Evaluation_measures_(information_retrieval)#Average_precision
+    num_rel = matches.sum(axis=1)
+    hits = np.cumsum(matches, axis=1, dtype=np.int32)
+    precision = np.divide(
+        hits, kept_rank + 1.0, out=np.zeros(hits.shape), where=matches
+    )
+    all_AP = precision.sum(axis=1) / num_rel
+    return cmc_counts, all_AP
+
+
+def eval_market1501(
+    distmat,
+    q_pids,
+    g_pids,
+    q_camids,
+    g_camids,
+    max_rank=50,
+    chunk_size=256,
+    num_workers=1,
+):
+    """Evaluation with market1501 metric
+    Key: for each query identity, its gallery images from the same camera view are discarded.
+
+    Queries are processed in chunks of ``chunk_size`` rows, so the temporary memory is
+    bounded by ``chunk_size * num_gallery`` per worker. With ``num_workers`` > 1 the
+    chunks are evaluated by a thread pool (the sorts release the GIL).
+    """
+    num_q, num_g = distmat.shape
+
+    if num_g < max_rank:
+        max_rank = num_g
+        print("Note: number of gallery samples is quite small, got {}".format(num_g))
+
+    def run(start):
+        stop = min(start + chunk_size, num_q)
+        return _eval_chunk(
+            np.asarray(distmat[start:stop]),
+            q_pids[start:stop],
+            g_pids,
+            q_camids[start:stop],
+            g_camids,
+            max_rank,
+        )
+
+    starts = range(0, num_q, chunk_size)
+    if num_workers > 1:
+        with ThreadPoolExecutor(num_workers) as executor:
+            results = list(executor.map(run, starts))
+    else:
+        results = [run(start) for start in starts]
+
+    all_AP = np.concatenate([AP for _, AP in results])
+    num_valid_q = float(len(all_AP))
+    assert num_valid_q > 0, "Error: all query identities do not appear in gallery"
+
+    cmc_counts = np.sum([counts for counts, _ in results], axis=0)
+    all_cmc = (np.cumsum(cmc_counts) / num_valid_q).astype(np.float32)
+    mAP = np.mean(all_AP)
+
+    return all_cmc, mAP
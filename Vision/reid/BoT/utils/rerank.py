@@ -0,0 +1,279 @@
+# -*- coding:utf-8 -*-
+"""
+k-reciprocal re-ranking (Zhong et al., CVPR 2017) with sparse neighbour sets.
+
+The reference implementation keeps several dense (num_query + num_gallery)^2 matrices
+in memory. Here the distance rows are produced ``chunk_size`` rows at a time, only the
+top ``k1 + 1`` neighbours of every sample are kept, and the k-reciprocal encodings V are
+stored as a sparse matrix, so the memory use apart from the output grows linearly with
+the number of samples.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from .distance import compute_distance_matrix, paired_distance
+
+
+class _DenseRows(object):
+    """Rows of the (query + gallery)^2 distance matrix, from precomputed blocks."""
+
+    def __init__(self, q_g_dist, q_q_dist, g_g_dist):
+        self.q_g_dist = q_g_dist
+        self.q_q_dist = q_q_dist
+        self.g_g_dist = g_g_dist
+        self.num_query = q_g_dist.shape[0]
+        self.num_all = q_g_dist.shape[0] + q_g_dist.shape[1]
+
+    def __call__(self, start, stop):
+        rows = []
+        if start < self.num_query:
+            q_stop = min(stop, self.num_query)
+            rows.append(
+                np.concatenate(
+                    [self.q_q_dist[start:q_stop], self.q_g_dist[start:q_stop]], axis=1
+                )
+            )
+        if stop > self.num_query:
+            g_start = max(start, self.num_query) - self.num_query
+            g_stop = stop - self.num_query
+            rows.append(
+                np.concatenate(
+                    [
+                        self.q_g_dist[:, g_start:g_stop].T,
+                        self.g_g_dist[g_start:g_stop],
+                    ],
+                    axis=1,
+                )
+            )
+        return np.concatenate(rows, axis=0)
+
+    def pairs(self, rows, cols):
+        nq = self.num_query
+        dist = np.empty(len(rows), dtype=self.q_g_dist.dtype)
+        blocks = [
+            ((rows < nq) & (cols < nq), self.q_q_dist, 0, 0, False),
+            ((rows < nq) & (cols >= nq), self.q_g_dist, 0, nq, False),
+            ((rows >= nq) & (cols < nq), self.q_g_dist, nq, 0, True),
+            ((rows >= nq) & (cols >= nq), self.g_g_dist, nq, nq, False),
+        ]
+        for selected, block, row_offset, col_offset, transposed in blocks:
+            r, c = rows[selected] - row_offset, cols[selected] - col_offset
+            dist[selected] = block[c, r] if transposed else block[r, c]
+        return dist
+
+
+class _FeatureRows(object):
+    """Rows of the (query + gallery)^2 distance matrix, computed from features."""
+
+    def __init__(self, qf, gf, metric):
+        self.features = np.concatenate([qf, gf], axis=0)
+        self.metric = metric
+        self.num_query = qf.shape[0]
+        self.num_all = self.features.shape[0]
+
+    def __call__(self, start, stop):
+        return compute_distance_matrix(
+            self.features[start:stop], self.features, self.metric
+        )
+
+    def pairs(self, rows, cols):
+        return paired_distance(self.features[rows], self.features[cols], self.metric)
+
+
+def _map_chunks(fn, num_rows, chunk_size, num_workers):
+    starts = range(0, num_rows, chunk_size)
+    if num_workers > 1:
+        with ThreadPoolExecutor(num_workers) as executor:
+            return list(executor.map(fn, starts))
+    return [fn(start) for start in starts]
+
+
+def _reciprocal_sets(initial_rank, k, chunk_size, num_workers):
+    """
+    Index matrix (num_all, k + 1) of the k-reciprocal neighbours of every sample, in
+    rank order, and the mask of valid entries.
+    """
+    forward = initial_rank[:, : k + 1]
+    mask = np.empty(forward.shape, dtype=bool)
+
+    def run(start):
+        stop = min(start + chunk_size, forward.shape[0])
+        backward = initial_rank[forward[start:stop], : k + 1]
+        rows = np.arange(start, stop)[:, np.newaxis, np.newaxis]
+        mask[start:stop] = (backward == rows).any(axis=2)
+
+    _map_chunks(run, forward.shape[0], chunk_size, num_workers)
+    return forward, mask
+
+
+def _rerank(dist_rows, k1, k2, lambda_value, chunk_size, num_workers, out):
+    num_query, num_all = dist_rows.num_query, dist_rows.num_all
+    num_gallery = num_all - num_query
+    top_k = k1 + 1
+    assert k2 <= top_k, "k2 must not be larger than k1 + 1"
+
+    # 1. the k1 + 1 nearest neighbours of every sample, without sorting whole rows
+    initial_rank = np.empty((num_all, top_k), dtype=np.int64)
+    row_max = np.empty(num_all, dtype=np.float32)
+
+    def nearest(start):
+        dist = np.power(dist_rows(start, start + chunk_size), 2).astype(np.float32)
+        row_max[start : start + dist.shape[0]] = dist.max(axis=1)
+        part = np.argpartition(dist, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(np.take_along_axis(dist, part, axis=1), axis=1)
+        initial_rank[start : start + dist.shape[0]] = np.take_along_axis(
+            part, order, axis=1
+        )
+
+    _map_chunks(nearest, num_all, chunk_size, num_workers)
+
+    # 2. k-reciprocal sets, and the k1 / 2 sets used to expand them
+    recip, recip_mask = _reciprocal_sets(initial_rank, k1, chunk_size, num_workers)
+    half, half_mask = _reciprocal_sets(
+        initial_rank, int(np.around(k1 / 2.0)), chunk_size, num_workers
+    )
+
+    # 3. sparse k-reciprocal encodings V
+    V_rows = [None] * ((num_all + chunk_size - 1) // chunk_size)
+
+    def encode(start):
+        stop = min(start + chunk_size, num_all)
+        r, r_mask = recip[start:stop], recip_mask[start:stop]
+        # candidate c = r[i, a] is accepted if more than 2/3 of its k1 / 2 reciprocal
+        # neighbours are k1 reciprocal neighbours of i
+        c_half, c_half_mask = half[r], half_mask[r] & r_mask[:, :, np.newaxis]
+        shared = (
+            (c_half[:, :, :, np.newaxis] == r[:, np.newaxis, np.newaxis, :])
+            & r_mask[:, np.newaxis, np.newaxis, :]
+        ).any(axis=3) & c_half_mask
+        accept = shared.sum(axis=2) > 2.0 / 3 * c_half_mask.sum(axis=2)
+        expansion = c_half_mask & accept[:, :, np.newaxis]
+
+        n = stop - start
+        row_ids = np.concatenate(
+            [
+                np.broadcast_to(np.arange(n)[:, np.newaxis], r.shape)[r_mask],
+                np.broadcast_to(np.arange(n)[:, np.newaxis, np.newaxis], c_half.shape)[
+                    expansion
+                ],
+            ]
+        )
+        col_ids = np.concatenate([r[r_mask], c_half[expansion]])
+        # duplicates are summed by tocsr(), mark them with one and count them once
+        V = sparse.coo_matrix(
+            (np.ones(len(row_ids), dtype=np.float32), (row_ids, col_ids)),
+            shape=(n, num_all),
+        ).tocsr()
+        V.data[:] = 1.0
+
+        rows, cols = V.nonzero()
+        dist = np.power(dist_rows.pairs(rows + start, cols), 2).astype(np.float32)
+        weight = np.exp(-dist / row_max[rows + start])
+        V = sparse.csr_matrix((weight, (rows, cols)), shape=(n, num_all))
+        V = sparse.diags(1.0 / np.asarray(V.sum(axis=1)).ravel()) @ V
+        V_rows[start // chunk_size] = V.astype(np.float32)
+
+    _map_chunks(encode, num_all, chunk_size, num_workers)
+    V = sparse.vstack(V_rows, format="csr")
+    del V_rows, recip, recip_mask, half, half_mask
+
+    # 4. local query expansion: average V over the k2 nearest neighbours
+    if k2 != 1:
+        expand = sparse.csr_matrix(
+            (
+                np.full(num_all * k2, 1.0 / k2, dtype=np.float32),
+                initial_rank[:, :k2].ravel(),
+                np.arange(0, num_all * k2 + 1, k2),
+            ),
+            shape=(num_all, num_all),
+        )
+        V = (expand @ V).tocsr()
+    del initial_rank
+
+    # 5. Jaccard distance between queries and gallery, through the columns of V
+    V_gallery = V[num_query:].tocsc()
+    col_nnz = np.diff(V_gallery.indptr)
+
+    if out is None:
+        out = np.empty((num_query, num_gallery), dtype=np.float32)
+
+    def jaccard(start):
+        stop = min(start + chunk_size, num_query)
+        V_q = V[start:stop].tocoo()
+        # every (query, k) entry meets every gallery entry of column k
+        repeat = col_nnz[V_q.col]
+        q_rows = np.repeat(V_q.row, repeat)
+        q_vals = np.repeat(V_q.data, repeat)
+        offsets = np.arange(repeat.sum()) - np.repeat(
+            np.cumsum(repeat) - repeat, repeat
+        )
+        entries = np.repeat(V_gallery.indptr[V_q.col], repeat) + offsets
+        g_rows = V_gallery.indices[entries]
+        g_vals = V_gallery.data[entries]
+        temp_min = np.bincount(
+            q_rows * num_gallery + g_rows,
+            weights=np.minimum(q_vals, g_vals),
+            minlength=(stop - start) * num_gallery,
+        ).reshape(stop - start, num_gallery)
+        jaccard_dist = 1 - temp_min / (2.0 - temp_min)
+
+        dist = np.power(dist_rows(start, stop)[:, num_query:], 2).astype(np.float32)
+        dist /= row_max[start:stop, np.newaxis]
+        out[start:stop] = jaccard_dist * (1 - lambda_value) + dist * lambda_value
+
+    _map_chunks(jaccard, num_query, chunk_size, num_workers)
+    return out
+
+
+def re_ranking(
+    q_g_dist,
+    q_q_dist,
+    g_g_dist,
+    k1=20,
+    k2=6,
+    lambda_value=0.3,
+    chunk_size=256,
+    num_workers=1,
+    out=None,
+):
+    """
+    Re-rank the query-gallery distances ``q_g_dist`` with k-reciprocal encoding.
+
+    The distance matrices are read ``chunk_size`` rows at a time, so they can be
+    memory-mapped. ``out`` is an optional (num_query, num_gallery) float32 array, e.g.
+    a ``np.memmap``, that receives the result.
+    """
+    return _rerank(
+        _DenseRows(q_g_dist, q_q_dist, g_g_dist),
+        k1,
+        k2,
+        lambda_value,
+        chunk_size,
+        num_workers,
+        out,
+    )
+
+
+def re_ranking_features(
+    qf,
+    gf,
+    metric="euclidean",
+    k1=20,
+    k2=6,
+    lambda_value=0.3,
+    chunk_size=256,
+    num_workers=1,
+    out=None,
+):
+    """Like :func:`re_ranking`, but computes the distance rows from the features."""
+    return _rerank(
+        _FeatureRows(qf, gf, metric),
+        k1,
+        k2,
+        lambda_value,
+        chunk_size,
+        num_workers,
+        out,
+    )
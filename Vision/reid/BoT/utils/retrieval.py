@@ -0,0 +1,389 @@
+# -*- coding:utf-8 -*-
+"""
+Top-k retrieval over large galleries.
+
+:class:`ExactIndex` streams the gallery in blocks and keeps only the ``k`` best
+candidates per query (``np.argpartition``), so memory is bounded by
+``num_query * block_size`` instead of ``num_query * num_gallery``, and a memory-mapped
+gallery is never loaded as a whole.
+
+:class:`IVFPQIndex` is an approximate index for galleries of millions of samples:
+an inverted file over k-means cells whose residuals are compressed with product
+quantization, searched with asymmetric distance lookup tables.
+
+Both return distances in the units of :func:`compute_distance_matrix` (squared
+euclidean or squared cosine distance), sorted in ascending order.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _prepare(features, metric):
+    features = np.ascontiguousarray(features, dtype=np.float32)
+    if metric == "cosine":
+        features = features / np.maximum(
+            np.linalg.norm(features, axis=1, keepdims=True), 1e-12
+        )
+    elif metric != "euclidean":
+        raise ValueError(
+            "Unknown distance metric: {}. "
+            'Please choose either "euclidean" or "cosine"'.format(metric)
+        )
+    return features
+
+
+def _squared_l2(x, y, y_norms=None):
+    """Squared euclidean distances between the rows of ``x`` and ``y``, with a GEMM."""
+    if y_norms is None:
+        y_norms = np.square(y).sum(axis=1)
+    dist = np.square(x).sum(axis=1)[:, np.newaxis] - 2.0 * x.dot(y.T)
+    dist += y_norms[np.newaxis, :]
+    return np.maximum(dist, 0.0, out=dist)
+
+
+def _to_metric(squared_l2, metric):
+    """Convert squared euclidean distances to the units of ``compute_distance_matrix``."""
+    if metric == "euclidean":
+        return squared_l2
+    # unit vectors: ||a - b||^2 = 2 * cosine distance
+    return np.square(squared_l2 / 2.0)
+
+
+def merge_topk(dist, idx, new_dist, new_idx, k):
+    """Merge two candidate sets (rows of distances and ids) into the k best, sorted."""
+    dist = np.concatenate([dist, new_dist], axis=1)
+    idx = np.concatenate([idx, new_idx], axis=1)
+    if dist.shape[1] > k:
+        part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        dist = np.take_along_axis(dist, part, axis=1)
+        idx = np.take_along_axis(idx, part, axis=1)
+    order = np.argsort(dist, axis=1, kind="stable")
+    return (
+        np.take_along_axis(dist, order, axis=1),
+        np.take_along_axis(idx, order, axis=1),
+    )
+
+
+def _empty_topk(num_query):
+    return (
+        np.zeros((num_query, 0), dtype=np.float32),
+        np.zeros((num_query, 0), dtype=np.int64),
+    )
+
+
+class ExactIndex(object):
+    """Brute-force index that scans the gallery block by block.
+
+    The added features are referenced, not copied, so a ``np.memmap`` gallery is read
+    one block at a time and converted (and normalized for "cosine") per block.
+
+    Args:
+        metric (str): "euclidean" or "cosine".
+        block_size (int): number of gallery samples compared at a time.
+        query_chunk_size (int): number of queries searched at a time.
+        num_workers (int): threads searching query chunks in parallel.
+    """
+
+    def __init__(
+        self, metric="euclidean", block_size=65536, query_chunk_size=1024, num_workers=1
+    ):
+        self.metric = metric
+        self.block_size = block_size
+        self.query_chunk_size = query_chunk_size
+        self.num_workers = num_workers
+        self.parts = []
+        self.part_norms = []
+        self.num_samples = 0
+
+    def __len__(self):
+        return self.num_samples
+
+    def add(self, features):
+        norms = np.empty(features.shape[0], dtype=np.float32)
+        for start in range(0, features.shape[0], self.block_size):
+            block = _prepare(features[start : start + self.block_size], self.metric)
+            norms[start : start + block.shape[0]] = np.square(block).sum(axis=1)
+        self.parts.append(features)
+        self.part_norms.append(norms)
+        self.num_samples += features.shape[0]
+
+    def _blocks(self):
+        """Yields ``(offset, features, norms)`` of the prepared gallery blocks."""
+        offset = 0
+        for features, norms in zip(self.parts, self.part_norms):
+            for start in range(0, features.shape[0], self.block_size):
+                stop = min(start + self.block_size, features.shape[0])
+                block = _prepare(features[start:stop], self.metric)
+                yield offset + start, block, norms[start:stop]
+            offset += features.shape[0]
+
+    def _search_chunk(self, queries, k, topk, offset, block, norms):
+        """Merges the k best of ``block`` for ``queries`` into their ``topk``."""
+        dist = _squared_l2(queries, block, norms)
+        block_k = min(k, block.shape[0])
+        part = np.argpartition(dist, block_k - 1, axis=1)[:, :block_k]
+        return merge_topk(
+            topk[0], topk[1], np.take_along_axis(dist, part, axis=1), part + offset, k,
+        )
+
+    def search(self, queries, k):
+        """Returns ``(distances, indices)``, both of shape ``(num_query, k)``."""
+        queries = _prepare(queries, self.metric)
+        k = min(k, len(self))
+        chunks = [
+            queries[start : start + self.query_chunk_size]
+            for start in range(0, queries.shape[0], self.query_chunk_size)
+        ]
+        if len(chunks) == 0:
+            return _empty_topk(0)
+        results = [_empty_topk(chunk.shape[0]) for chunk in chunks]
+
+        # every gallery block is read once and compared with all the query chunks
+        executor = (
+            ThreadPoolExecutor(self.num_workers) if self.num_workers > 1 else None
+        )
+        try:
+            for offset, block, norms in self._blocks():
+                args = [
+                    (chunk, k, topk, offset, block, norms)
+                    for chunk, topk in zip(chunks, results)
+                ]
+                if executor is not None:
+                    results = list(executor.map(lambda a: self._search_chunk(*a), args))
+                else:
+                    results = [self._search_chunk(*a) for a in args]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        dist = np.concatenate([d for d, _ in results], axis=0)
+        idx = np.concatenate([i for _, i in results], axis=0)
+        return _to_metric(dist, self.metric), idx
+
+
+def refine_topk(queries, ids, gallery, k, metric="euclidean"):
+    """Re-rank approximate candidates ``ids`` (-1 for none) with exact distances.
+
+    ``gallery`` holds the raw gallery features and may be a ``np.memmap``, only the
+    candidate rows are read.
+    """
+    q = _prepare(queries, metric)
+    valid = ids >= 0
+    candidates = _prepare(gallery[np.where(valid, ids, 0).ravel()], metric)
+    candidates = candidates.reshape(ids.shape + (-1,))
+    dist = np.square(candidates - q[:, np.newaxis, :]).sum(axis=2)
+    dist[~valid] = np.inf
+    part = np.argsort(dist, axis=1, kind="stable")[:, :k]
+    return (
+        _to_metric(np.take_along_axis(dist, part, axis=1), metric),
+        np.take_along_axis(ids, part, axis=1),
+    )
+
+
+def kmeans(x, num_clusters, num_iters=20, block_size=65536, seed=0):
+    """Lloyd's k-means, assignments computed block by block. Returns the centroids."""
+    rng = np.random.RandomState(seed)
+    if x.shape[0] < num_clusters:
+        raise ValueError(
+            "{} training samples are not enough for {} clusters".format(
+                x.shape[0], num_clusters
+            )
+        )
+    centroids = x[rng.choice(x.shape[0], num_clusters, replace=False)].copy()
+    for _ in range(num_iters):
+        assign = assign_clusters(x, centroids, block_size)
+        counts = np.bincount(assign, minlength=num_clusters)
+        nonempty = counts > 0
+        # sum the samples of every cluster after grouping them by cluster
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums = np.add.reduceat(x[order].astype(np.float64), starts, axis=0)
+        centroids[nonempty] = sums / counts[nonempty, np.newaxis]
+        # re-seed empty clusters with random samples
+        num_empty = int((~nonempty).sum())
+        if num_empty > 0:
+            centroids[~nonempty] = x[rng.choice(x.shape[0], num_empty, replace=False)]
+    return centroids
+
+
+def assign_clusters(x, centroids, block_size=65536):
+    norms = np.square(centroids).sum(axis=1)
+    assign = np.empty(x.shape[0], dtype=np.int64)
+    for start in range(0, x.shape[0], block_size):
+        dist = _squared_l2(x[start : start + block_size], centroids, norms)
+        assign[start : start + block_size] = dist.argmin(axis=1)
+    return assign
+
+
+class IVFPQIndex(object):
+    """Inverted file index with product quantized residuals.
+
+    Args:
+        dim (int): feature dimension, must be divisible by ``num_subspaces``.
+        num_lists (int): number of k-means cells of the inverted file.
+        num_subspaces (int): number of PQ sub-vectors, i.e. bytes per code.
+        num_bits (int): bits per sub-vector code, at most 8.
+        metric (str): "euclidean" or "cosine".
+        nprobe (int): number of cells visited per query.
+    """
+
+    def __init__(
+        self,
+        dim,
+        num_lists=1024,
+        num_subspaces=16,
+        num_bits=8,
+        metric="euclidean",
+        nprobe=16,
+    ):
+        assert dim % num_subspaces == 0, "dim must be divisible by num_subspaces"
+        assert num_bits <= 8, "codes are stored as uint8"
+        self.dim = dim
+        self.num_lists = num_lists
+        self.num_subspaces = num_subspaces
+        self.num_codes = 2 ** num_bits
+        self.metric = metric
+        self.nprobe = nprobe
+        self.coarse_centroids = None
+        self.pq_centroids = None
+        # inverted lists, stored contiguously: list l is [list_offsets[l], list_offsets[l + 1])
+        self.list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.codes = np.zeros((0, num_subspaces), dtype=np.uint8)
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @property
+    def is_trained(self):
+        return self.pq_centroids is not None
+
+    def _split(self, x):
+        return x.reshape(x.shape[0], self.num_subspaces, -1)
+
+    def train(self, features, num_iters=20, seed=0):
+        x = _prepare(features, self.metric)
+        self.coarse_centroids = kmeans(x, self.num_lists, num_iters, seed=seed)
+        residuals = self._split(
+            x - self.coarse_centroids[assign_clusters(x, self.coarse_centroids)]
+        )
+        self.pq_centroids = np.stack(
+            [
+                kmeans(
+                    np.ascontiguousarray(residuals[:, j]),
+                    self.num_codes,
+                    num_iters,
+                    seed=seed + j + 1,
+                )
+                for j in range(self.num_subspaces)
+            ]
+        )
+
+    def _encode(self, residuals):
+        residuals = self._split(residuals)
+        codes = np.empty((residuals.shape[0], self.num_subspaces), dtype=np.uint8)
+        for j in range(self.num_subspaces):
+            codes[:, j] = assign_clusters(
+                np.ascontiguousarray(residuals[:, j]), self.pq_centroids[j]
+            )
+        return codes
+
+    def add(self, features, ids=None):
+        assert self.is_trained, "train the index before adding features"
+        x = _prepare(features, self.metric)
+        if ids is None:
+            ids = np.arange(len(self), len(self) + x.shape[0], dtype=np.int64)
+        lists = assign_clusters(x, self.coarse_centroids)
+        codes = self._encode(x - self.coarse_centroids[lists])
+
+        # merge the new entries into the contiguous inverted lists
+        old_lists = np.repeat(np.arange(self.num_lists), np.diff(self.list_offsets))
+        all_lists = np.concatenate([old_lists, lists])
+        order = np.argsort(all_lists, kind="stable")
+        self.ids = np.concatenate([self.ids, ids])[order]
+        self.codes = np.concatenate([self.codes, codes])[order]
+        self.list_offsets[1:] = np.cumsum(
+            np.bincount(all_lists, minlength=self.num_lists)
+        )
+
+    def search(self, queries, k, nprobe=None):
+        """Returns ``(distances, ids)`` of shape ``(num_query, k)``, padded with
+        ``inf`` / -1 when the probed cells hold fewer than ``k`` entries."""
+        nprobe = min(nprobe or self.nprobe, self.num_lists)
+        q = _prepare(queries, self.metric)
+        coarse = _squared_l2(q, self.coarse_centroids)
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        dist = np.full((q.shape[0], k), np.inf, dtype=np.float32)
+        idx = np.full((q.shape[0], k), -1, dtype=np.int64)
+        # visit every cell once, with all the queries probing it
+        probe_queries = np.repeat(np.arange(q.shape[0]), nprobe)
+        probe_lists = probes.ravel()
+        order = np.argsort(probe_lists, kind="stable")
+        probe_queries, probe_lists = probe_queries[order], probe_lists[order]
+        bounds = np.searchsorted(probe_lists, np.arange(self.num_lists + 1))
+        pq_norms = np.square(self.pq_centroids).sum(axis=2)
+        for l in range(self.num_lists):
+            begin, end = self.list_offsets[l], self.list_offsets[l + 1]
+            if begin == end or bounds[l] == bounds[l + 1]:
+                continue
+            qs = probe_queries[bounds[l] : bounds[l + 1]]
+            codes = self.codes[begin:end]
+            # asymmetric distance: lookup table (subspaces, queries, codes)
+            residuals = self._split(q[qs] - self.coarse_centroids[l]).transpose(1, 0, 2)
+            lut = np.matmul(residuals, self.pq_centroids.transpose(0, 2, 1))
+            lut *= -2.0
+            lut += pq_norms[:, np.newaxis, :]
+            lut += np.square(residuals).sum(axis=2)[:, :, np.newaxis]
+            list_dist = np.zeros((len(qs), end - begin), dtype=np.float32)
+            for j in range(self.num_subspaces):
+                list_dist += lut[j][:, codes[:, j]]
+            list_k = min(k, end - begin)
+            part = np.argpartition(list_dist, list_k - 1, axis=1)[:, :list_k]
+            dist[qs], idx[qs] = merge_topk(
+                dist[qs],
+                idx[qs],
+                np.take_along_axis(list_dist, part, axis=1),
+                self.ids[begin:end][part],
+                k,
+            )
+        return _to_metric(dist, self.metric), idx
+
+    def save(self, path):
+        np.savez(
+            path,
+            config=np.array(
+                [
+                    self.dim,
+                    self.num_lists,
+                    self.num_subspaces,
+                    self.num_codes,
+                    self.nprobe,
+                ]
+            ),
+            metric=np.array(self.metric),
+            coarse_centroids=self.coarse_centroids,
+            pq_centroids=self.pq_centroids,
+            list_offsets=self.list_offsets,
+            ids=self.ids,
+            codes=self.codes,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        dim, num_lists, num_subspaces, num_codes, nprobe = data["config"].tolist()
+        index = cls(
+            dim,
+            num_lists=num_lists,
+            num_subspaces=num_subspaces,
+            num_bits=int(np.log2(num_codes)),
+            metric=str(data["metric"]),
+            nprobe=nprobe,
+        )
+        index.coarse_centroids = data["coarse_centroids"]
+        index.pq_centroids = data["pq_centroids"]
+        index.list_offsets = data["list_offsets"]
+        index.ids = data["ids"]
+        index.codes = data["codes"]
+        return index